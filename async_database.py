@@ -0,0 +1,158 @@
+import os
+from typing import Optional
+from sqlalchemy import select, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from database import Product, Category, DATABASE_URL, UPDATE_EXCLUDED, get_pool_options, build_products_query, \
+    PRODUCT_COLUMNS, product_options, category_options, check_category_parent, check_category_deletable
+import bulk_import
+import category_tree
+import change_log
+import partial_update
+import search
+import stock
+from pool_metrics import TimedAsyncAdaptedQueuePool
+
+# Async drivers used in place of the blocking ones configured in database.py
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+# Build the async database URL by swapping in the async driver
+def get_async_database_url():
+    url = make_url(DATABASE_URL)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+# Create the async database engine
+async_engine = create_async_engine(get_async_database_url(), poolclass=TimedAsyncAdaptedQueuePool, **get_pool_options())
+
+# Forked workers start with an empty pool, as for the sync engine in database.py
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=lambda: async_engine.sync_engine.dispose(close=False))
+
+# Create an async session maker; objects stay loaded after commit so handlers never lazy-load
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+# Function to get an async database session
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Async CRUD functions, mirroring the ones in database.py
+
+async def create_product(db: AsyncSession, product: Product):
+    db.add(product)
+    await db.commit()
+    await db.refresh(product)
+    return product
+
+async def get_products(db: AsyncSession, skip: int = 0, limit: int = 100, after_id: Optional[int] = None, include_category: bool = False,
+                       **filters):
+    query = build_products_query(skip=skip, limit=limit, after_id=after_id, **filters)
+    return (await db.scalars(query.options(*product_options(include_category)))).all()
+
+async def get_product_rows(db: AsyncSession, skip: int = 0, limit: int = 100, after_id: Optional[int] = None, **filters):
+    return (await db.execute(build_products_query(skip=skip, limit=limit, after_id=after_id, columns=PRODUCT_COLUMNS, **filters))).all()
+
+async def get_product_by_id(db: AsyncSession, product_id: int, include_category: bool = False):
+    return await db.scalar(select(Product).options(*product_options(include_category)).where(Product.id == product_id))
+
+async def get_product_modified_at(db: AsyncSession, product_id: int):
+    return await db.scalar(select(Product.modified_at).where(Product.id == product_id))
+
+async def get_products_by_ids(db: AsyncSession, product_ids: list, include_category: bool = False):
+    return (await db.scalars(select(Product).options(*product_options(include_category)).where(Product.id.in_(product_ids)))).all()
+
+async def get_products_by_skus(db: AsyncSession, skus: list, include_category: bool = False):
+    return (await db.scalars(select(Product).options(*product_options(include_category)).where(Product.sku.in_(skus)))).all()
+
+# Same as get_product_for_update in database.py
+async def get_product_for_update(db: AsyncSession, product_id: int):
+    if db.get_bind().dialect.name == "sqlite":
+        await db.execute(update(Product).where(Product.id == product_id).values(modified_at=Product.modified_at))
+    return await db.scalar(select(Product).where(Product.id == product_id).with_for_update().execution_options(populate_existing=True))
+
+async def update_product(db: AsyncSession, product_id: int, product_data):
+    db_product = await get_product_for_update(db, product_id)
+    if db_product:
+        for key, value in product_data.dict(exclude=UPDATE_EXCLUDED).items():
+            setattr(db_product, key, value)
+        await db.commit()
+        await db.refresh(db_product)
+    return db_product
+
+async def delete_product(db: AsyncSession, product_id: int):
+    db_product = await get_product_for_update(db, product_id)
+    if db_product:
+        await db.delete(db_product)
+        await db.commit()
+    return db_product
+
+async def create_category(db: AsyncSession, category: Category):
+    await db.run_sync(check_category_parent, category.id, category.parent_id)
+    db.add(category)
+    await db.commit()
+    await db.refresh(category)
+    return category
+
+async def get_categories(db: AsyncSession, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    query = select(Category).order_by(Category.id)
+    if after_id is not None:
+        # Keyset pagination: seek past the last seen id instead of scanning OFFSET rows
+        query = query.where(Category.id > after_id)
+    else:
+        query = query.offset(skip)
+    return (await db.scalars(query.limit(limit))).all()
+
+async def get_category_by_id(db: AsyncSession, category_id: int, include_products: bool = False):
+    return await db.scalar(select(Category).options(*category_options(include_products)).where(Category.id == category_id))
+
+async def get_category_modified_at(db: AsyncSession, category_id: int):
+    return await db.scalar(select(Category.modified_at).where(Category.id == category_id))
+
+async def update_category(db: AsyncSession, category_id: int, category_data):
+    db_category = await get_category_by_id(db, category_id)
+    if db_category:
+        await db.run_sync(check_category_parent, category_id, category_data.parent_id)
+        for key, value in category_data.dict(exclude=UPDATE_EXCLUDED).items():
+            setattr(db_category, key, value)
+        await db.commit()
+        await db.refresh(db_category)
+    return db_category
+
+# Partial updates share the single-statement UPDATE in partial_update.py
+async def patch_product(db: AsyncSession, product_id: int, changes: dict, expected_modified_at=None):
+    return await db.run_sync(partial_update.patch_product, product_id, changes, expected_modified_at)
+
+async def patch_category(db: AsyncSession, category_id: int, changes: dict, expected_modified_at=None):
+    return await db.run_sync(partial_update.patch_category, category_id, changes, expected_modified_at)
+
+# Bulk import shares the sync importer, run on the session's connection; file parsing happens between awaits
+async def import_products(db: AsyncSession, stream, **options):
+    return await db.run_sync(bulk_import.import_products, stream, **options)
+
+async def apply_stock_changes(db: AsyncSession, deltas: dict) -> list:
+    return await db.run_sync(stock.apply_stock_changes, deltas)
+
+async def search_products(db: AsyncSession, query: str, limit: int = 20):
+    return await db.run_sync(search.search_products, query, limit)
+
+async def get_category_tree(db: AsyncSession, root_id: Optional[int] = None):
+    return await db.run_sync(category_tree.get_category_tree, root_id)
+
+async def get_changes(db: AsyncSession, since: int, limit: int):
+    return await db.run_sync(change_log.get_changes, since, limit)
+
+# Reads a batch of the change feed in a session of its own, for streams that outlive a request
+async def load_changes(since: int, limit: int) -> dict:
+    async with AsyncSessionLocal() as db:
+        return await get_changes(db, since, limit)
+
+async def delete_category(db: AsyncSession, category_id: int):
+    db_category = await get_category_by_id(db, category_id)
+    if db_category:
+        await db.run_sync(check_category_deletable, category_id)
+        await db.delete(db_category)
+        await db.commit()
+    return db_category
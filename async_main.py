@@ -0,0 +1,375 @@
+import io
+import os
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, UploadFile, status
+from fastapi.responses import StreamingResponse
+from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from sqlalchemy import select, text
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Literal, Optional
+
+from models import Product as ProductSchema, Category as CategorySchema, ProductWithCategory, CategoryWithProducts, ProductBatch, \
+    ProductFilters, ProductSearchResults, Principal, Token, CategoryNode, ChangeFeed, ImportReport, StockChange, StockBatch, StockLevel, \
+    StockLevels, ProductUpdate, CategoryUpdate
+from auth import create_access_token, resolve_token, remember_principal, revoke_token, password_hasher, PasswordHasherBusy
+from database import Category, Product, User, PRODUCT_COLUMNS
+from async_database import async_engine, get_async_db, create_product, get_products, get_product_rows, get_product_by_id, \
+    get_product_modified_at, get_products_by_ids, get_products_by_skus, update_product, delete_product, create_category, \
+    get_categories, get_category_by_id, get_category_modified_at, update_category, delete_category, get_category_tree, \
+    get_changes, load_changes, import_products, search_products as find_products, apply_stock_changes, patch_product, patch_category
+from batch import parse_batch_keys, order_batch
+from pagination import get_after_id, get_after_position, get_keyset, set_next_cursor
+from pool_metrics import get_pool_metrics
+from bulk_import import detect_format, READERS, CHUNK_SIZE
+from http_cache import make_etag, item_etag, document_etag, list_etag, last_modified_of, is_conditional, is_not_modified, \
+    not_modified, set_cache_headers, write_precondition
+from cache import catalog_cache, product_key, category_key, to_cached
+from serialization import FastJSONResponse, rows_to_dicts, dumps
+import metrics
+import throttling
+from includes import related_tables, products_response
+from config import change_settings
+from change_log import ChangesPruned, stream_changes
+from export import export_products, accepts_gzip, FORMATS
+from replicas import reads_own_writes
+from stock import StockUnavailable
+from partial_update import ModifiedSinceRead
+from lifecycle import async_lifespan
+
+# Async variant of the API in main.py, served when `db_settings.use_async` is enabled.
+# Handlers run on the event loop and await the database instead of blocking a threadpool worker.
+
+app = FastAPI(lifespan=async_lifespan)
+throttling.install(app)
+# Installed last so that it is the outermost middleware and records every response, including 429s and coalesced reads
+metrics.install(app, async_engine.sync_engine)
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+
+# Dependency to get current user from token, querying the database only on a principal cache miss
+async def get_current_user(db: AsyncSession = Depends(get_async_db), token: str = Depends(oauth2_scheme)):
+    payload, user = resolve_token(token)
+    if payload is not None and user is None:
+        user = remember_principal(token, payload, await db.scalar(select(User).where(User.id == payload["user_id"])))
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid authentication credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
+
+# Check a password on the dedicated hashing threads, shedding load when they are saturated
+async def check_password(plain_password: str, hashed_password: str):
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Too many login attempts in progress", headers={"Retry-After": "1"})
+
+@app.post("/token", response_model=Token)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await db.scalar(select(User).where(User.username == form_data.username))
+    if not user or not await check_password(form_data.password, user.hashed_password):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect username or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    access_token = create_access_token(data={"user_id": user.id})
+    return {"access_token": access_token, "token_type": "bearer"}
+
+@app.post("/token/revoke", status_code=204)
+async def revoke_access_token(token: str = Depends(oauth2_scheme), current_user: Principal = Depends(get_current_user)):
+    revoke_token(token)
+
+# Serves rows as column tuples rendered straight to JSON, bypassing response_model validation
+@app.get("/products", response_model=List[ProductWithCategory], response_model_exclude_none=True, response_class=FastJSONResponse)
+async def list_products(request: Request, skip: int = 0, limit: int = 100, after: Optional[dict] = Depends(get_after_position),
+                        include: Optional[Literal["category"]] = None, filters: ProductFilters = Depends(),
+                        db: AsyncSession = Depends(get_async_db)):
+    after_id, after_key = get_keyset(after, filters.sort)
+    async def load():
+        if include == "category":
+            rows = await get_products(db, skip=skip, limit=limit, after_id=after_id, after_key=after_key, include_category=True,
+                                      **filters.model_dump())
+            return [to_cached(ProductWithCategory, row) for row in rows]
+        rows = await get_product_rows(db, skip=skip, limit=limit, after_id=after_id, after_key=after_key, **filters.model_dump())
+        return rows_to_dicts(PRODUCT_COLUMNS, rows)
+    cache_key = catalog_cache.list_key("products", *related_tables(include), skip=skip, limit=limit, after=after_id, after_key=after_key,
+                                       include=include, **filters.model_dump())
+    products = await catalog_cache.get_or_load_async(cache_key, load)
+    etag, last_modified = list_etag("products", products), last_modified_of(products)
+    if is_not_modified(request, etag, last_modified):
+        return not_modified(etag, last_modified)
+    response = FastJSONResponse(products)
+    set_cache_headers(response, etag, last_modified)
+    set_next_cursor(response, products, limit, sort=filters.sort)
+    return response
+
+@app.post("/products", response_model=ProductSchema)
+async def create_new_product(product: ProductSchema, db: AsyncSession = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
+    db_product = await create_product(db, Product(**product.dict()))
+    return db_product
+
+@app.post("/products/import", response_model=ImportReport)
+async def bulk_import_products(file: UploadFile, format: Optional[str] = None, chunk_size: int = CHUNK_SIZE, upsert: bool = True,
+                               create_categories: bool = True, db: AsyncSession = Depends(get_async_db),
+                               current_user: Principal = Depends(get_current_user)):
+    file_format = format or detect_format(file.filename or "")
+    if file_format not in READERS or chunk_size < 1:
+        raise HTTPException(status_code=400, detail="Unsupported import format or chunk size")
+    stream = io.TextIOWrapper(file.file, encoding="utf-8", newline="")
+    try:
+        report = await import_products(db, stream, file_format=file_format, chunk_size=chunk_size, upsert=upsert,
+                                       create_categories=create_categories)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Malformed import file: {e}")
+    finally:
+        stream.detach()
+    return report
+
+# The export generator is shared with main.py: it reads through the sync engine (or a read replica)
+# and StreamingResponse runs it on the threadpool, one batch at a time
+@app.get("/products/export")
+async def export_catalog(request: Request, format: Literal["ndjson", "csv"] = "ndjson", include: Optional[Literal["category"]] = None,
+                         gzip: Optional[bool] = None):
+    # Compress when asked explicitly, otherwise when the client accepts gzip
+    compress = accepts_gzip(request.headers.get("accept-encoding")) if gzip is None else gzip
+    headers = {"Content-Disposition": f'attachment; filename="products.{format}"', "Vary": "Accept-Encoding"}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(export_products(format, include_category=include == "category", compress=compress,
+                                             prefer_primary=reads_own_writes(request)),
+                             media_type=FORMATS[format], headers=headers)
+
+@app.get("/products/search", response_model=ProductSearchResults, response_model_exclude_none=True)
+async def search_products(q: str = Query(..., min_length=1, max_length=200), limit: int = Query(20, ge=1, le=100),
+                          include: Optional[Literal["category"]] = None, db: AsyncSession = Depends(get_async_db)):
+    product_ids, total = await find_products(db, q, limit=limit)
+    # Load the ranked hits in one query and put them back in rank order
+    rows = await get_products_by_ids(db, product_ids, include_category=include == "category") if product_ids else []
+    found = {product.id: product for product in rows}
+    return {"total": total, "products": products_response(include, [found[product_id] for product_id in product_ids if product_id in found])}
+
+@app.get("/products:batch", response_model=ProductBatch, response_model_exclude_none=True)
+async def retrieve_products_batch(ids: Optional[List[str]] = Query(None), skus: Optional[List[str]] = Query(None),
+                                  include: Optional[Literal["category"]] = None, db: AsyncSession = Depends(get_async_db)):
+    field, keys = parse_batch_keys(ids, skus)
+    # One IN query for the whole batch instead of a request per product
+    lookup = get_products_by_ids if field == "id" else get_products_by_skus
+    batch = order_batch(field, keys, await lookup(db, keys, include_category=include == "category"))
+    return {**batch, "products": products_response(include, batch["products"])}
+
+@app.get("/products/{product_id}", response_model=ProductWithCategory, response_model_exclude_none=True)
+async def retrieve_product(product_id: int, request: Request, response: Response, include: Optional[Literal["category"]] = None,
+                           db: AsyncSession = Depends(get_async_db)):
+    if include is None and is_conditional(request) and catalog_cache.peek(product_key(product_id)) is None:
+        # Revalidate from modified_at alone instead of loading the whole row
+        modified_at = await get_product_modified_at(db, product_id)
+        if modified_at is not None:
+            etag = item_etag("product", product_id, modified_at)
+            if is_not_modified(request, etag, modified_at):
+                return not_modified(etag, modified_at)
+    async def load():
+        if include == "category":
+            return to_cached(ProductWithCategory, await get_product_by_id(db, product_id, include_category=True))
+        return to_cached(ProductSchema, await get_product_by_id(db, product_id))
+    cache_key = catalog_cache.list_key("products", "categories", id=product_id, include=include) if include else product_key(product_id)
+    product = await catalog_cache.get_or_load_async(cache_key, load)
+    if product is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    etag, last_modified = document_etag("product", product), last_modified_of([product])
+    if is_not_modified(request, etag, last_modified):
+        return not_modified(etag, last_modified)
+    set_cache_headers(response, etag, last_modified)
+    return product
+
+@app.put("/products/{product_id}", response_model=ProductSchema)
+async def update_existing_product(product_id: int, product: ProductSchema, db: AsyncSession = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
+    updated_product = await update_product(db, product_id, product)
+    if updated_product is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return updated_product
+
+# The version an If-Match header is checked against, read only when the header is sent
+async def if_match_version(request: Request, load_modified_at):
+    return await load_modified_at() if request.headers.get("if-match") else None
+
+# Writes only the fields that were sent, in a single UPDATE. The update is conditional
+# on If-Match or on the modified_at in the body when either is given.
+@app.patch("/products/{product_id}", response_model=ProductSchema)
+async def patch_existing_product(product_id: int, changes: ProductUpdate, request: Request, response: Response,
+                                 db: AsyncSession = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
+    fields = changes.model_dump(exclude_unset=True, exclude={"modified_at"})
+    if not fields:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    current = await if_match_version(request, lambda: get_product_modified_at(db, product_id))
+    expected = write_precondition(request, "product", product_id, lambda: current, changes.modified_at)
+    try:
+        product = await patch_product(db, product_id, fields, expected)
+    except ModifiedSinceRead:
+        raise HTTPException(status_code=412, detail="The product was modified since it was read")
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="The sku or category conflicts with existing data")
+    if product is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    response.headers["ETag"] = item_etag("product", product_id, product.modified_at)
+    return product
+
+@app.delete("/products/{product_id}", response_model=ProductSchema)
+async def delete_existing_product(product_id: int, db: AsyncSession = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
+    deleted_product = await delete_product(db, product_id)
+    if deleted_product is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return deleted_product
+
+# Unknown products are reported as 404, changes that would oversell as 409
+def stock_error(error: StockUnavailable):
+    if error.missing:
+        return HTTPException(status_code=404, detail=f"Product not found: {', '.join(map(str, error.missing))}")
+    return HTTPException(status_code=409, detail=f"Insufficient stock or stock limit exceeded: {', '.join(map(str, error.insufficient))}")
+
+@app.post("/products/{product_id}/stock", response_model=StockLevel)
+async def change_product_stock(product_id: int, change: StockChange, db: AsyncSession = Depends(get_async_db),
+                               current_user: Principal = Depends(get_current_user)):
+    try:
+        return (await apply_stock_changes(db, {product_id: change.delta}))[0]
+    except StockUnavailable as e:
+        raise stock_error(e)
+
+@app.post("/products/stock:batch", response_model=StockLevels)
+async def change_stock_batch(batch: StockBatch, db: AsyncSession = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
+    # Lines for the same product are combined into one update
+    deltas = {}
+    for item in batch.items:
+        deltas[item.product_id] = deltas.get(item.product_id, 0) + item.delta
+    try:
+        return {"products": await apply_stock_changes(db, deltas)}
+    except StockUnavailable as e:
+        raise stock_error(e)
+
+@app.get("/categories", response_model=List[CategorySchema])
+async def list_categories(request: Request, response: Response, skip: int = 0, limit: int = 100, after_id: Optional[int] = Depends(get_after_id), db: AsyncSession = Depends(get_async_db)):
+    async def load():
+        return [to_cached(CategorySchema, row) for row in await get_categories(db, skip=skip, limit=limit, after_id=after_id)]
+    categories = await catalog_cache.get_or_load_async(catalog_cache.list_key("categories", skip=skip, limit=limit, after=after_id), load)
+    etag, last_modified = list_etag("categories", categories), last_modified_of(categories)
+    if is_not_modified(request, etag, last_modified):
+        return not_modified(etag, last_modified)
+    set_cache_headers(response, etag, last_modified)
+    set_next_cursor(response, categories, limit)
+    return categories
+
+@app.post("/categories", response_model=CategorySchema)
+async def create_new_category(category: CategorySchema, db: AsyncSession = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
+    try:
+        db_category = await create_category(db, Category(**category.dict()))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return db_category
+
+@app.get("/categories/tree", response_model=List[CategoryNode])
+async def read_category_tree(request: Request, response: Response, root: Optional[int] = None, db: AsyncSession = Depends(get_async_db)):
+    async def load():
+        return await get_category_tree(db, root)
+    tree = await catalog_cache.get_or_load_async(catalog_cache.list_key("categories", "products", tree=root), load)
+    if tree is None:
+        raise HTTPException(status_code=404, detail="Category not found")
+    etag = make_etag("category-tree", dumps(tree).decode())
+    if is_not_modified(request, etag, None):
+        return not_modified(etag, None)
+    set_cache_headers(response, etag, None)
+    return tree
+
+@app.get("/categories/{category_id}", response_model=CategoryWithProducts, response_model_exclude_none=True)
+async def retrieve_category(category_id: int, request: Request, response: Response, include: Optional[Literal["products"]] = None,
+                            db: AsyncSession = Depends(get_async_db)):
+    if include is None and is_conditional(request) and catalog_cache.peek(category_key(category_id)) is None:
+        # Revalidate from modified_at alone instead of loading the whole row
+        modified_at = await get_category_modified_at(db, category_id)
+        if modified_at is not None:
+            etag = item_etag("category", category_id, modified_at)
+            if is_not_modified(request, etag, modified_at):
+                return not_modified(etag, modified_at)
+    async def load():
+        if include == "products":
+            return to_cached(CategoryWithProducts, await get_category_by_id(db, category_id, include_products=True))
+        return to_cached(CategorySchema, await get_category_by_id(db, category_id))
+    cache_key = catalog_cache.list_key("categories", "products", id=category_id, include=include) if include else category_key(category_id)
+    category = await catalog_cache.get_or_load_async(cache_key, load)
+    if category is None:
+        raise HTTPException(status_code=404, detail="Category not found")
+    etag, last_modified = document_etag("category", category), last_modified_of([category])
+    if is_not_modified(request, etag, last_modified):
+        return not_modified(etag, last_modified)
+    set_cache_headers(response, etag, last_modified)
+    return category
+
+@app.put("/categories/{category_id}", response_model=CategorySchema)
+async def update_existing_category(category_id: int, category: CategorySchema, db: AsyncSession = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
+    try:
+        updated_category = await update_category(db, category_id, category)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if updated_category is None:
+        raise HTTPException(status_code=404, detail="Category not found")
+    return updated_category
+
+@app.patch("/categories/{category_id}", response_model=CategorySchema)
+async def patch_existing_category(category_id: int, changes: CategoryUpdate, request: Request, response: Response,
+                                  db: AsyncSession = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
+    fields = changes.model_dump(exclude_unset=True, exclude={"modified_at"})
+    if not fields:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    current = await if_match_version(request, lambda: get_category_modified_at(db, category_id))
+    expected = write_precondition(request, "category", category_id, lambda: current, changes.modified_at)
+    try:
+        category = await patch_category(db, category_id, fields, expected)
+    except ModifiedSinceRead:
+        raise HTTPException(status_code=412, detail="The category was modified since it was read")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if category is None:
+        raise HTTPException(status_code=404, detail="Category not found")
+    response.headers["ETag"] = item_etag("category", category_id, category.modified_at)
+    return category
+
+@app.delete("/categories/{category_id}", response_model=CategorySchema)
+async def delete_existing_category(category_id: int, db: AsyncSession = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
+    try:
+        deleted_category = await delete_category(db, category_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if deleted_category is None:
+        raise HTTPException(status_code=404, detail="Category not found")
+    return deleted_category
+
+@app.get("/changes", response_model=ChangeFeed, response_class=FastJSONResponse)
+async def read_changes(since: int = Query(0, ge=0), limit: int = Query(change_settings.batch_size, ge=1, le=change_settings.max_batch_size),
+                       db: AsyncSession = Depends(get_async_db)):
+    try:
+        return FastJSONResponse(await get_changes(db, since, limit))
+    except ChangesPruned:
+        raise HTTPException(status_code=410, detail="Changes after this sequence have been pruned, resync from /products")
+
+# The same feed as Server-Sent Events; reconnecting clients resume from Last-Event-ID
+@app.get("/changes/stream")
+async def stream_change_feed(request: Request, since: int = Query(0, ge=0),
+                             limit: int = Query(change_settings.batch_size, ge=1, le=change_settings.max_batch_size)):
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        since = int(last_event_id)
+    return StreamingResponse(stream_changes(since, limit, load=load_changes), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/admin/pool")
+async def read_pool_metrics(current_user: Principal = Depends(get_current_user)):
+    return {"primary": get_pool_metrics(async_engine.sync_engine.pool)}
+
+@app.get("/health")
+async def read_health(db: AsyncSession = Depends(get_async_db)):
+    try:
+        await db.execute(text("SELECT 1"))
+    except SQLAlchemyError:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    return {"status": "ok", "worker": os.getpid()}
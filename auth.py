@@ -1,10 +1,17 @@
+import asyncio
+import hashlib
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 import os
 from dotenv import load_dotenv
 from sqlalchemy.orm import Session
-from models import User
+from config import auth_settings, cache_settings
+from database import User
+from models import Principal
+from cache import MemoryBackend, build_backend
 
 load_dotenv()
 
@@ -12,7 +19,17 @@ SECRET_KEY = os.environ.get("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=auth_settings.bcrypt_rounds)
+
+# Verified principals and revocations are shared by all workers when the cache uses Redis,
+# otherwise they are kept per process. Revocations get their own store so principals can
+# never evict them; it has no size bound, as evicting a live revocation would reinstate a
+# token, and is kept small by dropping revocations once the tokens they cover have expired.
+if cache_settings.backend == "redis":
+    principal_backend = revocation_backend = build_backend(cache_settings)
+else:
+    principal_backend = MemoryBackend(cache_settings.max_entries)
+    revocation_backend = MemoryBackend(sys.maxsize)
 
 def hash_password(password: str):
     return pwd_context.hash(password)
@@ -20,10 +37,40 @@ def hash_password(password: str):
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
+class PasswordHasherBusy(Exception):
+    """Raised when too many password checks are already waiting for a worker"""
+
+class PasswordHasher:
+    """Runs bcrypt on a small dedicated thread pool so login bursts cannot take over the request threadpool"""
+
+    def __init__(self, workers: int, max_pending: int):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hasher")
+        self.max_pending = max_pending
+        self.pending = 0
+
+    async def run(self, function, *args):
+        # Only touched from the event loop thread, so a plain counter is enough
+        if self.pending >= self.max_pending:
+            raise PasswordHasherBusy()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+        finally:
+            self.pending -= 1
+
+    async def verify(self, plain_password, hashed_password):
+        return await self.run(verify_password, plain_password, hashed_password)
+
+    async def hash(self, password: str):
+        return await self.run(hash_password, password)
+
+password_hasher = PasswordHasher(auth_settings.hash_workers, auth_settings.hash_max_pending)
+
 def create_access_token(data: dict):
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire.timestamp()})
+    issued = datetime.utcnow()
+    expire = issued + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.update({"exp": expire.timestamp(), "iat": issued.timestamp()})
     encoded_token = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_token
 
@@ -34,10 +81,56 @@ def decode_token(token: str):
     except JWTError:
         return None
 
-def get_current_user_from_token(db: Session, token: str):
+def get_user_by_username(db: Session, username: str):
+    return db.query(User).filter(User.username == username).first()
+
+# Tokens are stored hashed so cache keys never expose usable credentials
+def token_key(token: str):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+# Seconds until the token expires
+def remaining_lifetime(payload: dict) -> int:
+    return max(int(payload.get("exp", 0) - datetime.utcnow().timestamp()), 0)
+
+def is_revoked(token: str, payload: dict):
+    if revocation_backend.get("revoked-token:" + token_key(token)):
+        return True
+    revoked_at = revocation_backend.get(f"revoked-user:{payload.get('user_id')}")
+    return revoked_at is not None and payload.get("iat", 0) <= revoked_at
+
+# Revoke a single token until it would have expired anyway
+def revoke_token(token: str):
     payload = decode_token(token)
     if payload:
-        user_id = payload.get("user_id")
-        if user_id:
-            return db.query(User).filter(User.id == user_id).first()
-    return None
+        revocation_backend.set("revoked-token:" + token_key(token), True, remaining_lifetime(payload) + 1)
+        principal_backend.delete("principal:" + token_key(token))
+
+# Revoke every token issued to a user so far, e.g. after a password change
+def revoke_user_tokens(user_id: int):
+    revocation_backend.set(f"revoked-user:{user_id}", datetime.utcnow().timestamp(), ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+# Decode a token and look up its cached principal.
+# Returns (None, None) for invalid or revoked tokens and (payload, None) when the user must be loaded.
+def resolve_token(token: str):
+    payload = decode_token(token)
+    if not payload or not payload.get("user_id") or is_revoked(token, payload):
+        return None, None
+    cached = principal_backend.get("principal:" + token_key(token))
+    return payload, None if cached is None else Principal(**cached)
+
+# Cache the user a token resolved to, for no longer than the token stays valid
+def remember_principal(token: str, payload: dict, user):
+    if user is None:
+        return None
+    principal = Principal.model_validate(user)
+    ttl = min(auth_settings.principal_ttl, remaining_lifetime(payload))
+    if ttl > 0:
+        principal_backend.set("principal:" + token_key(token), principal.model_dump(), ttl)
+    return principal
+
+def get_current_user_from_token(db: Session, token: str):
+    payload, principal = resolve_token(token)
+    if payload is None or principal is not None:
+        return principal
+    user = db.query(User).filter(User.id == payload["user_id"]).first()
+    return remember_principal(token, payload, user)
@@ -0,0 +1,30 @@
+from typing import List, Optional
+from fastapi import HTTPException
+
+# Helpers for fetching many products in one request.
+# Keys arrive as comma separated lists (?ids=1,2,3), repeated parameters, or both.
+
+MAX_BATCH_SIZE = 100
+
+# Validate the batch query and return the lookup column name with its keys, in request order
+def parse_batch_keys(ids: Optional[List[str]], skus: Optional[List[str]]):
+    if bool(ids) == bool(skus):
+        raise HTTPException(status_code=400, detail="Provide either ids or skus")
+    field, values = ("id", ids) if ids else ("sku", skus)
+    keys = list(dict.fromkeys(key.strip() for value in values for key in value.split(",") if key.strip()))
+    if not keys or len(keys) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Provide between 1 and {MAX_BATCH_SIZE} keys")
+    if field == "id":
+        try:
+            keys = [int(key) for key in keys]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Product ids must be integers")
+    return field, keys
+
+# Arrange the fetched rows in request order and list the keys that were not found
+def order_batch(field: str, keys: list, rows: list):
+    found = {getattr(row, field): row for row in rows}
+    return {
+        "products": [found[key] for key in keys if key in found],
+        "missing": [key for key in keys if key not in found],
+    }
@@ -0,0 +1,309 @@
+import argparse
+import csv
+import io
+import json
+import time
+from datetime import datetime
+from itertools import islice
+from sqlalchemy import insert, select
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.orm import Session
+from pydantic import ValidationError
+from database import Product, Category
+from models import ProductImport
+from cache import mark_changed
+from search import stage_products
+from category_tree import apply_product_changes
+from change_log import record_changes
+
+# Bulk product import.
+# Files are parsed as a stream of rows, validated, and written in chunks: one
+# multi-row INSERT (or upsert by sku) and one commit per chunk, instead of a
+# commit and refresh per product.
+
+CHUNK_SIZE = 1000
+READ_SIZE = 64 * 1024
+MAX_REPORTED_ERRORS = 1000
+
+class JSONArrayReader:
+    """Decodes the items of a JSON array one at a time from a text stream"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        chunk = self.stream.read(READ_SIZE)
+        if not chunk:
+            self.eof = True
+        # Drop consumed text so memory stays bounded by the largest item
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self.fill()
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at offset {self.pos}")
+        self.pos += 1
+
+    def decode(self):
+        self.peek()
+        decoder = json.JSONDecoder()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buffer, self.pos)
+                # A value that ends at the buffer edge (e.g. a number) may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def items(self):
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.decode()
+            if self.peek() == "]":
+                self.pos += 1
+                return
+            self.expect(",")
+
+# Stream the products of a JSON file: either a top level array or an object with a
+# "products" array, like electronic-catalog.json. Other top level keys are skipped.
+def iter_json(stream, key: str = "products"):
+    reader = JSONArrayReader(stream)
+    if reader.peek() == "[":
+        yield from reader.items()
+        return
+    reader.expect("{")
+    while reader.peek() != "}":
+        name = reader.decode()
+        reader.expect(":")
+        if name == key:
+            yield from reader.items()
+        else:
+            reader.decode()
+        if reader.peek() == ",":
+            reader.pos += 1
+    reader.expect("}")
+
+class MalformedRow:
+    """A row that could not be decoded, reported as a failed row in place of its values"""
+
+    def __init__(self, error: str):
+        self.error = error
+
+# Lines are independent, so one that is not valid JSON fails alone instead of ending the import
+def iter_ndjson(stream):
+    for line in stream:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                yield MalformedRow(f"Invalid JSON: {e}")
+
+def iter_csv(stream):
+    for row in csv.DictReader(stream):
+        # Empty cells mean "not provided"
+        yield {key: value for key, value in row.items() if value not in ("", None)}
+
+READERS = {
+    "json": iter_json,
+    "ndjson": iter_ndjson,
+    "csv": iter_csv,
+}
+
+# Guess the file format from its name
+def detect_format(filename: str) -> str:
+    extension = filename.rsplit(".", 1)[-1].lower()
+    if extension in ("ndjson", "jsonl"):
+        return "ndjson"
+    if extension == "csv":
+        return "csv"
+    return "json"
+
+# Build a multi-row INSERT, turned into an upsert on sku where the dialect supports it
+def build_insert(db: Session, rows: list, upsert: bool):
+    dialect = db.get_bind().dialect.name
+    updated = ("name", "category_id", "price", "quantity", "modified_at")
+    if upsert and dialect == "mysql":
+        statement = mysql.insert(Product).values(rows)
+        return statement.on_duplicate_key_update({column: statement.inserted[column] for column in updated})
+    if upsert and dialect == "sqlite":
+        statement = sqlite.insert(Product).values(rows)
+        return statement.on_conflict_do_update(
+            index_elements=[Product.sku],
+            set_={column: statement.excluded[column] for column in updated},
+        )
+    return insert(Product).values(rows)
+
+class ProductImporter:
+    def __init__(self, db: Session, chunk_size: int = CHUNK_SIZE, upsert: bool = True, create_categories: bool = True):
+        self.db = db
+        self.chunk_size = chunk_size
+        self.upsert = upsert
+        self.create_categories = create_categories
+        # Prefetch every category once instead of resolving names row by row
+        self.categories = dict(db.execute(select(Category.name, Category.id)).all())
+        self.processed = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def fail(self, row_number: int, sku, error: str):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row_number, "sku": sku, "error": error})
+
+    def resolve_category(self, name: str):
+        category_id = self.categories.get(name)
+        if category_id is None and self.create_categories:
+            category = Category(name=name)
+            self.db.add(category)
+            self.db.commit()
+            category_id = self.categories[name] = category.id
+        return category_id
+
+    def to_row(self, row_number: int, raw: dict):
+        if isinstance(raw, MalformedRow):
+            self.fail(row_number, None, raw.error)
+            return None
+        try:
+            item = ProductImport.model_validate(raw)
+        except ValidationError as e:
+            errors = "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+            self.fail(row_number, raw.get("sku") if isinstance(raw, dict) else None, errors)
+            return None
+        category_id = item.category_id
+        if category_id is None and item.category is not None:
+            category_id = self.resolve_category(item.category)
+        if category_id is None:
+            self.fail(row_number, item.sku, f"Unknown category: {item.category}")
+            return None
+        now = datetime.utcnow()
+        return {
+            "name": item.name,
+            "category_id": category_id,
+            "sku": item.sku,
+            "price": item.price,
+            "quantity": item.quantity,
+            "created_at": now,
+            "modified_at": now,
+        }
+
+    def write(self, numbered_rows: list):
+        # The last occurrence of a sku within a chunk wins
+        rows = {row["sku"]: (row_number, row) for row_number, row in numbered_rows}
+        try:
+            previous = self.previous_values(rows)
+            self.db.execute(build_insert(self.db, [row for _, row in rows.values()], self.upsert))
+            self.record_changes(rows, previous)
+            self.db.commit()
+            self.imported += len(rows)
+        except Exception:
+            self.db.rollback()
+            # Retry the chunk row by row to report exactly which rows failed
+            for row_number, row in rows.values():
+                try:
+                    previous = self.previous_values({row["sku"]: (row_number, row)})
+                    self.db.execute(build_insert(self.db, [row], self.upsert))
+                    self.record_changes({row["sku"]: (row_number, row)}, previous)
+                    self.db.commit()
+                    self.imported += 1
+                except Exception as e:
+                    self.db.rollback()
+                    self.fail(row_number, row["sku"], str(getattr(e, "orig", e)))
+
+    # Category, price and quantity of the products an upsert is about to overwrite, by sku
+    def previous_values(self, rows: dict) -> dict:
+        existing = self.db.execute(
+            select(Product.sku, Product.category_id, Product.price, Product.quantity).where(Product.sku.in_(list(rows)))
+        ).all()
+        return {row.sku: (row.category_id, row.price, row.quantity) for row in existing}
+
+    def record_changes(self, rows: dict, previous: dict):
+        written = self.db.execute(
+            select(Product.id, Product.name, Product.sku, Product.category_id).where(Product.sku.in_(list(rows)))
+        ).all()
+        mark_changed(self.db, Product, [row.id for row in written])
+        stage_products(self.db, written)
+        apply_product_changes(self.db.connection(), [
+            (previous.get(sku), (row["category_id"], row["price"], row["quantity"])) for sku, (_, row) in rows.items()
+        ])
+        record_changes(self.db.connection(), "product", [row.id for row in written if row.sku not in previous], "insert")
+        record_changes(self.db.connection(), "product", [row.id for row in written if row.sku in previous], "update")
+
+    def run(self, items) -> dict:
+        start = time.perf_counter()
+        numbered = enumerate(items, start=1)
+        while True:
+            chunk = list(islice(numbered, self.chunk_size))
+            if not chunk:
+                break
+            self.processed += len(chunk)
+            rows = []
+            for row_number, raw in chunk:
+                row = self.to_row(row_number, raw)
+                if row is not None:
+                    rows.append((row_number, row))
+            if rows:
+                self.write(rows)
+        seconds = time.perf_counter() - start
+        return {
+            "processed": self.processed,
+            "imported": self.imported,
+            "failed": self.failed,
+            "errors": self.errors,
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(self.processed / seconds, 1) if seconds else 0.0,
+        }
+
+# Import products from a text stream in the given format
+def import_products(db: Session, stream, file_format: str = "json", chunk_size: int = CHUNK_SIZE,
+                    upsert: bool = True, create_categories: bool = True) -> dict:
+    if file_format not in READERS:
+        raise ValueError(f"Unsupported format: {file_format}")
+    importer = ProductImporter(db, chunk_size=chunk_size, upsert=upsert, create_categories=create_categories)
+    return importer.run(READERS[file_format](stream))
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import products from a JSON, NDJSON or CSV file")
+    parser.add_argument("path", help="File to import, e.g. electronic-catalog.json")
+    parser.add_argument("--format", choices=sorted(READERS), help="File format (detected from the extension by default)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Rows per INSERT statement and commit")
+    parser.add_argument("--no-upsert", action="store_true", help="Fail rows whose sku already exists instead of updating them")
+    parser.add_argument("--no-create-categories", action="store_true", help="Fail rows whose category does not exist")
+    args = parser.parse_args()
+
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        with io.open(args.path, encoding="utf-8", newline="") as stream:
+            report = import_products(
+                db,
+                stream,
+                file_format=args.format or detect_format(args.path),
+                chunk_size=args.chunk_size,
+                upsert=not args.no_upsert,
+                create_categories=not args.no_create_categories,
+            )
+    finally:
+        db.close()
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
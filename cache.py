@@ -0,0 +1,278 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from itertools import chain
+from typing import Any, Callable, Optional
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+from config import cache_settings, change_settings
+from database import Product, Category, Change
+from change_log import get_changes, ChangesPruned
+
+# Read-through cache for catalog lookups.
+# Single rows are cached under "product:<id>" / "category:<id>". Listings are cached
+# under a per-table generation number, so one increment invalidates every cached page.
+# A single row is only stored if its table's generation did not move while it loaded.
+# Keys are collected from the session when Product/Category rows are flushed and are
+# invalidated only once the transaction commits. The memory backend only sees its own
+# worker's commits, so each worker also follows the change feed (ChangeFollower) and
+# invalidates what the other workers wrote.
+
+class MemoryBackend:
+    """In-process LRU cache with per-entry expiry"""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # Generations live outside the LRU so eviction can never roll them back
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def get(self, key: str):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl: int):
+        with self.lock:
+            now = time.monotonic()
+            self.entries[key] = (value, now + ttl)
+            self.entries.move_to_end(key)
+            # Drop expired entries from the old end, so keys that are never read again do not pile up
+            while self.entries:
+                oldest = next(iter(self.entries))
+                if self.entries[oldest][1] >= now:
+                    break
+                del self.entries[oldest]
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, *keys: str):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def get_generation(self, name: str) -> int:
+        with self.lock:
+            return self.generations.get(name, 0)
+
+    def bump_generation(self, name: str):
+        with self.lock:
+            self.generations[name] = self.generations.get(name, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.generations.clear()
+
+class RedisBackend:
+    """Cache shared by every worker, on any Redis-compatible client"""
+
+    def __init__(self, client, prefix: str = "catalog:"):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key: str):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key: str, value, ttl: int):
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl)
+
+    def delete(self, *keys: str):
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+    def get_generation(self, name: str) -> int:
+        return int(self.client.get(self.prefix + "generation:" + name) or 0)
+
+    def bump_generation(self, name: str):
+        self.client.incr(self.prefix + "generation:" + name)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + "*"))
+        if keys:
+            self.client.delete(*keys)
+
+class NullBackend:
+    """Disables caching; every lookup goes to the database"""
+
+    def get(self, key: str):
+        return None
+
+    def set(self, key: str, value, ttl: int):
+        pass
+
+    def delete(self, *keys: str):
+        pass
+
+    def get_generation(self, name: str) -> int:
+        return 0
+
+    def bump_generation(self, name: str):
+        pass
+
+    def clear(self):
+        pass
+
+LAST_WRITE_KEY = "last-write"
+# Tables of single-row keys ("product:<id>"), whose keys carry no generation of their own
+ROW_TABLES = {"product": "products", "category": "categories"}
+
+class CatalogCache:
+    def __init__(self, backend, ttl: int = 60):
+        self.backend = backend
+        self.ttl = ttl
+
+    # Keys of listings and embedded documents change whenever one of the tables they read from does
+    def list_key(self, table: str, *related: str, **params) -> str:
+        generation = ".".join(str(self.backend.get_generation(name)) for name in (table, *related))
+        query = "&".join(f"{name}={params[name]}" for name in sorted(params))
+        return f"{table}:list:{generation}:{query}"
+
+    def peek(self, key: str):
+        return self.backend.get(key)
+
+    # Generation of the table behind a single-row key, None for keys that embed their generations
+    def row_generation(self, key: str) -> Optional[int]:
+        table = ROW_TABLES.get(key.partition(":")[0])
+        return None if table is None else self.backend.get_generation(table)
+
+    # Store a loaded row unless its table was written while it loaded: the load may have read the
+    # row before that write committed, after the write had already invalidated the key
+    def fill(self, key: str, value, generation: Optional[int]):
+        if generation is None or self.row_generation(key) == generation:
+            self.backend.set(key, value, self.ttl)
+
+    # fill=False serves a miss without storing it, for reads that may be older than what is cached;
+    # refresh=True loads the value even when one is cached, for reads that must see the latest writes
+    def get_or_load(self, key: str, loader: Callable[[], Any], fill: bool = True, refresh: bool = False):
+        value = None if refresh else self.backend.get(key)
+        if value is None:
+            generation = self.row_generation(key)
+            value = loader()
+            if value is not None and fill:
+                self.fill(key, value, generation)
+        return value
+
+    async def get_or_load_async(self, key: str, loader: Callable[[], Any]):
+        value = self.backend.get(key)
+        if value is None:
+            generation = self.row_generation(key)
+            value = await loader()
+            if value is not None:
+                self.fill(key, value, generation)
+        return value
+
+    def invalidate(self, keys: set, tables: set):
+        self.backend.delete(*keys)
+        for table in tables:
+            self.backend.bump_generation(table)
+        self.note_write()
+
+    # Wall-clock time of the latest write invalidated here, by this process or (through the shared backend
+    # or the change feed) by any other; replica reads shortly after it are not cached
+    def note_write(self):
+        self.backend.set(LAST_WRITE_KEY, time.time(), self.ttl)
+
+    def last_write(self) -> float:
+        return self.backend.get(LAST_WRITE_KEY) or 0.0
+
+def build_backend(settings):
+    if settings.backend == "memory":
+        return MemoryBackend(settings.max_entries)
+    if settings.backend == "redis":
+        import redis
+        return RedisBackend(redis.Redis.from_url(settings.redis_url))
+    return NullBackend()
+
+catalog_cache = CatalogCache(build_backend(cache_settings), ttl=cache_settings.ttl)
+
+# Cache keys for single rows
+def product_key(product_id: int) -> str:
+    return f"product:{product_id}"
+
+def category_key(category_id: int) -> str:
+    return f"category:{category_id}"
+
+# Convert an ORM row into the JSON-safe dict that is cached and returned
+def to_cached(schema, row) -> Optional[dict]:
+    if row is None:
+        return None
+    return schema.model_validate(row).model_dump(mode="json")
+
+CACHED_TABLES = {
+    Product: ("products", product_key),
+    Category: ("categories", category_key),
+}
+
+# Record rows changed outside the ORM unit of work (e.g. bulk Core statements)
+# so they are invalidated when the session commits
+def mark_changed(session, model, ids):
+    table, key = CACHED_TABLES[model]
+    session.info.setdefault("cache_keys", set()).update(key(row_id) for row_id in ids)
+    session.info.setdefault("cache_tables", set()).add(table)
+
+@event.listens_for(Session, "after_flush")
+def collect_invalidations(session, flush_context):
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if type(obj) in CACHED_TABLES:
+            mark_changed(session, type(obj), [obj.id])
+
+@event.listens_for(Session, "after_commit")
+def apply_invalidations(session):
+    keys = session.info.pop("cache_keys", set())
+    tables = session.info.pop("cache_tables", set())
+    if keys or tables:
+        catalog_cache.invalidate(keys, tables)
+
+@event.listens_for(Session, "after_rollback")
+def discard_invalidations(session):
+    session.info.pop("cache_keys", None)
+    session.info.pop("cache_tables", None)
+
+CHANGED_KINDS = {"product": CACHED_TABLES[Product], "category": CACHED_TABLES[Category]}
+
+class ChangeFollower:
+    """Invalidates the entries changed by any process, reading the change feed from the last sequence it saw"""
+
+    def __init__(self, cache: CatalogCache):
+        self.cache = cache
+        self.sequence = None
+
+    # Starts from the latest sequence, since writes before it were committed before anything was cached
+    def start(self, db: Session):
+        self.sequence = db.scalar(select(func.max(Change.id))) or 0
+
+    def catch_up(self, db: Session):
+        if self.sequence is None:
+            self.start(db)
+            return
+        while True:
+            try:
+                feed = get_changes(db, self.sequence, change_settings.max_batch_size)
+            except ChangesPruned:
+                # Too far behind to tell what changed; start over from an empty cache
+                self.start(db)
+                self.cache.backend.clear()
+                return
+            keys, tables = set(), set()
+            for change in feed["changes"]:
+                table, key = CHANGED_KINDS[change["kind"]]
+                keys.add(key(change["id"]))
+                tables.add(table)
+            if keys:
+                self.cache.invalidate(keys, tables)
+            self.sequence = feed["next"]
+            if not feed["has_more"]:
+                return
+
+change_follower = ChangeFollower(catalog_cache)
@@ -0,0 +1,217 @@
+import argparse
+import json
+from collections import defaultdict
+from itertools import chain
+from typing import Optional
+from sqlalchemy import delete, event, func, insert, inspect, literal, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from database import Category, CategoryStats, CategoryStock, Product
+
+# Category hierarchy and per-category aggregates.
+# Categories form a tree through parent_id, with a materialized path ("/1/5/")
+# for subtree lookups. category_stats holds the product count, total stock and
+# price range of the products directly in each category. It is maintained in the
+# same transaction as every product write: ORM writes are picked up at flush time
+# like the cache and search hooks, and Core writes (bulk import, stock changes,
+# partial updates) report their changes through the functions below. Counts and
+# stock are applied as deltas; a price range is re-read with MIN/MAX, which the
+# (category_id, price) index answers without scanning the category.
+# Stock changes (checkouts) only move stock, and would all queue on the one stats row
+# of a busy category until their transactions commit. They add to one of
+# STOCK_SHARDS category_stock rows instead, picked by product id, so checkouts of
+# different products rarely wait on each other; the tree sums the shards back in.
+# The tree endpoint then rolls these up in O(categories) instead of O(products).
+
+STATS_COLUMNS = ("product_count", "total_stock", "min_price", "max_price")
+STOCK_SHARDS = 16
+
+def stock_shards(category_ids) -> list:
+    return [{"category_id": category_id, "shard": shard, "stock_delta": 0} for category_id in category_ids for shard in range(STOCK_SHARDS)]
+
+# The fields of a product that feed the aggregates, before and after a change
+def snapshot(product) -> tuple:
+    return product.category_id, product.price, product.quantity
+
+def previous_snapshot(product) -> tuple:
+    state = inspect(product)
+    values = []
+    for name in ("category_id", "price", "quantity"):
+        history = state.attrs[name].history
+        values.append(history.deleted[0] if history.deleted else getattr(product, name))
+    return tuple(values)
+
+def price_range(category_id: int):
+    return (select(func.min(Product.price)).where(Product.category_id == category_id).scalar_subquery(),
+            select(func.max(Product.price)).where(Product.category_id == category_id).scalar_subquery())
+
+# Recompute the aggregates of some categories from their products
+def refresh_category_stats(connection, category_ids):
+    category_ids = sorted({category_id for category_id in category_ids if category_id is not None})
+    if not category_ids:
+        return
+    existing = connection.execute(select(Category.id).where(Category.id.in_(category_ids))).scalars().all()
+    totals = {row.category_id: row for row in connection.execute(
+        select(Product.category_id, func.count().label("product_count"), func.coalesce(func.sum(Product.quantity), 0).label("total_stock"),
+               func.min(Product.price).label("min_price"), func.max(Product.price).label("max_price"))
+        .where(Product.category_id.in_(existing)).group_by(Product.category_id)
+    )}
+    connection.execute(delete(CategoryStats).where(CategoryStats.category_id.in_(category_ids)))
+    connection.execute(delete(CategoryStock).where(CategoryStock.category_id.in_(category_ids)))
+    rows = []
+    for category_id in existing:
+        row = totals.get(category_id)
+        rows.append({"category_id": category_id, **({column: getattr(row, column) for column in STATS_COLUMNS} if row
+                                                     else {"product_count": 0, "total_stock": 0, "min_price": None, "max_price": None})})
+    if rows:
+        connection.execute(insert(CategoryStats), rows)
+        connection.execute(insert(CategoryStock), stock_shards(existing))
+
+# Apply product changes given as (before, after) snapshots, None for a created or deleted product
+def apply_product_changes(connection, changes):
+    counts, stock, prices = defaultdict(int), defaultdict(int), set()
+    for before, after in changes:
+        if before == after:
+            continue
+        if before is not None and before[0] is not None:
+            counts[before[0]] -= 1
+            stock[before[0]] -= before[2]
+        if after is not None and after[0] is not None:
+            counts[after[0]] += 1
+            stock[after[0]] += after[2]
+        if before is None or after is None or before[:2] != after[:2]:
+            prices.update(values[0] for values in (before, after) if values is not None and values[0] is not None)
+    missing = []
+    # A fixed order keeps concurrent writers from deadlocking on the stats rows
+    for category_id in sorted(set(counts) | prices):
+        values = {}
+        if counts[category_id]:
+            values["product_count"] = CategoryStats.product_count + counts[category_id]
+        if stock[category_id]:
+            values["total_stock"] = CategoryStats.total_stock + stock[category_id]
+        if category_id in prices:
+            values["min_price"], values["max_price"] = price_range(category_id)
+        if values and connection.execute(update(CategoryStats).where(CategoryStats.category_id == category_id).values(**values)).rowcount == 0:
+            missing.append(category_id)
+    # Categories created before the aggregates existed are computed in full once
+    refresh_category_stats(connection, missing)
+
+# Stock changes only move totals; rows are (product_id, category_id, quantity delta)
+def apply_stock_deltas(connection, rows):
+    deltas = defaultdict(int)
+    for product_id, category_id, delta in rows:
+        if category_id is not None:
+            deltas[category_id, product_id % STOCK_SHARDS] += delta
+    missing = set()
+    for category_id, shard in sorted(deltas):
+        delta = deltas[category_id, shard]
+        if delta and connection.execute(
+            update(CategoryStock).where(CategoryStock.category_id == category_id, CategoryStock.shard == shard)
+            .values(stock_delta=CategoryStock.stock_delta + delta)
+        ).rowcount == 0:
+            missing.add(category_id)
+    refresh_category_stats(connection, missing)
+
+def category_path(connection, category_id: int, parent_id: Optional[int]) -> str:
+    parent_path = connection.execute(select(Category.path).where(Category.id == parent_id)).scalar() if parent_id is not None else None
+    return f"{parent_path or '/'}{category_id}/"
+
+# Point a category and its whole subtree at a new path prefix, returning the category's new path
+def move_category(connection, category_id: int, old_path: Optional[str], parent_id: Optional[int]) -> str:
+    old_path = old_path or f"/{category_id}/"
+    new_path = category_path(connection, category_id, parent_id)
+    connection.execute(
+        update(Category).where(Category.path.startswith(old_path, autoescape=True))
+        .values(path=literal(new_path) + func.substr(Category.path, len(old_path) + 1))
+    )
+    connection.execute(update(Category).where(Category.id == category_id).values(path=new_path))
+    return new_path
+
+@event.listens_for(Session, "after_flush")
+def maintain_category_tree(session, flush_context):
+    changes = []
+    connection = None
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Product):
+            before = None if obj in session.new else previous_snapshot(obj)
+            after = None if obj in session.deleted else snapshot(obj)
+            changes.append((before, after))
+        elif isinstance(obj, Category):
+            connection = connection or session.connection()
+            if obj in session.new:
+                path = category_path(connection, obj.id, obj.parent_id)
+                connection.execute(update(Category).where(Category.id == obj.id).values(path=path))
+                set_committed_value(obj, "path", path)
+                connection.execute(insert(CategoryStats).values(category_id=obj.id, product_count=0, total_stock=0))
+                connection.execute(insert(CategoryStock), stock_shards([obj.id]))
+            elif obj in session.deleted:
+                connection.execute(delete(CategoryStats).where(CategoryStats.category_id == obj.id))
+                connection.execute(delete(CategoryStock).where(CategoryStock.category_id == obj.id))
+            elif inspect(obj).attrs.parent_id.history.has_changes():
+                set_committed_value(obj, "path", move_category(connection, obj.id, obj.path, obj.parent_id))
+    if changes:
+        apply_product_changes(connection or session.connection(), changes)
+
+# Nested categories with aggregates over each whole subtree, optionally below one category
+def get_category_tree(db: Session, root_id: Optional[int] = None):
+    query = select(Category.id, Category.name, Category.parent_id, *(getattr(CategoryStats, column) for column in STATS_COLUMNS))
+    stock = select(CategoryStock.category_id, func.sum(CategoryStock.stock_delta).label("stock_delta")).group_by(CategoryStock.category_id).subquery()
+    query = query.add_columns(stock.c.stock_delta).outerjoin(CategoryStats, CategoryStats.category_id == Category.id) \
+        .outerjoin(stock, stock.c.category_id == Category.id)
+    if root_id is not None:
+        root_path = db.scalar(select(Category.path).where(Category.id == root_id))
+        if root_path is None:
+            return None
+        query = query.where(Category.path.startswith(root_path, autoescape=True))
+    nodes = {}
+    for row in db.execute(query):
+        nodes[row.id] = {"id": row.id, "name": row.name, "parent_id": row.parent_id, "product_count": row.product_count or 0,
+                         "total_stock": (row.total_stock or 0) + (row.stock_delta or 0), "min_price": row.min_price, "max_price": row.max_price, "children": []}
+    roots = []
+    for node in nodes.values():
+        parent = nodes.get(node["parent_id"]) if node["id"] != root_id else None
+        (parent["children"] if parent else roots).append(node)
+
+    def roll_up(node):
+        for child in node["children"]:
+            roll_up(child)
+            node["product_count"] += child["product_count"]
+            node["total_stock"] += child["total_stock"]
+            for column, pick in (("min_price", min), ("max_price", max)):
+                values = [value for value in (node[column], child[column]) if value is not None]
+                node[column] = pick(values) if values else None
+        node["children"].sort(key=lambda child: child["name"])
+
+    for root in roots:
+        roll_up(root)
+    return sorted(roots, key=lambda root: root["name"])
+
+# Recompute every path and aggregate, e.g. after adding the columns to an existing database
+def rebuild(db: Session):
+    categories = db.execute(select(Category.id, Category.parent_id)).all()
+    children = defaultdict(list)
+    for category_id, parent_id in categories:
+        children[parent_id].append(category_id)
+    stack = [(category_id, "/") for category_id in children[None]]
+    while stack:
+        category_id, parent_path = stack.pop()
+        path = f"{parent_path}{category_id}/"
+        db.execute(update(Category).where(Category.id == category_id).values(path=path))
+        stack.extend((child_id, path) for child_id in children[category_id])
+    refresh_category_stats(db.connection(), [category_id for category_id, _ in categories])
+    db.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild category paths and aggregates from the products table")
+    parser.parse_args()
+
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        rebuild(db)
+        print(json.dumps({"categories": len(get_category_tree(db) or [])}, indent=2))
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
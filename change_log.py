@@ -0,0 +1,151 @@
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, event, func, insert, select
+from sqlalchemy.orm import Session
+from config import change_settings
+from database import Change, Category, Product, PRODUCT_COLUMNS, CATEGORY_COLUMNS
+from serialization import dumps, json_value, rows_to_dicts
+
+# Change feed for incremental sync.
+# Every product and category write appends (sequence, kind, id, operation) to the
+# changes table in the same transaction as the write itself, so a change is
+# visible exactly when the write commits and is lost exactly when it rolls back.
+# ORM writes are logged at flush time; Core writes (bulk import, stock changes,
+# partial updates) log through record_changes. Consumers keep the last sequence
+# they processed and ask for what came after it, instead of re-reading the catalog.
+
+KINDS = {"product": (Product, PRODUCT_COLUMNS), "category": (Category, CATEGORY_COLUMNS)}
+CHANGE_COLUMNS = (Change.id, Change.kind, Change.row_id, Change.operation, Change.changed_at)
+
+class ChangesPruned(Exception):
+    """Raised when changes after the requested sequence have already been deleted"""
+
+def record_changes(connection, kind: str, ids, operation: str, now: Optional[datetime] = None):
+    now = now or datetime.utcnow()
+    rows = [{"kind": kind, "row_id": row_id, "operation": operation, "changed_at": now} for row_id in ids]
+    if rows:
+        connection.execute(insert(Change), rows)
+
+@event.listens_for(Session, "after_flush")
+def log_flushed_changes(session, flush_context):
+    now = datetime.utcnow()
+    rows = []
+    for objects, operation in ((session.new, "insert"), (session.dirty, "update"), (session.deleted, "delete")):
+        for obj in objects:
+            kind = "product" if isinstance(obj, Product) else "category" if isinstance(obj, Category) else None
+            if kind is None or (operation == "update" and not session.is_modified(obj, include_collections=False)):
+                continue
+            rows.append({"kind": kind, "row_id": obj.id, "operation": operation, "changed_at": now})
+    if rows:
+        session.connection().execute(insert(Change), rows)
+
+# Sequences come from an auto-increment, so a transaction that started earlier can commit
+# a lower sequence after a higher one is already visible. Stop at a recent gap instead of
+# moving past it; gaps left by rolled back transactions are skipped once they are old.
+def settled(rows, since: int, now: datetime):
+    previous = since
+    for index, row in enumerate(rows):
+        if row.id != previous + 1 and (now - row.changed_at).total_seconds() < change_settings.gap_seconds:
+            return rows[:index]
+        previous = row.id
+    return rows
+
+# Current state of the changed rows, one query per kind; None once a row is deleted
+def current_rows(db: Session, rows) -> dict:
+    ids = {}
+    for row in rows:
+        ids.setdefault(row.kind, set()).add(row.row_id)
+    current = {}
+    for kind, row_ids in ids.items():
+        model, columns = KINDS[kind]
+        for data in rows_to_dicts(columns, db.execute(select(*columns).where(model.id.in_(row_ids)))):
+            current[kind, data["id"]] = data
+    return current
+
+# Changes after `since` in sequence order, with the sequence to resume from
+def get_changes(db: Session, since: int = 0, limit: int = change_settings.batch_size) -> dict:
+    rows = db.execute(select(*CHANGE_COLUMNS).where(Change.id > since).order_by(Change.id).limit(limit)).all()
+    if since and (not rows or rows[0].id != since + 1):
+        oldest = db.scalar(select(func.min(Change.id)))
+        if oldest is not None and since < oldest - 1:
+            raise ChangesPruned()
+    ready = settled(rows, since, datetime.utcnow())
+    current = current_rows(db, ready)
+    changes = [
+        {"sequence": row.id, "kind": row.kind, "id": row.row_id, "operation": row.operation,
+         "changed_at": json_value(row.changed_at), "data": current.get((row.kind, row.row_id))}
+        for row in ready
+    ]
+    # A full batch may be followed by more; one stopped at an unsettled gap has to wait for the gap to settle
+    return {"changes": changes, "next": ready[-1].id if ready else since, "has_more": len(rows) == limit and len(ready) == len(rows)}
+
+def load_changes(since: int, limit: int) -> dict:
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        return get_changes(db, since, limit)
+    finally:
+        db.close()
+
+async def load_changes_in_threadpool(since: int, limit: int) -> dict:
+    return await run_in_threadpool(load_changes, since, limit)
+
+# Server-Sent Events: one "change" event per change, with the sequence as the event id so that
+# a reconnecting client resumes through Last-Event-ID. Streams end after stream_seconds and
+# the client reconnects, which bounds how long a connection is held. `load` reads a batch of
+# the feed; the async app passes one that uses its own sessions.
+async def stream_changes(since: int, limit: int = change_settings.batch_size, load=load_changes_in_threadpool):
+    deadline = time.monotonic() + change_settings.stream_seconds
+    yield f"retry: {int(change_settings.poll_seconds * 1000)}\n\n".encode()
+    last_sent = time.monotonic()
+    while True:
+        try:
+            feed = await load(since, limit)
+        except ChangesPruned:
+            yield b"event: pruned\ndata: {}\n\n"
+            return
+        if feed["changes"]:
+            yield b"".join(b"id: %d\nevent: change\ndata: %s\n\n" % (change["sequence"], dumps(change)) for change in feed["changes"])
+            since = feed["next"]
+            last_sent = time.monotonic()
+        elif time.monotonic() - last_sent >= change_settings.keepalive_seconds:
+            yield b": keep-alive\n\n"
+            last_sent = time.monotonic()
+        if time.monotonic() >= deadline:
+            return
+        if not feed["has_more"]:
+            await asyncio.sleep(change_settings.poll_seconds)
+
+# Delete changes older than the retention period, always keeping the latest so its sequence is never reused
+def prune_changes(db: Session, days: int = change_settings.retention_days) -> int:
+    latest = db.scalar(select(func.max(Change.id)))
+    if latest is None:
+        return 0
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    deleted = db.execute(delete(Change).where(Change.changed_at < cutoff, Change.id < latest)).rowcount
+    db.commit()
+    return deleted
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the change feed")
+    parser.add_argument("--prune", action="store_true", help="Delete changes older than the retention period")
+    parser.add_argument("--days", type=int, default=change_settings.retention_days, help="Retention period in days")
+    args = parser.parse_args()
+
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        report = {"latest": db.scalar(select(func.max(Change.id)))}
+        if args.prune:
+            report["pruned"] = prune_changes(db, args.days)
+        print(json.dumps(report, indent=2))
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,153 @@
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 import os
+from typing import Optional
 
 # Load environment variables from .env file
 load_dotenv()
 
-class DatabaseSettings(BaseSettings):
+# Unset and empty variables both mean "use the default": docker-compose passes an empty
+# string for every variable that is listed but not set on the host
+def env(name: str, default: Optional[str] = None) -> Optional[str]:
+    value = os.getenv(name)
+    return default if value is None or not value.strip() else value.strip()
+
+def env_int(name: str, default: int) -> int:
+    value = env(name)
+    try:
+        return default if value is None else int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer, got {value!r}") from None
+
+def env_float(name: str, default: float) -> float:
+    value = env(name)
+    try:
+        return default if value is None else float(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number, got {value!r}") from None
+
+def env_bool(name: str, default: bool) -> bool:
+    value = env(name)
+    return default if value is None else value.lower() in ("1", "true", "yes")
+
+class EnvSettings(BaseSettings):
+    """Settings whose values are read from the variables named in their defaults"""
+
+    # Only the explicit variables count: field names like user, host or port must not
+    # pick up unrelated USER, HOST or PORT variables from the environment
+    @classmethod
+    def settings_customise_sources(cls, settings_cls, init_settings, env_settings, dotenv_settings, file_secret_settings):
+        return (init_settings,)
+
+class DatabaseSettings(EnvSettings):
     """Database connection settings"""
     
-    host: str = os.getenv("TEST_DB_HOST")
-    port: int = int(os.getenv("TEST_DB_PORT"))
-    user: str = os.getenv("TEST_DB_USER")
-    password: str = os.getenv("TEST_DB_PASSWORD")
-    database: str = os.getenv("TEST_DB_NAME")
+    host: str = env("TEST_DB_HOST", "localhost")
+    port: int = env_int("TEST_DB_PORT", 3306)
+    user: Optional[str] = env("TEST_DB_USER")
+    password: Optional[str] = env("TEST_DB_PASSWORD")
+    database: Optional[str] = env("TEST_DB_NAME")
+    # Full SQLAlchemy URL, overrides the MySQL settings above (e.g. sqlite:///./catalog.db)
+    url: Optional[str] = env("TEST_DB_URL")
+    # Serve the API through the async engine and async route handlers
+    use_async: bool = env_bool("TEST_DB_ASYNC", False)
+    # Connection pool sizing, per worker process
+    pool_size: int = env_int("TEST_DB_POOL_SIZE", 5)
+    max_overflow: int = env_int("TEST_DB_MAX_OVERFLOW", 10)
+    pool_timeout: float = env_float("TEST_DB_POOL_TIMEOUT", 30)
+    # Recycle connections before MySQL's wait_timeout closes them ("MySQL server has gone away")
+    pool_recycle: int = env_int("TEST_DB_POOL_RECYCLE", 3600)
+    pool_pre_ping: bool = env_bool("TEST_DB_POOL_PRE_PING", True)
+    # Read replicas for GET handlers, as comma separated SQLAlchemy URLs; each gets a pool sized as above
+    replica_urls: Optional[str] = env("TEST_DB_REPLICA_URLS")
+    # After a write, the client that wrote reads from the primary for this long so it is not served from a replica that is behind,
+    # and no worker caches what it reads from replicas
+    replica_sticky_seconds: float = env_float("TEST_DB_REPLICA_STICKY_SECONDS", 5)
+    # A replica that cannot be reached is skipped for this long before it is tried again
+    replica_eject_seconds: float = env_float("TEST_DB_REPLICA_EJECT_SECONDS", 30)
+
+class CacheSettings(EnvSettings):
+    """Catalog read cache settings"""
+
+    # "memory" (per process), "redis" (shared by all workers) or "none"
+    backend: str = env("CACHE_BACKEND", "memory")
+    ttl: int = env_int("CACHE_TTL", 60)
+    max_entries: int = env_int("CACHE_MAX_ENTRIES", 10000)
+    redis_url: str = env("CACHE_REDIS_URL", "redis://localhost:6379/0")
+    # With the memory backend, how often each worker reads the change feed to drop what other workers changed; 0 turns it off
+    follow_seconds: float = env_float("CACHE_FOLLOW_SECONDS", 1)
+    # Cache-Control lifetimes for CDNs and browsers
+    http_max_age: int = env_int("CACHE_HTTP_MAX_AGE", 30)
+    http_stale_while_revalidate: int = env_int("CACHE_HTTP_STALE_WHILE_REVALIDATE", 60)
+
+class AuthSettings(EnvSettings):
+    """Authentication settings"""
+
+    # bcrypt cost factor; every +1 doubles the time to hash or verify a password
+    bcrypt_rounds: int = env_int("AUTH_BCRYPT_ROUNDS", 12)
+    # Threads that hash and verify passwords, and how many logins may queue for them
+    hash_workers: int = env_int("AUTH_HASH_WORKERS", 2)
+    hash_max_pending: int = env_int("AUTH_HASH_MAX_PENDING", 64)
+    # How long a verified token's user is reused without querying the database
+    principal_ttl: int = env_int("AUTH_PRINCIPAL_TTL", 60)
+
+class MetricsSettings(EnvSettings):
+    """Request and SQL instrumentation settings"""
+
+    # Record request and SQL metrics and serve them on /metrics (Prometheus text format)
+    enabled: bool = env_bool("METRICS_ENABLED", False)
+    # Statements slower than this are logged with their fingerprint
+    slow_query_seconds: float = env_float("METRICS_SLOW_QUERY_SECONDS", 0.2)
+
+class ChangeFeedSettings(EnvSettings):
+    """Change feed (GET /changes) settings"""
+
+    # Changes returned per request when no limit is given, and the most a request may ask for
+    batch_size: int = env_int("CHANGES_BATCH_SIZE", 100)
+    max_batch_size: int = env_int("CHANGES_MAX_BATCH_SIZE", 1000)
+    # A missing sequence younger than this may belong to a transaction that has not committed yet,
+    # so the feed stops before it; keep it above the longest write transaction
+    gap_seconds: float = env_float("CHANGES_GAP_SECONDS", 5)
+    # Server-Sent Events: polling interval, keep-alive interval, and how long a stream lasts before the client reconnects
+    poll_seconds: float = env_float("CHANGES_POLL_SECONDS", 1)
+    keepalive_seconds: float = env_float("CHANGES_KEEPALIVE_SECONDS", 15)
+    stream_seconds: float = env_float("CHANGES_STREAM_SECONDS", 300)
+    # Changes older than this are deleted by `python change_log.py --prune`
+    retention_days: int = env_int("CHANGES_RETENTION_DAYS", 30)
+
+class ServerSettings(EnvSettings):
+    """Production server settings (serve.py)"""
+
+    host: str = env("SERVER_HOST", "0.0.0.0")
+    port: int = env_int("SERVER_PORT", 8000)
+    # Worker processes, one per CPU core when 0; every worker has its own connection pool
+    workers: int = env_int("SERVER_WORKERS", env_int("WEB_CONCURRENCY", 0))
+    # Connections each worker opens at startup, before it accepts requests (capped at the pool size)
+    warm_connections: int = env_int("SERVER_WARM_CONNECTIONS", 2)
+    # Build the search index at startup instead of on the first search
+    warm_search: bool = env_bool("SERVER_WARM_SEARCH", True)
+    # How long in-flight requests may run on after a shutdown signal before they are cancelled
+    graceful_timeout: int = env_int("SERVER_GRACEFUL_TIMEOUT", 30)
+    keepalive_timeout: int = env_int("SERVER_KEEPALIVE_TIMEOUT", 5)
+    # Proxies trusted to set X-Forwarded-For / X-Forwarded-Proto
+    forwarded_allow_ips: str = env("SERVER_FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+class TrafficSettings(EnvSettings):
+    """Request coalescing and write rate limiting settings (throttling.py)"""
+
+    # Concurrent identical GET /products/{product_id} requests share one run of the handler
+    coalesce_reads: bool = env_bool("COALESCE_READS", True)
+    # Token bucket per client for POST, PUT, PATCH and DELETE: sustained writes per second, and the burst allowed on top
+    rate_limit_enabled: bool = env_bool("RATE_LIMIT_ENABLED", False)
+    rate_limit_per_second: float = env_float("RATE_LIMIT_WRITES_PER_SECOND", 10)
+    rate_limit_burst: int = env_int("RATE_LIMIT_BURST", 50)
+    # Buckets kept per worker; beyond this the least recently seen client starts over with a full bucket
+    rate_limit_max_clients: int = env_int("RATE_LIMIT_MAX_CLIENTS", 10000)
 
 db_settings = DatabaseSettings()
+cache_settings = CacheSettings()
+auth_settings = AuthSettings()
+metrics_settings = MetricsSettings()
+change_settings = ChangeFeedSettings()
+server_settings = ServerSettings()
+traffic_settings = TrafficSettings()
@@ -0,0 +1,78 @@
+import os
+from contextlib import contextmanager
+import pytest
+from sqlalchemy import event
+
+# Run the tests against a throwaway SQLite database unless a MySQL test database is configured.
+# Set TEST_DB_ASYNC=1 to serve the same tests through the async engine (aiosqlite).
+if not os.getenv("TEST_DB_HOST") and not os.getenv("TEST_DB_URL"):
+    os.environ["TEST_DB_URL"] = "sqlite:///./test_catalog.db"
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+# Cheap password hashing keeps the suite fast
+os.environ.setdefault("AUTH_BCRYPT_ROUNDS", "4")
+os.environ.setdefault("METRICS_ENABLED", "1")
+
+from config import db_settings
+from database import Base, engine, SessionLocal, User
+from auth import create_access_token, hash_password
+
+@pytest.fixture(scope="session", autouse=True)
+def create_tables():
+    """
+    Creates a fresh schema when testing on SQLite.
+    """
+    if engine.url.get_backend_name() == "sqlite":
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+    yield
+
+@pytest.fixture(scope="session")
+def test_user(create_tables):
+    """
+    Returns the id of the "testuser" account (password "testpassword"), creating it if needed.
+    """
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.username == "testuser").first()
+        if user is None:
+            user = User(username="testuser", email="testuser@example.com", hashed_password=hash_password("testpassword"))
+            db.add(user)
+            db.commit()
+        return user.id
+    finally:
+        db.close()
+
+@pytest.fixture(scope="session")
+def auth_headers(test_user):
+    """
+    Authorization headers for write requests.
+    """
+    return {"Authorization": f"Bearer {create_access_token(data={'user_id': test_user})}"}
+
+@pytest.fixture
+def count_queries():
+    """
+    Counts the SQL statements run while a block executes, to catch N+1 query regressions:
+
+        with count_queries() as statements:
+            client.get("/products")
+        assert len(statements) == 1
+    """
+    engines = [engine]
+    if db_settings.use_async:
+        from async_database import async_engine
+        engines.append(async_engine.sync_engine)
+
+    @contextmanager
+    def counter():
+        statements = []
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        for target in engines:
+            event.listen(target, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            for target in engines:
+                event.remove(target, "before_cursor_execute", record)
+    return counter
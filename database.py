@@ -1,9 +1,15 @@
+import os
+import sys
 import warnings
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship
+from sqlalchemy import create_engine, select, update, or_, and_, Column, Integer, String, Float, DateTime, ForeignKey, Index
+from sqlalchemy.engine import URL
+from sqlalchemy.dialects import mysql
+from sqlalchemy.orm import declarative_base, sessionmaker, relationship, joinedload, selectinload
 from sqlalchemy.exc import SAWarning
 from config import db_settings
+from pool_metrics import TimedQueuePool
 from datetime import datetime
+from typing import Optional
 from sqlalchemy.orm import Session
 
 # Suppress the warning
@@ -12,16 +18,54 @@ warnings.filterwarnings("ignore", category=SAWarning)
 # Create a base class for SQLAlchemy models
 Base = declarative_base()
 
+# modified_at keeps microseconds on MySQL too, so ETags change on every update
+Timestamp = DateTime().with_variant(mysql.DATETIME(fsp=6), "mysql")
+
 # Define Category model (mapped to the "categories" table)
 class Category(Base):
     __tablename__ = "categories"
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), unique=True, nullable=False)
+    parent_id = Column(Integer, ForeignKey("categories.id"), nullable=True, index=True)
+    # Materialized path of ids from the root, e.g. "/1/5/", maintained by category_tree.py
+    path = Column(String(255), index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
-    modified_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    modified_at = Column(Timestamp, default=datetime.utcnow, onupdate=datetime.utcnow)
     products = relationship("Product", back_populates="category")
 
+# Aggregates over the products directly in a category, kept up to date by category_tree.py
+class CategoryStats(Base):
+    __tablename__ = "category_stats"
+
+    category_id = Column(Integer, ForeignKey("categories.id", ondelete="CASCADE"), primary_key=True)
+    product_count = Column(Integer, nullable=False, default=0)
+    total_stock = Column(Integer, nullable=False, default=0)
+    min_price = Column(Float)
+    max_price = Column(Float)
+
+# Stock moved by stock changes, spread over a few rows per category so that checkouts in one category
+# do not queue on a single row; a category's stock is category_stats.total_stock plus its deltas here
+class CategoryStock(Base):
+    __tablename__ = "category_stock"
+
+    category_id = Column(Integer, ForeignKey("categories.id", ondelete="CASCADE"), primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    stock_delta = Column(Integer, nullable=False, default=0)
+
+# Ordered log of product and category writes for incremental sync, written by change_log.py
+class Change(Base):
+    __tablename__ = "changes"
+    # Never reuse the sequence of a pruned change on SQLite
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    # The sequence consumers resume from
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(16), nullable=False)
+    row_id = Column(Integer, nullable=False)
+    operation = Column(String(8), nullable=False)
+    changed_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
 # Define Product model (mapped to the "products" table)
 class Product(Base):
     __tablename__ = "products"
@@ -33,14 +77,63 @@ class Product(Base):
     price = Column(Float, nullable=False)
     quantity = Column(Integer, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
-    modified_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    modified_at = Column(Timestamp, default=datetime.utcnow, onupdate=datetime.utcnow)
     category = relationship("Category", back_populates="products")
 
+    # Composite indexes backing the filtered and sorted product listings
+    __table_args__ = (
+        Index("ix_products_category_id_id", "category_id", "id"),
+        Index("ix_products_category_id_price", "category_id", "price"),
+        Index("ix_products_price_id", "price", "id"),
+        Index("ix_products_name", "name"),
+    )
+
+# Define User model (mapped to the "users" table)
+class User(Base):
+    __tablename__ = "users"
+
+    id = Column(Integer, primary_key=True, index=True)
+    username = Column(String(255), unique=True, nullable=False)
+    email = Column(String(255), nullable=False)
+    hashed_password = Column(String(255), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    modified_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# Build the database URL from config.py, preferring an explicit URL override
+def get_database_url():
+    if db_settings.url:
+        return db_settings.url
+    # URL.create escapes credentials and leaves out unset parts instead of writing "None" into the URL
+    url = URL.create("mysql+mysqlconnector", username=db_settings.user, password=db_settings.password, host=db_settings.host,
+                     port=db_settings.port, database=db_settings.database)
+    return url.render_as_string(hide_password=False)
+
+DATABASE_URL = get_database_url()
+
+# Connection pool options shared by the sync and async engines
+def get_pool_options():
+    return {
+        "pool_size": db_settings.pool_size,
+        "max_overflow": db_settings.max_overflow,
+        "pool_timeout": db_settings.pool_timeout,
+        "pool_recycle": db_settings.pool_recycle,
+        "pool_pre_ping": db_settings.pool_pre_ping,
+    }
+
 # Create the database engine using connection details from config.py
 engine = create_engine(
-    f"mysql+mysqlconnector://{db_settings.user}:{db_settings.password}@{db_settings.host}:{db_settings.port}/{db_settings.database}"
+    DATABASE_URL,
+    poolclass=TimedQueuePool,
+    # SQLite connections are shared with the threadpool that runs sync handlers
+    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {},
+    **get_pool_options(),
 )
 
+# Creating the engine opens no connection. A process forked from one that has connected
+# (e.g. gunicorn --preload) starts with an empty pool instead of sharing the parent's sockets.
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+
 # Create a session maker for interacting with the database
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -54,50 +147,170 @@ def get_db():
 
 # CRUD functions
 
+# Timestamps are maintained by the database layer, never taken from request bodies on update
+SERVER_TIMESTAMPS = {"created_at", "modified_at"}
+# Nor is the id: the path names the row, and a PUT that moved it would leave the old id cached
+UPDATE_EXCLUDED = SERVER_TIMESTAMPS | {"id"}
+
 def create_product(db: Session, product: Product):
     db.add(product)
     db.commit()
     db.refresh(product)
     return product
 
-def get_products(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(Product).offset(skip).limit(limit).all()
+# Columns the product listing can be sorted by; a leading "-" sorts descending
+PRODUCT_SORT_COLUMNS = {
+    "id": Product.id,
+    "price": Product.price,
+    "name": Product.name,
+}
+
+# Names starting with a prefix, in a form the name index can serve. SQLite cannot use an index for
+# LIKE, but compares names byte by byte, so a range up to the next string is exact. Other databases
+# compare under a collation (MySQL's default sorts punctuation before letters and digits), where
+# such a bound can cut off matching names, and LIKE 'prefix%' is served from the index anyway.
+def name_prefix_condition(prefix: str, dialect_name: str = engine.dialect.name):
+    if dialect_name != "sqlite":
+        return Product.name.startswith(prefix, autoescape=True)
+    condition = Product.name >= prefix
+    if ord(prefix[-1]) < sys.maxunicode:
+        condition = and_(condition, Product.name < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+    return condition
+
+# Build the product listing statement, shared by the sync and async CRUD functions
+def build_products_query(skip: int = 0, limit: int = 100, after_id: Optional[int] = None, after_key=None,
+                         category_id: Optional[int] = None, min_price: Optional[float] = None,
+                         max_price: Optional[float] = None, in_stock: Optional[bool] = None,
+                         name_prefix: Optional[str] = None, sort: str = "id", columns=None):
+    query = select(*columns) if columns else select(Product)
+    if category_id is not None:
+        query = query.where(Product.category_id == category_id)
+    if min_price is not None:
+        query = query.where(Product.price >= min_price)
+    if max_price is not None:
+        query = query.where(Product.price <= max_price)
+    if in_stock is not None:
+        query = query.where(Product.quantity > 0 if in_stock else Product.quantity == 0)
+    if name_prefix:
+        query = query.where(name_prefix_condition(name_prefix))
+
+    descending = sort.startswith("-")
+    column = PRODUCT_SORT_COLUMNS[sort.lstrip("-")]
+    if column is Product.id:
+        query = query.order_by(Product.id.desc() if descending else Product.id)
+    else:
+        # Ties on the sort column are broken by id so the order is total and cursors are stable
+        query = query.order_by(column.desc(), Product.id.desc()) if descending else query.order_by(column, Product.id)
+
+    if after_id is not None:
+        # Keyset pagination: seek past the last seen row instead of scanning OFFSET rows
+        if column is Product.id:
+            query = query.where(Product.id < after_id if descending else Product.id > after_id)
+        elif descending:
+            query = query.where(or_(column < after_key, and_(column == after_key, Product.id < after_id)))
+        else:
+            query = query.where(or_(column > after_key, and_(column == after_key, Product.id > after_id)))
+    else:
+        query = query.offset(skip)
+    return query.limit(limit)
+
+# Eager loading for relationships that responses can embed, so a page of rows costs a
+# fixed number of queries instead of one more per row
+def product_options(include_category: bool = False):
+    return (joinedload(Product.category),) if include_category else ()
+
+def category_options(include_products: bool = False):
+    return (selectinload(Category.products),) if include_products else ()
+
+def get_products(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None, include_category: bool = False, **filters):
+    query = build_products_query(skip=skip, limit=limit, after_id=after_id, **filters)
+    return db.scalars(query.options(*product_options(include_category))).all()
 
-def get_product_by_id(db: Session, product_id: int):
-    return db.query(Product).filter(Product.id == product_id).first()
+# Columns of the product listing, in response order
+PRODUCT_COLUMNS = (Product.id, Product.name, Product.category_id, Product.sku, Product.price, Product.quantity,
+                   Product.created_at, Product.modified_at)
+CATEGORY_COLUMNS = (Category.id, Category.name, Category.parent_id, Category.created_at, Category.modified_at)
+
+# Same listing as get_products, as plain column tuples instead of ORM entities
+def get_product_rows(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None, **filters):
+    return db.execute(build_products_query(skip=skip, limit=limit, after_id=after_id, columns=PRODUCT_COLUMNS, **filters)).all()
+
+def get_product_by_id(db: Session, product_id: int, include_category: bool = False):
+    return db.query(Product).options(*product_options(include_category)).filter(Product.id == product_id).first()
+
+def get_product_modified_at(db: Session, product_id: int):
+    return db.query(Product.modified_at).filter(Product.id == product_id).scalar()
+
+def get_products_by_ids(db: Session, product_ids: list, include_category: bool = False):
+    return db.query(Product).options(*product_options(include_category)).filter(Product.id.in_(product_ids)).all()
+
+def get_products_by_skus(db: Session, skus: list, include_category: bool = False):
+    return db.query(Product).options(*product_options(include_category)).filter(Product.sku.in_(skus)).all()
+
+# Load a product for a write that derives category totals from its current values. The row stays locked
+# until commit, and a copy the session loaded earlier is refreshed, so a concurrent write is never counted twice
+def get_product_for_update(db: Session, product_id: int):
+    if db.get_bind().dialect.name == "sqlite":
+        # SQLite ignores FOR UPDATE; a write takes its database lock instead, held until commit
+        db.execute(update(Product).where(Product.id == product_id).values(modified_at=Product.modified_at))
+    return db.query(Product).filter(Product.id == product_id).populate_existing().with_for_update().first()
 
 def update_product(db: Session, product_id: int, product_data: Product):
-    db_product = db.query(Product).filter(Product.id == product_id).first()
+    db_product = get_product_for_update(db, product_id)
     if db_product:
-        for key, value in product_data.dict().items():
+        for key, value in product_data.dict(exclude=UPDATE_EXCLUDED).items():
             setattr(db_product, key, value)
         db.commit()
         db.refresh(db_product)
     return db_product
 
+# A product another transaction deleted first is not found, so its totals are only subtracted once
 def delete_product(db: Session, product_id: int):
-    db_product = db.query(Product).filter(Product.id == product_id).first()
+    db_product = get_product_for_update(db, product_id)
     if db_product:
         db.delete(db_product)
         db.commit()
     return db_product
 
+# Raise ValueError unless parent_id names an existing category outside the category's own subtree
+def check_category_parent(db: Session, category_id: Optional[int], parent_id: Optional[int]):
+    if parent_id is None:
+        return
+    parent = db.query(Category.id, Category.path).filter(Category.id == parent_id).first()
+    if parent is None:
+        raise ValueError("Parent category not found")
+    if category_id is not None and (parent_id == category_id or f"/{category_id}/" in (parent.path or "")):
+        raise ValueError("A category cannot be moved below itself")
+
+def check_category_deletable(db: Session, category_id: int):
+    if db.query(Category.id).filter(Category.parent_id == category_id).first() is not None:
+        raise ValueError("Category has subcategories")
+
 def create_category(db: Session, category: Category):
+    check_category_parent(db, category.id, category.parent_id)
     db.add(category)
     db.commit()
     db.refresh(category)
     return category
 
-def get_categories(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(Category).offset(skip).limit(limit).all()
+def get_categories(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    query = db.query(Category).order_by(Category.id)
+    if after_id is not None:
+        # Keyset pagination: seek past the last seen id instead of scanning OFFSET rows
+        return query.filter(Category.id > after_id).limit(limit).all()
+    return query.offset(skip).limit(limit).all()
+
+def get_category_by_id(db: Session, category_id: int, include_products: bool = False):
+    return db.query(Category).options(*category_options(include_products)).filter(Category.id == category_id).first()
 
-def get_category_by_id(db: Session, category_id: int):
-    return db.query(Category).filter(Category.id == category_id).first()
+def get_category_modified_at(db: Session, category_id: int):
+    return db.query(Category.modified_at).filter(Category.id == category_id).scalar()
 
 def update_category(db: Session, category_id: int, category_data: Category):
     db_category = db.query(Category).filter(Category.id == category_id).first()
     if db_category:
-        for key, value in category_data.dict().items():
+        check_category_parent(db, category_id, category_data.parent_id)
+        for key, value in category_data.dict(exclude=UPDATE_EXCLUDED).items():
             setattr(db_category, key, value)
         db.commit()
         db.refresh(db_category)
@@ -106,6 +319,7 @@ def update_category(db: Session, category_id: int, category_data: Category):
 def delete_category(db: Session, category_id: int):
     db_category = db.query(Category).filter(Category.id == category_id).first()
     if db_category:
+        check_category_deletable(db, category_id)
         db.delete(db_category)
         db.commit()
     return db_category
@@ -0,0 +1,91 @@
+import csv
+import io
+import zlib
+from sqlalchemy import select
+from database import Product, Category, PRODUCT_COLUMNS
+from serialization import dumps, json_value, rows_to_dicts
+from replicas import read_session
+
+# Streaming catalog export.
+# Products are read in keyset batches of BATCH_SIZE rows (`WHERE id > :last
+# ORDER BY id LIMIT :n`) and each batch is encoded and handed to the response
+# before the next one is fetched, so memory stays flat whatever the size of the
+# catalog. Server-side cursors would do the same with one query, but drivers
+# without them (mysql-connector buffers every result) silently load everything.
+
+BATCH_SIZE = 1000
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+def export_columns(include_category: bool = False):
+    return PRODUCT_COLUMNS + (Category.name.label("category_name"),) if include_category else PRODUCT_COLUMNS
+
+def export_query(include_category: bool = False):
+    query = select(*export_columns(include_category))
+    if include_category:
+        query = query.outerjoin(Category, Product.category_id == Category.id)
+    return query.order_by(Product.id)
+
+# Batches of product rows, one query per batch that seeks past the last id of the previous one.
+# Each batch is read in its own short transaction, so a slow client does not hold a snapshot open;
+# rows written during the export are included if they are not yet behind it.
+def iter_batches(db, include_category: bool = False, batch_size: int = BATCH_SIZE):
+    query = export_query(include_category).limit(batch_size)
+    last_id = None
+    while True:
+        rows = db.execute(query if last_id is None else query.where(Product.id > last_id)).all()
+        db.rollback()
+        if rows:
+            yield rows
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1].id
+
+def ndjson_chunks(batches, columns):
+    for rows in batches:
+        yield b"".join(dumps(row) + b"\n" for row in rows_to_dicts(columns, rows))
+
+def csv_chunks(batches, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column.key for column in columns])
+    for rows in batches:
+        writer.writerows([json_value(value) for value in row] for row in rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    # Only the header is left when the catalog is empty
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+ENCODERS = {
+    "ndjson": ndjson_chunks,
+    "csv": csv_chunks,
+}
+
+# Compress a stream of chunks into a single gzip member as it is produced
+def gzip_chunks(chunks, level: int = 6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    for coding in (accept_encoding or "").split(","):
+        name, _, params = coding.strip().partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+# Encoded export of the whole catalog. The generator owns its session, on a read
+# replica when there is one, so it stays open for as long as the response is
+# streaming, and is closed when it ends or the client goes away.
+def export_products(file_format: str, include_category: bool = False, compress: bool = False, batch_size: int = BATCH_SIZE,
+                    prefer_primary: bool = False):
+    with read_session(prefer_primary) as db:
+        chunks = ENCODERS[file_format](iter_batches(db, include_category, batch_size), export_columns(include_category))
+        yield from gzip_chunks(chunks) if compress else chunks
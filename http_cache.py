@@ -0,0 +1,103 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+from fastapi import HTTPException, Request, Response
+from config import cache_settings
+
+# HTTP validators and cache headers for catalog reads.
+# ETags are derived from row ids and modified_at, so a single row can be revalidated
+# from its modified_at column alone without loading or serializing it.
+
+def as_datetime(value):
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+# Embedded rows (?include=...) are part of the version, so the validator changes when they do
+EMBEDDED_FIELDS = ("category", "products")
+
+def row_version(row) -> str:
+    modified_at = as_datetime(row["modified_at"] if isinstance(row, dict) else row.modified_at)
+    version = f"{row['id'] if isinstance(row, dict) else row.id}@{modified_at.isoformat()}"
+    if isinstance(row, dict):
+        for field in EMBEDDED_FIELDS:
+            embedded = row.get(field)
+            if isinstance(embedded, dict):
+                version += f"+{field}:{row_version(embedded)}"
+            elif isinstance(embedded, list):
+                version += f"+{field}:" + ",".join(row_version(item) for item in embedded)
+    return version
+
+def make_etag(*versions: str) -> str:
+    return '"' + hashlib.sha1("|".join(versions).encode()).hexdigest() + '"'
+
+def item_etag(kind: str, row_id: int, modified_at) -> str:
+    return make_etag(f"{kind}:{row_id}@{as_datetime(modified_at).isoformat()}")
+
+# Same as item_etag for a plain document, and covers its embedded rows otherwise
+def document_etag(kind: str, document: dict) -> str:
+    return make_etag(f"{kind}:{row_version(document)}")
+
+def list_etag(kind: str, rows: list) -> str:
+    return make_etag(kind, *(row_version(row) for row in rows))
+
+# Modification times of a row and the rows embedded in it
+def row_dates(row):
+    yield as_datetime(row["modified_at"] if isinstance(row, dict) else row.modified_at)
+    if isinstance(row, dict):
+        for field in EMBEDDED_FIELDS:
+            embedded = row.get(field)
+            for item in [embedded] if isinstance(embedded, dict) else embedded or ():
+                yield from row_dates(item)
+
+def last_modified_of(rows: list) -> Optional[datetime]:
+    dates = [date for row in rows for date in row_dates(row)]
+    return max(dates) if dates else None
+
+# True when the client's cached copy is still current (If-None-Match wins over If-Modified-Since)
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+        return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= since
+    return False
+
+# The modified_at a conditional write must still find when it runs. With If-Match the
+# current version is read and compared with the client's ETags (412 when stale);
+# otherwise the modified_at the client sent, if any, is used as is.
+def write_precondition(request: Request, kind: str, row_id: int, load_modified_at, modified_at: Optional[datetime] = None):
+    if_match = request.headers.get("if-match")
+    candidates = [candidate.strip() for candidate in if_match.split(",")] if if_match else ["*"]
+    if "*" in candidates:
+        return modified_at
+    current = load_modified_at()
+    if current is None:
+        return modified_at
+    if item_etag(kind, row_id, current) not in candidates:
+        raise HTTPException(status_code=412, detail=f"The {kind} was modified since it was read")
+    return current
+
+def set_cache_headers(response: Response, etag: str, last_modified: Optional[datetime]):
+    response.headers["ETag"] = etag
+    if last_modified is not None:
+        response.headers["Last-Modified"] = format_datetime(last_modified.replace(tzinfo=timezone.utc), usegmt=True)
+    response.headers["Cache-Control"] = (
+        f"public, max-age={cache_settings.http_max_age}, stale-while-revalidate={cache_settings.http_stale_while_revalidate}"
+    )
+
+def not_modified(etag: str, last_modified: Optional[datetime]) -> Response:
+    response = Response(status_code=304)
+    set_cache_headers(response, etag, last_modified)
+    return response
+
+# Whether the request carries validators worth checking before loading the row
+def is_conditional(request: Request) -> bool:
+    return "if-none-match" in request.headers or "if-modified-since" in request.headers
@@ -0,0 +1,17 @@
+from typing import Optional
+from models import Product as ProductSchema, ProductWithCategory
+from cache import to_cached
+
+# Helpers for embedding related rows in product responses (?include=category).
+# Related rows are always loaded eagerly by the database layer; these helpers
+# only choose the response shape and the cache dependencies.
+
+# Tables besides products that a response with the given include reads from
+def related_tables(include: Optional[str]) -> tuple:
+    return ("categories",) if include == "category" else ()
+
+# Serialize product rows explicitly, so validation never touches (and lazily loads)
+# a relationship that was not requested
+def products_response(include: Optional[str], rows: list) -> list:
+    schema = ProductWithCategory if include == "category" else ProductSchema
+    return [to_cached(schema, row) for row in rows]
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import os
+from contextlib import AsyncExitStack, asynccontextmanager, suppress
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+from config import db_settings, server_settings, cache_settings
+from database import engine, SessionLocal
+from search import search_index
+from cache import change_follower
+import replicas
+
+# Worker process lifecycle.
+# Each worker owns its connection pool: whatever a parent process had open before
+# forking is dropped (database.py does the same in a fork hook), and the worker
+# opens its own connections and builds its per-process caches during startup, before
+# the server routes any request to it. While it serves, a worker with a per-process
+# cache follows the change feed to drop entries the other workers' writes made stale.
+# On shutdown the server stops accepting connections and lets in-flight requests
+# finish first; the lifespan exit then closes the pool so the database sees clean
+# disconnects instead of dropped sockets.
+
+logger = logging.getLogger("catalog.server")
+
+# Open connections up front so the first requests do not pay for the TCP and auth handshakes
+def warm_pool(connections: int = server_settings.warm_connections, target=engine) -> int:
+    count = min(connections, db_settings.pool_size)
+    opened = []
+    try:
+        for _ in range(count):
+            connection = target.connect()
+            opened.append(connection)
+            connection.execute(text("SELECT 1"))
+    finally:
+        for connection in opened:
+            connection.close()
+    return count
+
+# An unreachable replica is ejected rather than failing the worker's startup
+def warm_replicas():
+    replica_set = replicas.replica_set
+    for replica in replica_set.replicas if replica_set is not None else ():
+        try:
+            warm_pool(target=replica.engine)
+        except DBAPIError as e:
+            replica_set.eject(replica, e)
+
+def warm_caches():
+    if server_settings.warm_search:
+        db = SessionLocal()
+        try:
+            search_index.ensure_built(db)
+        finally:
+            db.close()
+
+def follow_changes():
+    db = SessionLocal()
+    try:
+        change_follower.catch_up(db)
+    finally:
+        db.close()
+
+async def keep_following_changes(interval: float):
+    while True:
+        try:
+            await run_in_threadpool(follow_changes)
+        except SQLAlchemyError:
+            logger.exception("Could not read the change feed to invalidate the cache")
+        await asyncio.sleep(interval)
+
+# Runs keep_following_changes for as long as the worker serves; a shared cache is invalidated by the writers themselves
+@asynccontextmanager
+async def following_changes(settings=cache_settings):
+    if settings.backend != "memory" or settings.follow_seconds <= 0:
+        yield
+        return
+    await run_in_threadpool(follow_changes)
+    task = asyncio.create_task(keep_following_changes(settings.follow_seconds))
+    try:
+        yield
+    finally:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+
+# Startup and shutdown of one worker process
+@asynccontextmanager
+async def lifespan(app):
+    # Never reuse connections inherited from a parent process; close=False leaves the parent's sockets alone
+    engine.dispose(close=False)
+    if replicas.replica_set is not None:
+        replicas.replica_set.reset_after_fork()
+    connections = await run_in_threadpool(warm_pool)
+    await run_in_threadpool(warm_replicas)
+    await run_in_threadpool(warm_caches)
+    logger.info("Worker %s ready with %s warm connections", os.getpid(), connections)
+    try:
+        async with following_changes():
+            yield
+    finally:
+        engine.dispose()
+        if replicas.replica_set is not None:
+            replicas.replica_set.dispose()
+        logger.info("Worker %s stopped", os.getpid())
+
+# The same for the async application, on the async engine
+@asynccontextmanager
+async def async_lifespan(app):
+    from async_database import async_engine
+    async_engine.sync_engine.dispose(close=False)
+    count = min(server_settings.warm_connections, db_settings.pool_size)
+    async with AsyncExitStack() as stack:
+        for _ in range(count):
+            connection = await stack.enter_async_context(async_engine.connect())
+            await connection.execute(text("SELECT 1"))
+    logger.info("Worker %s ready with %s warm connections", os.getpid(), count)
+    try:
+        async with following_changes():
+            yield
+    finally:
+        await async_engine.dispose()
+        # Streaming exports read through the sync engine in the async application too
+        engine.dispose()
+        logger.info("Worker %s stopped", os.getpid())
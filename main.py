@@ -1,24 +1,55 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+import io
+import os
+import time
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.orm import Session
-from typing import List
-from models import Category, Product
-from pydantic import BaseModel
+from typing import List, Literal, Optional
+from database import Category, Product, PRODUCT_COLUMNS
 
 import auth
-from models import Product as ProductSchema, Category as CategorySchema, User
-from auth import create_access_token, get_current_user_from_token, hash_password, verify_password
-from database import get_db, create_product, get_products, get_product_by_id, update_product, delete_product, \
-    create_category, get_categories, get_category_by_id, update_category, delete_category
+from models import Product as ProductSchema, Category as CategorySchema, ProductWithCategory, CategoryWithProducts, ProductBatch, \
+    ProductFilters, ProductSearchResults, Principal, Token, ImportReport, StockChange, StockBatch, StockLevel, StockLevels, \
+    ProductUpdate, CategoryUpdate, CategoryNode, ChangeFeed
+from auth import create_access_token, get_current_user_from_token, get_user_by_username, revoke_token, \
+    password_hasher, PasswordHasherBusy
+from database import engine, get_db, create_product, get_products, get_product_rows, get_product_by_id, get_product_modified_at, \
+    get_products_by_ids, get_products_by_skus, update_product, delete_product, create_category, get_categories, \
+    get_category_by_id, get_category_modified_at, update_category, delete_category
+from config import db_settings, change_settings
+from batch import parse_batch_keys, order_batch
+from pagination import get_after_id, get_after_position, get_keyset, set_next_cursor
+from pool_metrics import get_pool_metrics
+from bulk_import import import_products, detect_format, READERS, CHUNK_SIZE
+from search import search_products as find_products
+from http_cache import make_etag, item_etag, document_etag, list_etag, last_modified_of, is_conditional, is_not_modified, \
+    not_modified, set_cache_headers, write_precondition
+from cache import catalog_cache, product_key, category_key, to_cached
+from serialization import FastJSONResponse, rows_to_dicts, dumps
+import metrics
+import throttling
+from includes import related_tables, products_response
+from stock import apply_stock_changes, StockUnavailable
+from partial_update import patch_product, patch_category, ModifiedSinceRead
+from export import export_products, accepts_gzip, FORMATS
+from category_tree import get_category_tree
+from change_log import get_changes, stream_changes, ChangesPruned
+from lifecycle import lifespan
+import replicas
+from replicas import get_read_db, reads_own_writes, fills_cache, ReadYourWritesMiddleware
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+throttling.install(app)
+app.add_middleware(ReadYourWritesMiddleware)
+# Installed last so that it is the outermost middleware and records every response, including 429s and coalesced reads
+metrics.install(app, engine)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-class Token(BaseModel):
-    access_token: str
-    token_type: str
-
 # Dependency to get current user from token
 def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
     user = get_current_user_from_token(db, token)
@@ -30,10 +61,18 @@ def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_
         )
     return user
 
+# Check a password on the dedicated hashing threads, shedding load when they are saturated
+async def check_password(plain_password: str, hashed_password: str):
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Too many login attempts in progress", headers={"Retry-After": "1"})
+
+# Async so that logins waiting on bcrypt do not hold request threadpool threads
 @app.post("/token", response_model=Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    user = await run_in_threadpool(get_user_by_username, db, form_data.username)
+    if not user or not await check_password(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -42,68 +81,308 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
     access_token = create_access_token(data={"user_id": user.id})
     return {"access_token": access_token, "token_type": "bearer"}
 
-@app.get("/products", response_model=List[ProductSchema])
-def list_products(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    products = get_products(db, skip=skip, limit=limit)
-    return products
+@app.post("/token/revoke", status_code=204)
+def revoke_access_token(token: str = Depends(oauth2_scheme), current_user: Principal = Depends(get_current_user)):
+    revoke_token(token)
+
+# Reads that may lag behind the primary take their session from get_read_db (a read replica when configured).
+# Search and the change feed stay on the primary: the search index follows the change feed, and the
+# feed's gap detection relies on the primary's commit order.
+
+# Serves rows as column tuples rendered straight to JSON, bypassing response_model validation
+@app.get("/products", response_model=List[ProductWithCategory], response_model_exclude_none=True, response_class=FastJSONResponse)
+def list_products(request: Request, skip: int = 0, limit: int = 100, after: Optional[dict] = Depends(get_after_position),
+                  include: Optional[Literal["category"]] = None, filters: ProductFilters = Depends(), db: Session = Depends(get_read_db)):
+    after_id, after_key = get_keyset(after, filters.sort)
+    def load():
+        if include == "category":
+            rows = get_products(db, skip=skip, limit=limit, after_id=after_id, after_key=after_key, include_category=True, **filters.model_dump())
+            return [to_cached(ProductWithCategory, row) for row in rows]
+        rows = get_product_rows(db, skip=skip, limit=limit, after_id=after_id, after_key=after_key, **filters.model_dump())
+        return rows_to_dicts(PRODUCT_COLUMNS, rows)
+    cache_key = catalog_cache.list_key("products", *related_tables(include), skip=skip, limit=limit, after=after_id, after_key=after_key,
+                                       include=include, **filters.model_dump())
+    products = catalog_cache.get_or_load(cache_key, load, fill=fills_cache(db), refresh=reads_own_writes(request))
+    etag, last_modified = list_etag("products", products), last_modified_of(products)
+    if is_not_modified(request, etag, last_modified):
+        return not_modified(etag, last_modified)
+    response = FastJSONResponse(products)
+    set_cache_headers(response, etag, last_modified)
+    set_next_cursor(response, products, limit, sort=filters.sort)
+    return response
 
 @app.post("/products", response_model=ProductSchema)
-def create_new_product(product: ProductSchema, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+def create_new_product(product: ProductSchema, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     db_product = create_product(db, Product(**product.dict()))
     return db_product
 
-@app.get("/products/{product_id}", response_model=ProductSchema)
-def retrieve_product(product_id: int, db: Session = Depends(get_db)):
-    product = get_product_by_id(db, product_id)
+@app.post("/products/import", response_model=ImportReport)
+def bulk_import_products(file: UploadFile, format: Optional[str] = None, chunk_size: int = CHUNK_SIZE, upsert: bool = True,
+                         create_categories: bool = True, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
+    file_format = format or detect_format(file.filename or "")
+    if file_format not in READERS or chunk_size < 1:
+        raise HTTPException(status_code=400, detail="Unsupported import format or chunk size")
+    stream = io.TextIOWrapper(file.file, encoding="utf-8", newline="")
+    try:
+        report = import_products(db, stream, file_format=file_format, chunk_size=chunk_size, upsert=upsert, create_categories=create_categories)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Malformed import file: {e}")
+    finally:
+        stream.detach()
+    return report
+
+@app.get("/products/export")
+def export_catalog(request: Request, format: Literal["ndjson", "csv"] = "ndjson", include: Optional[Literal["category"]] = None,
+                   gzip: Optional[bool] = None):
+    # Compress when asked explicitly, otherwise when the client accepts gzip
+    compress = accepts_gzip(request.headers.get("accept-encoding")) if gzip is None else gzip
+    headers = {"Content-Disposition": f'attachment; filename="products.{format}"', "Vary": "Accept-Encoding"}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(export_products(format, include_category=include == "category", compress=compress,
+                                             prefer_primary=reads_own_writes(request)),
+                             media_type=FORMATS[format], headers=headers)
+
+@app.get("/products/search", response_model=ProductSearchResults, response_model_exclude_none=True)
+def search_products(q: str = Query(..., min_length=1, max_length=200), limit: int = Query(20, ge=1, le=100),
+                    include: Optional[Literal["category"]] = None, db: Session = Depends(get_db)):
+    product_ids, total = find_products(db, q, limit=limit)
+    # Load the ranked hits in one query and put them back in rank order
+    rows = get_products_by_ids(db, product_ids, include_category=include == "category") if product_ids else []
+    found = {product.id: product for product in rows}
+    return {"total": total, "products": products_response(include, [found[product_id] for product_id in product_ids if product_id in found])}
+
+@app.get("/products:batch", response_model=ProductBatch, response_model_exclude_none=True)
+def retrieve_products_batch(ids: Optional[List[str]] = Query(None), skus: Optional[List[str]] = Query(None),
+                            include: Optional[Literal["category"]] = None, db: Session = Depends(get_read_db)):
+    field, keys = parse_batch_keys(ids, skus)
+    # One IN query for the whole batch instead of a request per product
+    lookup = get_products_by_ids if field == "id" else get_products_by_skus
+    batch = order_batch(field, keys, lookup(db, keys, include_category=include == "category"))
+    return {**batch, "products": products_response(include, batch["products"])}
+
+@app.get("/products/{product_id}", response_model=ProductWithCategory, response_model_exclude_none=True)
+def retrieve_product(product_id: int, request: Request, response: Response, include: Optional[Literal["category"]] = None,
+                     db: Session = Depends(get_read_db)):
+    if include is None and is_conditional(request) and catalog_cache.peek(product_key(product_id)) is None:
+        # Revalidate from modified_at alone instead of loading the whole row
+        modified_at = get_product_modified_at(db, product_id)
+        if modified_at is not None:
+            etag = item_etag("product", product_id, modified_at)
+            if is_not_modified(request, etag, modified_at):
+                return not_modified(etag, modified_at)
+    def load():
+        if include == "category":
+            return to_cached(ProductWithCategory, get_product_by_id(db, product_id, include_category=True))
+        return to_cached(ProductSchema, get_product_by_id(db, product_id))
+    cache_key = catalog_cache.list_key("products", "categories", id=product_id, include=include) if include else product_key(product_id)
+    product = catalog_cache.get_or_load(cache_key, load, fill=fills_cache(db), refresh=reads_own_writes(request))
     if product is None:
         raise HTTPException(status_code=404, detail="Product not found")
+    etag, last_modified = document_etag("product", product), last_modified_of([product])
+    if is_not_modified(request, etag, last_modified):
+        return not_modified(etag, last_modified)
+    set_cache_headers(response, etag, last_modified)
     return product
 
 @app.put("/products/{product_id}", response_model=ProductSchema)
-def update_existing_product(product_id: int, product: ProductSchema, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    updated_product = update_product(db, product_id, Product(**product.dict()))
+def update_existing_product(product_id: int, product: ProductSchema, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
+    updated_product = update_product(db, product_id, product)
     if updated_product is None:
         raise HTTPException(status_code=404, detail="Product not found")
     return updated_product
 
+# Writes only the fields that were sent, in a single UPDATE. The update is conditional
+# on If-Match or on the modified_at in the body when either is given.
+@app.patch("/products/{product_id}", response_model=ProductSchema)
+def patch_existing_product(product_id: int, changes: ProductUpdate, request: Request, response: Response, db: Session = Depends(get_db),
+                           current_user: Principal = Depends(get_current_user)):
+    fields = changes.model_dump(exclude_unset=True, exclude={"modified_at"})
+    if not fields:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    expected = write_precondition(request, "product", product_id, lambda: get_product_modified_at(db, product_id), changes.modified_at)
+    try:
+        product = patch_product(db, product_id, fields, expected)
+    except ModifiedSinceRead:
+        raise HTTPException(status_code=412, detail="The product was modified since it was read")
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="The sku or category conflicts with existing data")
+    if product is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    response.headers["ETag"] = item_etag("product", product_id, product.modified_at)
+    return product
+
 @app.delete("/products/{product_id}", response_model=ProductSchema)
-def delete_existing_product(product_id: int, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+def delete_existing_product(product_id: int, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     deleted_product = delete_product(db, product_id)
     if deleted_product is None:
         raise HTTPException(status_code=404, detail="Product not found")
     return deleted_product
 
+# Unknown products are reported as 404, changes that would oversell as 409
+def stock_error(error: StockUnavailable):
+    if error.missing:
+        return HTTPException(status_code=404, detail=f"Product not found: {', '.join(map(str, error.missing))}")
+    return HTTPException(status_code=409, detail=f"Insufficient stock or stock limit exceeded: {', '.join(map(str, error.insufficient))}")
+
+@app.post("/products/{product_id}/stock", response_model=StockLevel)
+def change_product_stock(product_id: int, change: StockChange, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
+    try:
+        return apply_stock_changes(db, {product_id: change.delta})[0]
+    except StockUnavailable as e:
+        raise stock_error(e)
+
+@app.post("/products/stock:batch", response_model=StockLevels)
+def change_stock_batch(batch: StockBatch, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
+    # Lines for the same product are combined into one update
+    deltas = {}
+    for item in batch.items:
+        deltas[item.product_id] = deltas.get(item.product_id, 0) + item.delta
+    try:
+        return {"products": apply_stock_changes(db, deltas)}
+    except StockUnavailable as e:
+        raise stock_error(e)
+
 @app.get("/categories", response_model=List[CategorySchema])
-def list_categories(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    categories = get_categories(db, skip=skip, limit=limit)
+def list_categories(request: Request, response: Response, skip: int = 0, limit: int = 100, after_id: Optional[int] = Depends(get_after_id), db: Session = Depends(get_read_db)):
+    def load():
+        return [to_cached(CategorySchema, row) for row in get_categories(db, skip=skip, limit=limit, after_id=after_id)]
+    categories = catalog_cache.get_or_load(catalog_cache.list_key("categories", skip=skip, limit=limit, after=after_id), load,
+                                           fill=fills_cache(db), refresh=reads_own_writes(request))
+    etag, last_modified = list_etag("categories", categories), last_modified_of(categories)
+    if is_not_modified(request, etag, last_modified):
+        return not_modified(etag, last_modified)
+    set_cache_headers(response, etag, last_modified)
+    set_next_cursor(response, categories, limit)
     return categories
 
 @app.post("/categories", response_model=CategorySchema)
-def create_new_category(category: CategorySchema, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    db_category = create_category(db, Category(**category.dict()))
+def create_new_category(category: CategorySchema, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
+    try:
+        db_category = create_category(db, Category(**category.dict()))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return db_category
 
-@app.get("/categories/{category_id}", response_model=CategorySchema)
-def get_category_by_id(category_id: int, db: Session = Depends(get_db)):
-    category = get_category_by_id(db, category_id)
+# The category hierarchy with product count, stock and price range rolled up over each subtree
+@app.get("/categories/tree", response_model=List[CategoryNode])
+def read_category_tree(request: Request, response: Response, root: Optional[int] = None, db: Session = Depends(get_read_db)):
+    def load():
+        return get_category_tree(db, root)
+    tree = catalog_cache.get_or_load(catalog_cache.list_key("categories", "products", tree=root), load, fill=fills_cache(db),
+                                     refresh=reads_own_writes(request))
+    if tree is None:
+        raise HTTPException(status_code=404, detail="Category not found")
+    # Aggregates have no modification time of their own, so the validator covers the content
+    etag = make_etag("category-tree", dumps(tree).decode())
+    if is_not_modified(request, etag, None):
+        return not_modified(etag, None)
+    set_cache_headers(response, etag, None)
+    return tree
+
+@app.get("/categories/{category_id}", response_model=CategoryWithProducts, response_model_exclude_none=True)
+def retrieve_category(category_id: int, request: Request, response: Response, include: Optional[Literal["products"]] = None,
+                      db: Session = Depends(get_read_db)):
+    if include is None and is_conditional(request) and catalog_cache.peek(category_key(category_id)) is None:
+        # Revalidate from modified_at alone instead of loading the whole row
+        modified_at = get_category_modified_at(db, category_id)
+        if modified_at is not None:
+            etag = item_etag("category", category_id, modified_at)
+            if is_not_modified(request, etag, modified_at):
+                return not_modified(etag, modified_at)
+    def load():
+        if include == "products":
+            return to_cached(CategoryWithProducts, get_category_by_id(db, category_id, include_products=True))
+        return to_cached(CategorySchema, get_category_by_id(db, category_id))
+    cache_key = catalog_cache.list_key("categories", "products", id=category_id, include=include) if include else category_key(category_id)
+    category = catalog_cache.get_or_load(cache_key, load, fill=fills_cache(db), refresh=reads_own_writes(request))
     if category is None:
         raise HTTPException(status_code=404, detail="Category not found")
+    etag, last_modified = document_etag("category", category), last_modified_of([category])
+    if is_not_modified(request, etag, last_modified):
+        return not_modified(etag, last_modified)
+    set_cache_headers(response, etag, last_modified)
     return category
 
 @app.put("/categories/{category_id}", response_model=CategorySchema)
-def update_existing_category(category_id: int, category: CategorySchema, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    updated_category = update_category(db, category_id, Category(**category.dict()))
+def update_existing_category(category_id: int, category: CategorySchema, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
+    try:
+        updated_category = update_category(db, category_id, category)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if updated_category is None:
         raise HTTPException(status_code=404, detail="Category not found")
     return updated_category
 
+@app.patch("/categories/{category_id}", response_model=CategorySchema)
+def patch_existing_category(category_id: int, changes: CategoryUpdate, request: Request, response: Response, db: Session = Depends(get_db),
+                            current_user: Principal = Depends(get_current_user)):
+    fields = changes.model_dump(exclude_unset=True, exclude={"modified_at"})
+    if not fields:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    expected = write_precondition(request, "category", category_id, lambda: get_category_modified_at(db, category_id), changes.modified_at)
+    try:
+        category = patch_category(db, category_id, fields, expected)
+    except ModifiedSinceRead:
+        raise HTTPException(status_code=412, detail="The category was modified since it was read")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if category is None:
+        raise HTTPException(status_code=404, detail="Category not found")
+    response.headers["ETag"] = item_etag("category", category_id, category.modified_at)
+    return category
+
 @app.delete("/categories/{category_id}", response_model=CategorySchema)
-def delete_existing_category(category_id: int, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    deleted_category = delete_category(db, category_id)
+def delete_existing_category(category_id: int, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
+    try:
+        deleted_category = delete_category(db, category_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     if deleted_category is None:
         raise HTTPException(status_code=404, detail="Category not found")
     return deleted_category
 
+# Incremental sync: the product and category writes after a sequence, oldest first
+@app.get("/changes", response_model=ChangeFeed, response_class=FastJSONResponse)
+def read_changes(since: int = Query(0, ge=0), limit: int = Query(change_settings.batch_size, ge=1, le=change_settings.max_batch_size),
+                 db: Session = Depends(get_db)):
+    try:
+        return FastJSONResponse(get_changes(db, since, limit))
+    except ChangesPruned:
+        raise HTTPException(status_code=410, detail="Changes after this sequence have been pruned, resync from /products")
+
+# The same feed as Server-Sent Events; reconnecting clients resume from Last-Event-ID
+@app.get("/changes/stream")
+def stream_change_feed(request: Request, since: int = Query(0, ge=0),
+                       limit: int = Query(change_settings.batch_size, ge=1, le=change_settings.max_batch_size)):
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        since = int(last_event_id)
+    return StreamingResponse(stream_changes(since, limit), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/admin/pool")
+def read_pool_metrics(current_user: Principal = Depends(get_current_user)):
+    pools = {"primary": get_pool_metrics(engine.pool)}
+    if replicas.replica_set is not None:
+        pools["replicas"] = {replica.name: {**get_pool_metrics(replica.engine.pool), "ejected": replica.ejected_until > time.monotonic()}
+                             for replica in replicas.replica_set.replicas}
+    return pools
+
+# Readiness check for load balancers; reports the worker so multi-process deployments can be told apart
+@app.get("/health")
+def read_health(db: Session = Depends(get_db)):
+    try:
+        db.execute(text("SELECT 1"))
+    except SQLAlchemyError:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    return {"status": "ok", "worker": os.getpid()}
+
+# Serve the async application instead when the async database layer is enabled
+if db_settings.use_async:
+    from async_main import app
+
+# Development server; use serve.py to run several worker processes in production
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="127.0.0.1", port=8000)
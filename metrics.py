@@ -0,0 +1,203 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Optional
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import event
+from config import metrics_settings
+from pool_metrics import get_pool_metrics
+
+# Request and SQL instrumentation, exposed on /metrics in the Prometheus text format.
+# Nothing is installed unless metrics are enabled, so a disabled deployment pays no
+# per-request or per-statement cost at all.
+
+logger = logging.getLogger("catalog.sql")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.values = defaultdict(float)
+
+    def inc(self, *label_values, amount: float = 1.0):
+        with self.lock:
+            self.values[label_values] += amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        with self.lock:
+            values = sorted(self.values.items())
+        for label_values, value in values:
+            yield f"{self.name}{format_labels(self.labels, label_values)} {value}"
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        # Per label set: [counts per bucket (last one is +Inf), sum]
+        self.series = {}
+
+    def observe(self, value: float, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self.lock:
+            series = sorted((label_values, list(counts), total) for label_values, (counts, total) in self.series.items())
+        for label_values, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                bucket = format_labels(self.labels, label_values, f'le="{bound}"')
+                yield f"{self.name}_bucket{bucket} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labels, label_values)} {total}"
+            yield f"{self.name}_count{format_labels(self.labels, label_values)} {cumulative}"
+
+REQUESTS = Counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+REQUEST_QUERIES = Histogram("http_request_db_queries", "SQL statements run per HTTP request", ("method", "route"), QUERY_COUNT_BUCKETS)
+REQUEST_DB_TIME = Histogram("http_request_db_seconds", "Time spent in SQL statements per HTTP request", ("method", "route"))
+QUERY_LATENCY = Histogram("db_query_duration_seconds", "SQL statement latency")
+SLOW_QUERIES = Counter("db_slow_queries_total", "SQL statements slower than the slow query threshold", ("fingerprint",))
+METRICS = (REQUESTS, REQUEST_LATENCY, REQUEST_QUERIES, REQUEST_DB_TIME, QUERY_LATENCY, SLOW_QUERIES)
+
+class RequestStats:
+    """SQL work done on behalf of one HTTP request"""
+
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+# Set by the middleware; copied into the threadpool with the rest of the request context
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+PLACEHOLDER_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+PARAMETERS = re.compile(r"%\(\w+\)s|%s|:\w+|\?")
+WHITESPACE = re.compile(r"\s+")
+
+# Normalize a statement so that queries differing only in their values share one fingerprint
+def normalize_statement(statement: str) -> str:
+    statement = PARAMETERS.sub("?", LITERALS.sub("?", statement))
+    statement = PLACEHOLDER_LISTS.sub("(...)", statement)
+    return WHITESPACE.sub(" ", statement).strip()
+
+def fingerprint(statement: str) -> str:
+    return hashlib.sha1(normalize_statement(statement).encode()).hexdigest()[:12]
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    QUERY_LATENCY.observe(elapsed)
+    stats = current_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+    if elapsed >= metrics_settings.slow_query_seconds:
+        statement_fingerprint = fingerprint(statement)
+        SLOW_QUERIES.inc(statement_fingerprint)
+        logger.warning("Slow query %.3fs [%s] %s", elapsed, statement_fingerprint, normalize_statement(statement))
+
+# A failed statement never reaches after_cursor_execute, so drop its start time here
+def handle_error(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_started"):
+        connection.info["query_started"].pop()
+
+def instrument_engine(engine):
+    if not event.contains(engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+        event.listen(engine, "handle_error", handle_error)
+
+class MetricsMiddleware:
+    """Records latency, status and SQL work per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_request.reset(token)
+            # Label by route template (/products/{product_id}), never by raw path, to bound cardinality
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            REQUESTS.inc(method, route, status)
+            REQUEST_LATENCY.observe(elapsed, method, route)
+            REQUEST_QUERIES.observe(stats.queries, method, route)
+            REQUEST_DB_TIME.observe(stats.db_seconds, method, route)
+
+def render_pool(engine):
+    pool = get_pool_metrics(engine.pool)
+    for key in ("size", "checked_out", "idle", "overflow"):
+        yield f"# TYPE db_pool_{key} gauge"
+        yield f"db_pool_{key} {pool[key]}"
+    yield "# TYPE db_pool_checkouts_total counter"
+    yield f"db_pool_checkouts_total {pool['checkouts']}"
+
+def render_metrics(engine) -> str:
+    lines = [line for metric in METRICS for line in metric.render()]
+    lines.extend(render_pool(engine))
+    return "\n".join(lines) + "\n"
+
+# Add the middleware, SQL hooks and /metrics route to an app when metrics are enabled
+def install(app, engine):
+    if not metrics_settings.enabled:
+        return
+    instrument_engine(engine)
+    app.add_middleware(MetricsMiddleware)
+
+    def read_metrics():
+        return PlainTextResponse(render_metrics(engine), media_type="text/plain; version=0.0.4")
+    app.add_api_route("/metrics", read_metrics, methods=["GET"], include_in_schema=False)
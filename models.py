@@ -1,9 +1,14 @@
 from datetime import datetime
-from pydantic import BaseModel, Field, EmailStr
+from typing import ClassVar, List, Literal, Optional, Union
+from pydantic import BaseModel, Field, EmailStr, model_validator
+
+# Largest stock level the quantity column holds (a signed 32-bit INT on MySQL)
+MAX_QUANTITY = 2 ** 31 - 1
 
 class Category(BaseModel):
     id: int
     name: str = Field(..., description="Name of the product category")
+    parent_id: Optional[int] = Field(None, description="Category this one is nested under, none for a top-level category")
     created_at: datetime = Field(default_factory=datetime.utcnow, description="Timestamp of category creation")
     modified_at: datetime = Field(default_factory=datetime.utcnow, description="Timestamp of category modification")
 
@@ -16,15 +21,155 @@ class Product(BaseModel):
     category_id: int
     sku: str = Field(..., description="Stock Keeping Unit (unique product identifier)")
     price: float = Field(..., gt=0, description="Price of the product (must be positive)")
-    quantity: int = Field(..., ge=0, description="Quantity of the product in stock (must be non-negative)")
+    quantity: int = Field(..., ge=0, le=MAX_QUANTITY, description="Quantity of the product in stock (must be non-negative)")
     created_at: datetime = Field(default_factory=datetime.utcnow, description="Timestamp of product creation")
     modified_at: datetime = Field(default_factory=datetime.utcnow, description="Timestamp of product modification")
 
     class Config:
         from_attributes = True
 
+class PartialUpdate(BaseModel):
+    """Fields to change on a record; fields that are not sent keep their value, and only nullable ones may be sent as null"""
+    nullable_fields: ClassVar[frozenset] = frozenset()
+
+    @model_validator(mode="after")
+    def check_nulls(self):
+        nulls = sorted(name for name in self.model_fields_set - self.nullable_fields - {"modified_at"} if getattr(self, name) is None)
+        if nulls:
+            raise ValueError(f"{', '.join(nulls)} cannot be null")
+        return self
+
+class CategoryUpdate(PartialUpdate):
+    """Fields to change on a category; fields that are not sent keep their value, and parent_id null moves it to the top level"""
+    nullable_fields: ClassVar[frozenset] = frozenset({"parent_id"})
+    name: Optional[str] = Field(None, description="Name of the product category")
+    parent_id: Optional[int] = Field(None, description="Category to move this one under")
+    modified_at: Optional[datetime] = Field(None, description="Only apply the update if the category was last modified at this time")
+
+class ProductUpdate(PartialUpdate):
+    """Fields to change on a product; fields that are not sent keep their value"""
+    name: Optional[str] = Field(None, description="Name of the product")
+    category_id: Optional[int] = None
+    sku: Optional[str] = Field(None, description="Stock Keeping Unit (unique product identifier)")
+    price: Optional[float] = Field(None, gt=0, description="Price of the product (must be positive)")
+    quantity: Optional[int] = Field(None, ge=0, le=MAX_QUANTITY, description="Quantity of the product in stock (must be non-negative)")
+    modified_at: Optional[datetime] = Field(None, description="Only apply the update if the product was last modified at this time")
+
+class ProductWithCategory(Product):
+    """A product with its category embedded, returned for ?include=category"""
+    category: Optional[Category] = None
+
+class CategoryWithProducts(Category):
+    """A category with its products embedded, returned for ?include=products"""
+    products: Optional[List[Product]] = None
+
+class CategoryNode(BaseModel):
+    """A category with aggregates over the products in it and all of its subcategories"""
+    id: int
+    name: str
+    parent_id: Optional[int] = None
+    product_count: int
+    total_stock: int
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    children: List["CategoryNode"] = Field(default_factory=list)
+
+class ChangeEntry(BaseModel):
+    """One write to a product or category"""
+    sequence: int = Field(..., description="Position in the change feed; pass the last one seen as ?since=")
+    kind: Literal["product", "category"]
+    id: int
+    operation: Literal["insert", "update", "delete"]
+    changed_at: datetime
+    data: Optional[dict] = Field(None, description="The row as it is now, or null once it has been deleted")
+
+class ChangeFeed(BaseModel):
+    changes: List[ChangeEntry]
+    next: int = Field(..., description="Sequence to pass as ?since= on the next request")
+    has_more: bool = Field(..., description="Whether more changes can be read right away")
+
+class ProductFilters(BaseModel):
+    """Query parameters for filtering and sorting the product listing"""
+    category_id: Optional[int] = None
+    min_price: Optional[float] = Field(None, ge=0, description="Lowest price to include")
+    max_price: Optional[float] = Field(None, ge=0, description="Highest price to include")
+    in_stock: Optional[bool] = Field(None, description="Only products with (true) or without (false) stock")
+    name_prefix: Optional[str] = Field(None, min_length=1, max_length=255, description="Product name starts with")
+    sort: Literal["id", "-id", "price", "-price", "name", "-name"] = Field("id", description="Sort column, prefix with - for descending")
+
+class ProductBatch(BaseModel):
+    products: List[ProductWithCategory]
+    missing: List[Union[int, str]] = Field(..., description="Requested ids or skus that do not exist")
+
+class ProductSearchResults(BaseModel):
+    total: int = Field(..., description="Number of matching products")
+    products: List[ProductWithCategory] = Field(..., description="Best matches first")
+
+class ProductImport(BaseModel):
+    """A product row from a bulk import file, referencing its category by name or id"""
+    name: str = Field(..., description="Name of the product")
+    category: Optional[str] = Field(None, description="Name of the product category")
+    category_id: Optional[int] = None
+    sku: str = Field(..., description="Stock Keeping Unit (unique product identifier)")
+    price: float = Field(..., gt=0, description="Price of the product (must be positive)")
+    quantity: int = Field(..., ge=0, le=MAX_QUANTITY, description="Quantity of the product in stock (must be non-negative)")
+
+class ImportReport(BaseModel):
+    processed: int
+    imported: int
+    failed: int
+    errors: List[dict]
+    seconds: float
+    rows_per_second: float
+
+class StockChange(BaseModel):
+    """A relative change to a product's stock"""
+    action: Literal["reserve", "release", "adjust"] = Field(..., description="reserve removes units, release returns them, adjust adds or removes")
+    quantity: int = Field(..., ge=-MAX_QUANTITY, le=MAX_QUANTITY, description="Units to reserve or release, or a signed delta when adjusting")
+
+    @model_validator(mode="after")
+    def check_quantity(self):
+        if self.quantity == 0 or (self.action != "adjust" and self.quantity < 0):
+            raise ValueError("quantity must be positive, or non-zero when adjusting")
+        return self
+
+    @property
+    def delta(self) -> int:
+        return -self.quantity if self.action == "reserve" else self.quantity
+
+class StockBatchItem(StockChange):
+    product_id: int
+
+class StockBatch(BaseModel):
+    """Stock changes applied together, e.g. the lines of one order"""
+    items: List[StockBatchItem] = Field(..., min_length=1, max_length=100)
+
+class StockLevel(BaseModel):
+    id: int
+    quantity: int
+    modified_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class StockLevels(BaseModel):
+    products: List[StockLevel]
+
 class User(BaseModel):
     username: str
     email: EmailStr
     password: str
     created_at: datetime = Field(default_factory=datetime.utcnow, description="Timestamp of user creation")
+
+class Principal(BaseModel):
+    """The authenticated user behind a request"""
+    id: int
+    username: str
+    email: str
+
+    class Config:
+        from_attributes = True
+
+class Token(BaseModel):
+    access_token: str
+    token_type: str
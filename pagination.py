@@ -0,0 +1,67 @@
+import base64
+import binascii
+import json
+from typing import Optional
+from fastapi import HTTPException, Response
+
+# Keyset pagination helpers.
+# A cursor is an opaque, URL-safe token that records the position of the last
+# row on a page (its id and, when sorting by another column, that sort key).
+# Clients pass it back as `after` and the next page starts right after it, so
+# the database seeks straight to the position instead of skipping OFFSET rows.
+
+def encode_cursor(**position) -> str:
+    raw = json.dumps(position, separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> dict:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError("Malformed cursor")
+    if not isinstance(position, dict) or not isinstance(position.get("id"), int):
+        raise ValueError("Malformed cursor")
+    return position
+
+# Dependency that decodes the `after` query parameter into the position to resume listing from
+def get_after_position(after: Optional[str] = None):
+    if after is None:
+        return None
+    try:
+        return decode_cursor(after)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
+# Dependency that decodes the `after` query parameter into the id to resume listing from
+def get_after_id(after: Optional[str] = None):
+    position = get_after_position(after)
+    return None if position is None else position["id"]
+
+# Types a cursor's sort key can have, by sort column; the id sorts need no key
+SORT_KEY_TYPES = {"price": (int, float), "name": (str,)}
+
+# Split a cursor into the id and sort key to seek past, checking it was issued for this sort order
+def get_keyset(position: Optional[dict], sort: str = "id"):
+    if position is None:
+        return None, None
+    if position.get("s", "id") != sort:
+        raise HTTPException(status_code=400, detail="Pagination cursor was issued for a different sort order")
+    key, key_types = position.get("k"), SORT_KEY_TYPES.get(sort.lstrip("-"))
+    if key_types is not None and (isinstance(key, bool) or not isinstance(key, key_types)):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    return position["id"], key
+
+def row_value(row, field: str):
+    return row[field] if isinstance(row, dict) else getattr(row, field)
+
+# Expose the cursor for the next page when the current page is full
+def set_next_cursor(response: Response, rows: list, limit: int, sort: str = "id"):
+    if rows and len(rows) >= limit:
+        last = rows[-1]
+        field = sort.lstrip("-")
+        if field == "id" and sort == "id":
+            cursor = encode_cursor(id=row_value(last, "id"))
+        else:
+            cursor = encode_cursor(id=row_value(last, "id"), s=sort, k=row_value(last, field))
+        response.headers["X-Next-Cursor"] = cursor
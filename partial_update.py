@@ -0,0 +1,79 @@
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+from database import Product, Category, PRODUCT_COLUMNS, CATEGORY_COLUMNS, check_category_parent
+from cache import mark_changed
+from search import stage_products, stage_categories
+from category_tree import apply_product_changes, move_category, snapshot
+from change_log import record_changes
+
+# Partial updates (PATCH).
+# Only the fields a client sends are written, in one `UPDATE ... WHERE id = :id`
+# that hands back the updated row (with RETURNING where the dialect supports it),
+# instead of loading the row, rewriting every column and refreshing it. Passing the
+# modified_at the client last saw makes the UPDATE conditional, which gives
+# optimistic concurrency without holding row locks between the read and the write.
+
+class ModifiedSinceRead(Exception):
+    """Raised when a conditional update finds the row was changed by someone else"""
+
+# Update the given columns of one row and return it, or None when the row does not exist
+def patch_row(db: Session, model, columns, row_id: int, changes: dict, expected_modified_at: Optional[datetime] = None):
+    statement = update(model).where(model.id == row_id).values(**changes, modified_at=datetime.utcnow())
+    if expected_modified_at is not None:
+        statement = statement.where(model.modified_at == expected_modified_at)
+    if db.get_bind().dialect.update_returning:
+        row = db.execute(statement.returning(*columns)).first()
+    elif db.execute(statement).rowcount:
+        # Without RETURNING (MySQL) the updated row stays locked until commit, so reading it back is consistent
+        row = db.execute(select(*columns).where(model.id == row_id)).first()
+    else:
+        row = None
+    if row is None and expected_modified_at is not None and db.scalar(select(model.id).where(model.id == row_id)) is not None:
+        raise ModifiedSinceRead()
+    return row
+
+def patch_product(db: Session, product_id: int, changes: dict, expected_modified_at: Optional[datetime] = None):
+    try:
+        # Moving a product or changing its stock shifts category totals, which need the values being replaced
+        previous = None
+        if "category_id" in changes or "quantity" in changes:
+            previous = db.execute(
+                select(Product.category_id, Product.price, Product.quantity).where(Product.id == product_id).with_for_update()
+            ).first()
+        row = patch_row(db, Product, PRODUCT_COLUMNS, product_id, changes, expected_modified_at)
+        if row is not None:
+            mark_changed(db, Product, [row.id])
+            stage_products(db, [(row.id, row.name, row.sku, row.category_id)])
+            record_changes(db.connection(), "product", [row.id], "update")
+            if previous is not None:
+                apply_product_changes(db.connection(), [(tuple(previous), snapshot(row))])
+            elif "price" in changes:
+                # A price change alone leaves count and stock as they were; only the price range is re-read
+                apply_product_changes(db.connection(), [((row.category_id, None, row.quantity), snapshot(row))])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return row
+
+# Raises ValueError when the new parent does not exist or lies below the category
+def patch_category(db: Session, category_id: int, changes: dict, expected_modified_at: Optional[datetime] = None):
+    try:
+        old_path = None
+        if "parent_id" in changes:
+            check_category_parent(db, category_id, changes["parent_id"])
+            old_path = db.scalar(select(Category.path).where(Category.id == category_id).with_for_update())
+        row = patch_row(db, Category, CATEGORY_COLUMNS, category_id, changes, expected_modified_at)
+        if row is not None:
+            mark_changed(db, Category, [row.id])
+            stage_categories(db, [(row.id, row.name)])
+            record_changes(db.connection(), "category", [row.id], "update")
+            if "parent_id" in changes:
+                move_category(db.connection(), row.id, old_path, row.parent_id)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return row
@@ -0,0 +1,66 @@
+import threading
+import time
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+# Connection pool instrumentation.
+# The pools below time every checkout (waiting for a free connection, opening a new
+# one and the pre-ping) so pool sizes can be tuned per worker from real numbers.
+
+class PoolStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, elapsed: float, timed_out: bool = False):
+        with self.lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += elapsed
+            self.wait_max = max(self.wait_max, elapsed)
+
+class TimedPoolMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.stats.record(time.perf_counter() - start)
+        return connection
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+class TimedAsyncAdaptedQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+# Snapshot of a pool's occupancy and checkout wait times
+def get_pool_metrics(pool) -> dict:
+    metrics = {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+    }
+    stats = getattr(pool, "stats", None)
+    if stats is not None:
+        with stats.lock:
+            metrics.update({
+                "checkouts": stats.checkouts,
+                "timeouts": stats.timeouts,
+                "wait_seconds_total": round(stats.wait_total, 6),
+                "wait_seconds_avg": round(stats.wait_total / stats.checkouts, 6) if stats.checkouts else 0.0,
+                "wait_seconds_max": round(stats.wait_max, 6),
+            })
+    return metrics
@@ -0,0 +1,154 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from itertools import count
+from typing import Optional
+from fastapi import Request
+from sqlalchemy import create_engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session, sessionmaker
+from config import db_settings, metrics_settings
+from database import SessionLocal, get_pool_options
+from pool_metrics import TimedQueuePool
+from cache import catalog_cache
+import metrics
+
+# Read replicas.
+# GET handlers take their session from get_read_db, which binds it to a replica
+# connection, round-robin over the replicas that are currently healthy; writes keep
+# using get_db and the primary. Replicas lag behind the primary, so:
+#  - a client that has just written reads from the primary (a cookie set on
+#    successful writes that lasts replica_sticky_seconds), so it sees its own changes,
+#    and skips cached entries, which another worker may have filled before the write;
+#  - for replica_sticky_seconds after any worker's write reaches the read cache
+#    (CatalogCache.last_write), replica reads are not stored in it (see fills_cache),
+#    so the entries that write invalidated are not filled again from a replica that
+#    has not caught up.
+# A replica that fails to connect is ejected for replica_eject_seconds and the read
+# falls through to the next one, and finally to the primary. Replica engines are
+# instrumented like the primary when metrics are enabled.
+
+logger = logging.getLogger("catalog.replicas")
+
+STICKY_COOKIE = "read_primary_until"
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+class Replica:
+    def __init__(self, url: str):
+        self.engine = create_engine(
+            url,
+            poolclass=TimedQueuePool,
+            connect_args={"check_same_thread": False} if url.startswith("sqlite") else {},
+            **get_pool_options(),
+        )
+        self.name = self.engine.url.render_as_string(hide_password=True)
+        self.ejected_until = 0.0
+        if metrics_settings.enabled:
+            metrics.instrument_engine(self.engine)
+
+class ReplicaSet:
+    def __init__(self, urls, sticky_seconds: float = db_settings.replica_sticky_seconds,
+                 eject_seconds: float = db_settings.replica_eject_seconds):
+        self.replicas = [Replica(url) for url in urls]
+        self.sticky_seconds = sticky_seconds
+        self.eject_seconds = eject_seconds
+        self.turn = count()
+        self.lock = threading.Lock()
+
+    def healthy(self, now: float) -> list:
+        return [replica for replica in self.replicas if replica.ejected_until <= now]
+
+    def eject(self, replica: Replica, error: Exception):
+        replica.ejected_until = time.monotonic() + self.eject_seconds
+        logger.warning("Ejecting replica %s for %ss: %s", replica.name, self.eject_seconds, error)
+
+    # A connection to the next healthy replica, or None when none can be reached
+    def connect(self):
+        now = time.monotonic()
+        candidates = self.healthy(now)
+        with self.lock:
+            start = next(self.turn)
+        for offset in range(len(candidates)):
+            replica = candidates[(start + offset) % len(candidates)]
+            try:
+                return replica, replica.engine.connect()
+            except DBAPIError as e:
+                self.eject(replica, e)
+        return None
+
+    # Drop connections inherited from a parent process, as database.py does for the primary
+    def reset_after_fork(self):
+        for replica in self.replicas:
+            replica.engine.dispose(close=False)
+
+    def dispose(self):
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+def build_replica_set() -> Optional[ReplicaSet]:
+    urls = [url.strip() for url in (db_settings.replica_urls or "").split(",") if url.strip()]
+    return ReplicaSet(urls) if urls else None
+
+replica_set = build_replica_set()
+if replica_set is not None and hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=replica_set.reset_after_fork)
+
+ReadSession = sessionmaker(autocommit=False, autoflush=False)
+
+# A session for reads: on a replica when one is available, on the primary otherwise
+@contextmanager
+def read_session(prefer_primary: bool = False):
+    routed = None if prefer_primary or replica_set is None else replica_set.connect()
+    if routed is None:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+        return
+    replica, connection = routed
+    db = ReadSession(bind=connection)
+    db.info["replica"] = replica.name
+    try:
+        yield db
+    finally:
+        db.close()
+        connection.close()
+
+def reads_own_writes(request: Request) -> bool:
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+# Whether rows read in this session may be stored in the read cache: not from a replica that may be behind the latest write
+def fills_cache(db: Session) -> bool:
+    if "replica" not in db.info or replica_set is None:
+        return True
+    return time.time() - catalog_cache.last_write() >= replica_set.sticky_seconds
+
+# Dependency for GET handlers
+def get_read_db(request: Request):
+    with read_session(prefer_primary=reads_own_writes(request)) as db:
+        yield db
+
+# Marks clients that have written so their next reads go to the primary; does nothing without replicas
+class ReadYourWritesMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in READ_METHODS or replica_set is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and 200 <= message["status"] < 400:
+                sticky = replica_set.sticky_seconds
+                cookie = f"{STICKY_COOKIE}={time.time() + sticky:.3f}; Max-Age={max(int(sticky), 1)}; Path=/; HttpOnly; SameSite=Lax"
+                message = {**message, "headers": [*message.get("headers", []), (b"set-cookie", cookie.encode())]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
@@ -0,0 +1,349 @@
+import math
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+from heapq import nsmallest
+from itertools import chain
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+from database import Product, Category, Change
+from change_log import get_changes, ChangesPruned
+
+# In-process product search.
+# Product names, skus and category names are kept in inverted indexes that are
+# loaded from the database on first use and then updated incrementally when a
+# session commits Product or Category changes, like the read cache in cache.py.
+# Each worker process keeps its own index; writes made by other workers or other
+# processes (e.g. `python bulk_import.py`) reach it through the change feed in
+# change_log.py, which every search reads past the last sequence the index applied.
+
+TOKEN_PATTERN = re.compile(r"[0-9a-z]+")
+
+# Relevance weights per field and match kind
+SKU_EXACT = 10.0
+SKU_PREFIX = 4.0
+NAME_EXACT = 2.0
+NAME_PREFIX = 1.4
+NAME_FUZZY = 1.0
+CATEGORY_MATCH = 0.8
+
+# Keep prefix and typo expansion bounded so short queries stay fast
+MIN_PREFIX_LENGTH = 2
+MIN_FUZZY_LENGTH = 4
+MAX_EXPANSIONS = 50
+
+# Changes read per query while catching up, and the backlog beyond which a full rebuild is cheaper
+CATCH_UP_BATCH = 1000
+REBUILD_BACKLOG = 20000
+
+def tokenize(text: str):
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+# Variants of a term with one character removed, used to find terms one edit away
+def deletes(term: str):
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+# True when two terms are at most one insertion, deletion, substitution or transposition apart
+def within_one_edit(a: str, b: str) -> bool:
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return (a[i + 1:] == b[i + 1:]
+                or (i + 1 < len(a) and a[i] == b[i + 1] and a[i + 1] == b[i] and a[i + 2:] == b[i + 2:]))
+    return a[i:] == b[i + 1:]
+
+class TermIndex:
+    """Inverted index from terms to ids, with prefix and one-typo lookups"""
+
+    # An unordered index is being loaded in bulk: its terms are sorted once by sort_terms, since
+    # keeping them sorted term by term is quadratic on a large catalog
+    def __init__(self, fuzzy: bool = True, ordered: bool = True):
+        self.postings = {}
+        self.terms = []
+        self.fuzzy = fuzzy
+        self.ordered = ordered
+        self.variants = defaultdict(set)
+
+    def add(self, term: str, doc_id: int):
+        posting = self.postings.get(term)
+        if posting is None:
+            posting = self.postings[term] = set()
+            if self.ordered:
+                insort(self.terms, term)
+            if self.fuzzy and len(term) >= MIN_FUZZY_LENGTH:
+                for variant in deletes(term):
+                    self.variants[variant].add(term)
+        posting.add(doc_id)
+
+    def remove(self, term: str, doc_id: int):
+        posting = self.postings.get(term)
+        if posting is None:
+            return
+        posting.discard(doc_id)
+        if not posting:
+            del self.postings[term]
+            if self.ordered:
+                del self.terms[bisect_left(self.terms, term)]
+            if self.fuzzy and len(term) >= MIN_FUZZY_LENGTH:
+                for variant in deletes(term):
+                    self.variants[variant].discard(term)
+                    if not self.variants[variant]:
+                        del self.variants[variant]
+
+    def sort_terms(self):
+        self.terms = sorted(self.postings)
+        self.ordered = True
+
+    def prefixed(self, prefix: str):
+        start = bisect_left(self.terms, prefix)
+        for term in self.terms[start:start + MAX_EXPANSIONS]:
+            if not term.startswith(prefix):
+                break
+            if term != prefix:
+                yield term
+
+    def similar(self, term: str):
+        if not self.fuzzy or len(term) < MIN_FUZZY_LENGTH:
+            return set()
+        candidates = set(self.variants.get(term, ()))
+        for variant in deletes(term):
+            candidates.add(variant)
+            candidates.update(self.variants.get(variant, ()))
+        return {candidate for candidate in candidates
+                if candidate != term and candidate in self.postings and within_one_edit(term, candidate)}
+
+    # Matching terms with their match weight: exact, then prefix, then one typo away
+    def expand(self, token: str, exact: float, prefix: float, fuzzy: float):
+        matches = {}
+        if token in self.postings:
+            matches[token] = exact
+        if len(token) >= MIN_PREFIX_LENGTH:
+            for term in self.prefixed(token):
+                matches.setdefault(term, prefix)
+        # Only look for typos when the token is not a known term itself
+        if token not in self.postings:
+            for term in list(self.similar(token))[:MAX_EXPANSIONS]:
+                matches.setdefault(term, fuzzy)
+        return matches
+
+    def idf(self, term: str, total: int) -> float:
+        return math.log(1 + total / len(self.postings[term]))
+
+class ProductSearchIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        # Held while reading the change feed, so only one thread at a time applies what it read
+        self.catching_up = threading.Lock()
+        self.built = False
+        # Last change feed sequence reflected in the index
+        self.sequence = 0
+        self.products = {}
+        self.categories = {}
+        self.category_products = defaultdict(set)
+        self.names = TermIndex()
+        self.skus = TermIndex(fuzzy=False)
+        self.category_names = TermIndex()
+
+    def rebuild(self, db: Session, batch_size: int = 10000):
+        with self.lock:
+            self.products.clear()
+            self.categories.clear()
+            self.category_products.clear()
+            self.names = TermIndex(ordered=False)
+            self.skus = TermIndex(fuzzy=False, ordered=False)
+            self.category_names = TermIndex(ordered=False)
+            # Taken before the rows are read, so writes that land meanwhile are applied again by catch_up
+            self.sequence = db.scalar(select(func.max(Change.id))) or 0
+            for category_id, name in db.execute(select(Category.id, Category.name)):
+                self.put_category(category_id, name)
+            rows = db.execute(select(Product.id, Product.name, Product.sku, Product.category_id).execution_options(yield_per=batch_size))
+            for product_id, name, sku, category_id in rows:
+                self.put_product(product_id, name, sku, category_id)
+            for index in (self.names, self.skus, self.category_names):
+                index.sort_terms()
+            self.built = True
+
+    def ensure_built(self, db: Session):
+        if not self.built:
+            with self.lock:
+                if not self.built:
+                    self.rebuild(db)
+
+    # Apply the writes logged after the index's sequence, from any process
+    def catch_up(self, db: Session):
+        if not self.catching_up.acquire(blocking=False):
+            # Another thread is already applying the same changes
+            return
+        try:
+            latest = db.scalar(select(func.max(Change.id))) or 0
+            if latest - self.sequence > REBUILD_BACKLOG:
+                self.rebuild(db)
+                return
+            while latest > self.sequence:
+                try:
+                    feed = get_changes(db, self.sequence, CATCH_UP_BATCH)
+                except ChangesPruned:
+                    self.rebuild(db)
+                    return
+                with self.lock:
+                    for change in feed["changes"]:
+                        data = change["data"]
+                        if change["kind"] == "product":
+                            self.apply([("product", change["id"], data and (data["name"], data["sku"], data["category_id"]))])
+                        else:
+                            self.apply([("category", change["id"], data and data["name"])])
+                    self.sequence = feed["next"]
+                # A change that has not committed yet is picked up by a later search
+                if not feed["has_more"] or not feed["changes"]:
+                    break
+        finally:
+            self.catching_up.release()
+
+    # Build the index on first use and bring it up to date with the change feed
+    def refresh(self, db: Session):
+        self.ensure_built(db)
+        self.catch_up(db)
+
+    def put_product(self, product_id: int, name: str, sku: str, category_id):
+        self.remove_product(product_id)
+        self.products[product_id] = (name, sku, category_id)
+        for term in set(tokenize(name)):
+            self.names.add(term, product_id)
+        if sku:
+            self.skus.add(sku.lower(), product_id)
+        self.category_products[category_id].add(product_id)
+
+    def remove_product(self, product_id: int):
+        document = self.products.pop(product_id, None)
+        if document is None:
+            return
+        name, sku, category_id = document
+        for term in set(tokenize(name)):
+            self.names.remove(term, product_id)
+        if sku:
+            self.skus.remove(sku.lower(), product_id)
+        self.category_products[category_id].discard(product_id)
+
+    def put_category(self, category_id: int, name: str):
+        self.remove_category(category_id)
+        self.categories[category_id] = name
+        for term in set(tokenize(name)):
+            self.category_names.add(term, category_id)
+
+    def remove_category(self, category_id: int):
+        name = self.categories.pop(category_id, None)
+        if name is not None:
+            for term in set(tokenize(name)):
+                self.category_names.remove(term, category_id)
+
+    # Products matching one query token, as (weight, product ids) tiers
+    def match_token(self, token: str):
+        total = max(len(self.products), 1)
+        tiers = []
+        for term, weight in self.skus.expand(token, SKU_EXACT, SKU_PREFIX, 0).items():
+            tiers.append((weight, self.skus.postings[term]))
+        for term, weight in self.names.expand(token, NAME_EXACT, NAME_PREFIX, NAME_FUZZY).items():
+            tiers.append((weight * self.names.idf(term, total), self.names.postings[term]))
+        category_total = max(len(self.categories), 1)
+        for term, weight in self.category_names.expand(token, 1.0, 0.7, 0.5).items():
+            product_ids = set().union(*(self.category_products.get(category_id, ()) for category_id in self.category_names.postings[term]))
+            tiers.append((CATEGORY_MATCH * weight * self.category_names.idf(term, category_total), product_ids))
+        tiers.sort(key=lambda tier: tier[0], reverse=True)
+        return tiers
+
+    # Product ids matching every query token, best first, with the number of matches.
+    # Scoring works on sets: candidates are split into groups that share the same
+    # best tier for each token, so the cost grows with the number of distinct scores
+    # rather than the number of matching products.
+    def search(self, query: str, limit: int = 20):
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return [], 0
+        with self.lock:
+            token_tiers = [self.match_token(token) for token in tokens]
+            matched = sorted((set().union(*(ids for _, ids in tiers)) for tiers in token_tiers), key=len)
+            candidates = matched[0].intersection(*matched[1:])
+            if not candidates:
+                return [], 0
+            groups = [(0.0, candidates)]
+            for tiers in token_tiers:
+                split = []
+                for score, group in groups:
+                    remaining = group
+                    for weight, ids in tiers:
+                        part = remaining & ids
+                        if part:
+                            split.append((score + weight, part))
+                            remaining = remaining - part
+                            if not remaining:
+                                break
+                groups = split
+        groups.sort(key=lambda group: group[0], reverse=True)
+        product_ids = []
+        for _, group in groups:
+            product_ids += nsmallest(limit - len(product_ids), group)
+            if len(product_ids) >= limit:
+                break
+        return product_ids, len(candidates)
+
+    def apply(self, changes: list):
+        with self.lock:
+            if not self.built:
+                return
+            for kind, row_id, data in changes:
+                if kind == "product":
+                    if data is None:
+                        self.remove_product(row_id)
+                    else:
+                        self.put_product(row_id, *data)
+                elif data is None:
+                    self.remove_category(row_id)
+                else:
+                    self.put_category(row_id, data)
+
+search_index = ProductSearchIndex()
+
+# Ranked product ids matching a query and the number of matches, on an index brought up to date first
+def search_products(db: Session, query: str, limit: int = 20):
+    search_index.refresh(db)
+    return search_index.search(query, limit=limit)
+
+# Record products written outside the ORM unit of work (e.g. bulk Core statements);
+# rows are (id, name, sku, category_id) tuples
+def stage_products(session, rows):
+    changes = session.info.setdefault("search_changes", [])
+    changes.extend(("product", product_id, (name, sku, category_id)) for product_id, name, sku, category_id in rows)
+
+# Same for categories; rows are (id, name) tuples
+def stage_categories(session, rows):
+    changes = session.info.setdefault("search_changes", [])
+    changes.extend(("category", category_id, name) for category_id, name in rows)
+
+# Snapshot changed rows at flush time; attributes are expired by the time the session commits
+@event.listens_for(Session, "after_flush")
+def collect_search_changes(session, flush_context):
+    changes = session.info.setdefault("search_changes", [])
+    for obj in chain(session.new, session.dirty):
+        if isinstance(obj, Product):
+            changes.append(("product", obj.id, (obj.name, obj.sku, obj.category_id)))
+        elif isinstance(obj, Category):
+            changes.append(("category", obj.id, obj.name))
+    for obj in session.deleted:
+        if isinstance(obj, (Product, Category)):
+            changes.append(("product" if isinstance(obj, Product) else "category", obj.id, None))
+
+@event.listens_for(Session, "after_commit")
+def apply_search_changes(session):
+    changes = session.info.pop("search_changes", None)
+    if changes:
+        search_index.apply(changes)
+
+@event.listens_for(Session, "after_rollback")
+def discard_search_changes(session):
+    session.info.pop("search_changes", None)
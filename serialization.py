@@ -0,0 +1,35 @@
+import json
+from datetime import datetime
+from typing import Any, Sequence
+from fastapi.responses import JSONResponse
+
+# orjson is optional; without it responses fall back to the standard library encoder
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Fast path for list endpoints.
+# Rows are selected as plain column tuples and turned into JSON ready dicts
+# directly, skipping ORM identity tracking and per-row Pydantic validation.
+# The values come straight from the database, which already enforces the
+# schema, so re-validating them on every read only costs CPU.
+
+def json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+# Column tuples to dicts with the same keys and value formats as Schema.model_dump(mode="json")
+def rows_to_dicts(columns: Sequence, rows) -> list:
+    keys = [column.key for column in columns]
+    return [{key: json_value(value) for key, value in zip(keys, row)} for row in rows]
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson when it is installed"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
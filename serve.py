@@ -0,0 +1,64 @@
+import argparse
+import logging
+import os
+from config import db_settings, server_settings, cache_settings
+
+# Production entry point.
+# Runs the API in several worker processes under uvicorn's process manager, so that
+# sync handlers, JSON encoding and bcrypt use every core instead of one. Each worker
+# imports the application on its own and goes through lifecycle.lifespan: it starts
+# with an empty connection pool, opens and checks its warm connections, builds its
+# caches, and only then accepts requests. On SIGTERM or SIGINT the workers stop
+# accepting connections, give in-flight requests the graceful timeout to finish,
+# and close their pools. Dead workers are replaced by the manager.
+#
+#   python serve.py --workers 4
+#   gunicorn main:app -k uvicorn.workers.UvicornWorker -w 4 --graceful-timeout 30   (same lifecycle)
+
+logger = logging.getLogger("catalog.server")
+
+def worker_count(requested: int = 0) -> int:
+    return requested if requested > 0 else os.cpu_count() or 1
+
+# Every worker has its own pool, so the database must accept workers x (pool_size + max_overflow) connections
+def connection_budget(workers: int) -> dict:
+    per_worker = db_settings.pool_size + db_settings.max_overflow
+    return {"workers": workers, "connections_per_worker": per_worker, "max_connections": workers * per_worker}
+
+def server_options(args) -> dict:
+    return {
+        # main serves the async application itself when db_settings.use_async is set
+        "app": "main:app",
+        "host": args.host,
+        "port": args.port,
+        "workers": worker_count(args.workers),
+        "timeout_graceful_shutdown": args.graceful_timeout,
+        "timeout_keep_alive": server_settings.keepalive_timeout,
+        "proxy_headers": True,
+        "forwarded_allow_ips": server_settings.forwarded_allow_ips,
+        # A worker whose startup fails exits instead of serving without warm connections
+        "lifespan": "on",
+        "access_log": args.access_log,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the catalog API with several worker processes")
+    parser.add_argument("--host", default=server_settings.host, help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=server_settings.port, help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=server_settings.workers, help="Worker processes, one per CPU core when 0")
+    parser.add_argument("--graceful-timeout", type=int, default=server_settings.graceful_timeout,
+                        help="Seconds in-flight requests get to finish on shutdown")
+    parser.add_argument("--access-log", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    options = server_options(args)
+    logger.info("Starting %(workers)s workers, up to %(max_connections)s database connections", connection_budget(options["workers"]))
+    if options["workers"] > 1 and cache_settings.backend == "memory" and cache_settings.follow_seconds <= 0:
+        logger.warning("Workers do not follow each other's writes (CACHE_FOLLOW_SECONDS=0), so cached reads can be stale for up to CACHE_TTL")
+
+    import uvicorn
+    uvicorn.run(**options)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+from datetime import datetime
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+from database import Product
+from models import MAX_QUANTITY
+from cache import mark_changed
+from category_tree import apply_stock_deltas
+from change_log import record_changes
+
+# Atomic stock changes.
+# Each change is a single conditional UPDATE that applies a delta in the database,
+# `quantity = quantity - :n WHERE quantity >= :n` for reservations, instead of
+# reading the row and writing back a new quantity. Concurrent checkouts therefore
+# never lose updates, and a reservation that cannot be met simply matches no row.
+
+STOCK_COLUMNS = (Product.id, Product.quantity, Product.modified_at, Product.category_id)
+
+class StockUnavailable(Exception):
+    """Raised when products are missing or a change would take their quantity below zero"""
+
+    def __init__(self, missing: list, insufficient: list):
+        super().__init__(f"missing={missing} insufficient={insufficient}")
+        self.missing = missing
+        self.insufficient = insufficient
+
+# Apply one delta, returning the new (id, quantity, modified_at, category_id) or None when no row matched
+def change_stock(db: Session, product_id: int, delta: int, now: datetime):
+    statement = update(Product).where(Product.id == product_id).values(quantity=Product.quantity + delta, modified_at=now)
+    if delta < 0:
+        statement = statement.where(Product.quantity >= -delta)
+    else:
+        # An increase past what the column holds matches no row, like an oversell, instead of failing in the database
+        statement = statement.where(Product.quantity <= MAX_QUANTITY - delta)
+    if db.get_bind().dialect.update_returning:
+        return db.execute(statement.returning(*STOCK_COLUMNS)).first()
+    # Without RETURNING (MySQL) the updated row stays locked until commit, so reading it back is consistent
+    if db.execute(statement).rowcount == 0:
+        return None
+    return db.execute(select(*STOCK_COLUMNS).where(Product.id == product_id)).first()
+
+# Apply deltas keyed by product id in one transaction: either every change is applied or none
+def apply_stock_changes(db: Session, deltas: dict) -> list:
+    now = datetime.utcnow()
+    rows, failed = {}, []
+    try:
+        # A fixed lock order keeps concurrent multi-line orders from deadlocking each other
+        for product_id in sorted(deltas):
+            row = change_stock(db, product_id, deltas[product_id], now)
+            if row is None:
+                failed.append(product_id)
+            else:
+                rows[product_id] = row
+        if failed:
+            existing = set(db.scalars(select(Product.id).where(Product.id.in_(failed))))
+            raise StockUnavailable([product_id for product_id in failed if product_id not in existing],
+                                   [product_id for product_id in failed if product_id in existing])
+        mark_changed(db, Product, list(rows))
+        apply_stock_deltas(db.connection(), [(product_id, row.category_id, deltas[product_id]) for product_id, row in rows.items()])
+        record_changes(db.connection(), "product", sorted(rows), "update", now)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return [rows[product_id] for product_id in deltas]
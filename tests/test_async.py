@@ -0,0 +1,65 @@
+import asyncio
+from fastapi.testclient import TestClient
+from async_main import app
+from async_database import AsyncSessionLocal, get_products, get_product_by_id
+
+# Create a test client for the async application
+client = TestClient(app)
+
+# Test case for the async CRUD round trip
+def test_async_product_crud(auth_headers):
+    """
+    Tests creating, reading, updating and deleting a product through the async routes.
+    """
+    category = {"id": 9001, "name": "Async Category"}
+    assert client.post("/categories", json=category, headers=auth_headers).status_code == 200
+
+    product_data = {"id": 9001, "name": "Async Product", "category_id": 9001, "sku": "ASYNC-1", "price": 9.99, "quantity": 3}
+    response = client.post("/products", json=product_data, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()["sku"] == "ASYNC-1"
+
+    response = client.get("/products/9001")
+    assert response.status_code == 200
+    assert response.json()["name"] == "Async Product"
+
+    product_data["quantity"] = 7
+    response = client.put("/products/9001", json=product_data, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()["quantity"] == 7
+
+    assert client.delete("/products/9001", headers=auth_headers).status_code == 200
+    assert client.get("/products/9001").status_code == 404
+    assert client.delete("/categories/9001", headers=auth_headers).status_code == 200
+
+# Test case for async listing with a cursor
+def test_async_list_products_with_cursor(auth_headers):
+    """
+    Tests that the async listing hands out a cursor and resumes after it.
+    """
+    assert client.post("/categories", json={"id": 9002, "name": "Async Paging"}, headers=auth_headers).status_code == 200
+    for product_id in (9010, 9011, 9012):
+        product_data = {"id": product_id, "name": f"Paged {product_id}", "category_id": 9002, "sku": f"PAGE-{product_id}", "price": 1.0, "quantity": 1}
+        assert client.post("/products", json=product_data, headers=auth_headers).status_code == 200
+
+    first_page = client.get("/products", params={"limit": 2})
+    assert first_page.status_code == 200
+    cursor = first_page.headers["X-Next-Cursor"]
+    next_page = client.get("/products", params={"limit": 2, "after": cursor})
+    assert next_page.status_code == 200
+    assert next_page.json()[0]["id"] > first_page.json()[-1]["id"]
+
+# Test case for calling the async CRUD functions directly
+def test_async_crud_functions():
+    """
+    Tests the async CRUD functions outside of a request.
+    """
+    async def run():
+        async with AsyncSessionLocal() as db:
+            products = await get_products(db, limit=1000)
+            missing = await get_product_by_id(db, -1)
+            return products, missing
+
+    products, missing = asyncio.run(run())
+    assert isinstance(products, list)
+    assert missing is None
@@ -0,0 +1,93 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from main import app
+import auth
+from auth import create_access_token, get_current_user_from_token, revoke_user_tokens, PasswordHasher, PasswordHasherBusy
+from database import SessionLocal
+
+# Create a test client
+client = TestClient(app)
+
+# Test case for logging in
+def test_login(test_user):
+    """
+    Tests that valid credentials return a bearer token and invalid ones are rejected.
+    """
+    response = client.post("/token", data={"username": "testuser", "password": "testpassword"})
+    assert response.status_code == 200
+    assert response.json()["token_type"] == "bearer"
+
+    response = client.post("/token", data={"username": "testuser", "password": "wrong"})
+    assert response.status_code == 401
+
+# Test case for writes requiring a valid token
+@pytest.mark.parametrize("headers", [{}, {"Authorization": "Bearer not-a-token"}])
+def test_write_requires_valid_token(headers):
+    """
+    Tests that write requests without a valid token are rejected.
+    """
+    response = client.post("/categories", json={"id": 9500, "name": "Unauthorized"}, headers=headers)
+    assert response.status_code == 401
+
+# Test case for the principal cache
+def test_principal_cache_skips_database(test_user):
+    """
+    Tests that a token is resolved from the database once and then from the principal cache.
+    """
+    token = create_access_token(data={"user_id": test_user})
+    db = SessionLocal()
+    try:
+        assert get_current_user_from_token(db, token).username == "testuser"
+        db.close()
+
+        class NoDatabase:
+            def query(self, *args):
+                pytest.fail("principal cache miss")
+
+        assert get_current_user_from_token(NoDatabase(), token).id == test_user
+    finally:
+        db.close()
+
+# Test case for revoking a single token
+def test_revoke_token(test_user):
+    """
+    Tests that a revoked token stops working even though its principal was cached.
+    """
+    token = create_access_token(data={"user_id": test_user})
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/admin/pool", headers=headers).status_code == 200
+    assert client.post("/token/revoke", headers=headers).status_code == 204
+    assert client.get("/admin/pool", headers=headers).status_code == 401
+
+# Test case for revoking every token of a user
+def test_revoke_user_tokens(test_user, monkeypatch):
+    """
+    Tests that tokens issued before a user-wide revocation are rejected and later ones accepted.
+    """
+    monkeypatch.setattr(auth, "revocation_backend", auth.MemoryBackend())
+    token = create_access_token(data={"user_id": test_user})
+    db = SessionLocal()
+    try:
+        assert get_current_user_from_token(db, token) is not None
+        revoke_user_tokens(test_user)
+        assert get_current_user_from_token(db, token) is None
+    finally:
+        db.close()
+
+# Test case for shedding logins when the hashing pool is saturated
+def test_password_hasher_sheds_load():
+    """
+    Tests that password checks beyond the queue limit are refused instead of queued.
+    """
+    hasher = PasswordHasher(workers=1, max_pending=1)
+    hashed = auth.hash_password("secret")
+
+    async def run():
+        first = asyncio.ensure_future(hasher.verify("secret", hashed))
+        await asyncio.sleep(0)
+        with pytest.raises(PasswordHasherBusy):
+            await hasher.verify("secret", hashed)
+        return await first
+
+    assert asyncio.run(run()) is True
@@ -0,0 +1,53 @@
+import pytest
+from fastapi.testclient import TestClient
+from main import app
+
+# Create a test client
+client = TestClient(app)
+
+@pytest.fixture(scope="module")
+def seed_products(auth_headers):
+    """
+    Seeds a category with three products for batch lookups.
+    """
+    client.post("/categories", json={"id": 9200, "name": "Batch Category"}, headers=auth_headers)
+    for product_id in (9201, 9202, 9203):
+        product_data = {"id": product_id, "name": f"Batch {product_id}", "category_id": 9200, "sku": f"BATCH-{product_id}", "price": 5.0, "quantity": 1}
+        client.post("/products", json=product_data, headers=auth_headers)
+    yield
+    for product_id in (9201, 9202, 9203):
+        client.delete(f"/products/{product_id}", headers=auth_headers)
+    client.delete("/categories/9200", headers=auth_headers)
+
+# Test case for fetching a batch by id
+@pytest.mark.usefixtures("seed_products")
+def test_batch_by_ids_keeps_order():
+    """
+    Tests that products come back in request order with missing ids reported.
+    """
+    response = client.get("/products:batch", params={"ids": "9203,9201,-5,9202"})
+    assert response.status_code == 200
+    body = response.json()
+    assert [product["id"] for product in body["products"]] == [9203, 9201, 9202]
+    assert body["missing"] == [-5]
+
+# Test case for fetching a batch by sku with repeated parameters
+@pytest.mark.usefixtures("seed_products")
+def test_batch_by_skus():
+    """
+    Tests batch lookups by sku, given as repeated query parameters.
+    """
+    response = client.get("/products:batch", params=[("skus", "BATCH-9202"), ("skus", "NOPE")])
+    assert response.status_code == 200
+    body = response.json()
+    assert [product["sku"] for product in body["products"]] == ["BATCH-9202"]
+    assert body["missing"] == ["NOPE"]
+
+# Test case for invalid batch requests
+@pytest.mark.parametrize("params", [{}, {"ids": "1", "skus": "A"}, {"ids": "one"}, {"ids": ",".join(map(str, range(101)))}])
+def test_batch_rejects_invalid_requests(params):
+    """
+    Tests that empty, ambiguous, malformed and oversized batches are rejected.
+    """
+    response = client.get("/products:batch", params=params)
+    assert response.status_code == 400
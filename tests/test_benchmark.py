@@ -0,0 +1,48 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+from benchmark import parse_mix, percentile, synthetic_products, seed_prefix
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Test case for the synthetic catalog
+def test_synthetic_products():
+    """
+    Tests that the synthetic catalog is reproducible and spread over the requested categories.
+    """
+    first = list(synthetic_products(50, 5, seed=7))
+    assert first == list(synthetic_products(50, 5, seed=7))
+    assert len({product["sku"] for product in first}) == 50
+    assert len({product["category"] for product in first}) == 5
+    assert "Games" in {product["category"] for product in first}
+    assert all(product["sku"].startswith(seed_prefix(5, 7)) for product in first)
+    assert not {product["sku"] for product in first} & {product["sku"] for product in synthetic_products(50, 5, seed=8)}
+
+# Test case for the report helpers
+def test_report_helpers():
+    """
+    Tests the request mix parser and nearest-rank percentiles.
+    """
+    assert parse_mix("read=3,write=1") == {"read": 3.0, "write": 1.0}
+    with pytest.raises(ValueError):
+        parse_mix("delete=1")
+    values = [float(value) for value in range(1, 101)]
+    assert (percentile(values, 0.5), percentile(values, 0.95), percentile(values, 0.99)) == (50.0, 95.0, 99.0)
+
+# Test case for a complete benchmark run
+def test_benchmark_run(tmp_path):
+    """
+    Tests a small end to end run against its own SQLite database and the JSON report it prints.
+    """
+    command = [sys.executable, "benchmark.py", "--database-url", f"sqlite:///{tmp_path / 'benchmark.db'}", "--products", "200",
+               "--categories", "4", "--requests", "40", "--concurrency", "4"]
+    result = subprocess.run(command, cwd=ROOT, capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout)
+    assert report["seed"]["products"] == 200
+    assert report["scenarios"]["total"]["requests"] == 40
+    assert report["scenarios"]["total"]["errors"] == 0
+    for name in ("read", "list", "search", "write"):
+        assert {"throughput_rps", "p50_ms", "p95_ms", "p99_ms"} <= set(report["scenarios"][name])
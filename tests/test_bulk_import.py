@@ -0,0 +1,115 @@
+import io
+import json
+import pytest
+from fastapi.testclient import TestClient
+from main import app
+import bulk_import
+from bulk_import import iter_json, import_products
+from database import SessionLocal
+
+# Create a test client
+client = TestClient(app)
+
+# Test case for streaming the catalog file in small reads
+def test_iter_json_streams_catalog(monkeypatch):
+    """
+    Tests that the products of electronic-catalog.json decode the same when read a few bytes at a time.
+    """
+    monkeypatch.setattr(bulk_import, "READ_SIZE", 7)
+    with open("electronic-catalog.json", encoding="utf-8") as stream:
+        streamed = list(iter_json(stream))
+    with open("electronic-catalog.json", encoding="utf-8") as stream:
+        expected = json.load(stream)["products"]
+    assert streamed == expected
+
+# Test case for top level arrays and empty arrays
+@pytest.mark.parametrize("text, expected", [
+    ('[{"sku": "A"}, {"sku": "B"}]', [{"sku": "A"}, {"sku": "B"}]),
+    ('{"users": [{"name": "x"}], "products": []}', []),
+    ('{"count": 12345, "products": [{"sku": "C"}]}', [{"sku": "C"}]),
+])
+def test_iter_json_shapes(monkeypatch, text, expected):
+    """
+    Tests the supported JSON layouts.
+    """
+    monkeypatch.setattr(bulk_import, "READ_SIZE", 3)
+    assert list(iter_json(io.StringIO(text))) == expected
+
+# Test case for importing the catalog file through the endpoint
+def test_import_catalog_file(auth_headers):
+    """
+    Tests importing electronic-catalog.json, resolving category names, then upserting it again.
+    """
+    with open("electronic-catalog.json", "rb") as f:
+        response = client.post("/products/import", files={"file": ("electronic-catalog.json", f)}, headers=auth_headers)
+    assert response.status_code == 200
+    report = response.json()
+    assert report["processed"] == 4
+    assert report["imported"] == 4
+    assert report["failed"] == 0
+
+    skus = {product["sku"]: product for product in client.get("/products", params={"limit": 1000}).json()}
+    assert skus["A0001"]["name"] == "Pong"
+    assert skus["A0001"]["category_id"] == skus["A0002"]["category_id"]
+
+    ndjson = b'{"name": "Pong Deluxe", "category": "Games", "sku": "A0001", "price": 79.99, "quantity": 5}\n'
+    response = client.post("/products/import", files={"file": ("update.ndjson", ndjson)}, headers=auth_headers)
+    assert response.json()["imported"] == 1
+    product = client.get(f"/products/{skus['A0001']['id']}").json()
+    assert product["name"] == "Pong Deluxe"
+    assert product["quantity"] == 5
+
+# Test case for per-row error reporting
+def test_import_reports_row_errors():
+    """
+    Tests that invalid rows are reported individually while valid rows are imported.
+    """
+    text = "name,category,sku,price,quantity\nGood,Bulk,BULK-1,1.50,3\nBad,Bulk,BULK-2,-1,3\nNoCategory,,BULK-3,2,1\n"
+    db = SessionLocal()
+    try:
+        report = import_products(db, io.StringIO(text), file_format="csv", chunk_size=2)
+    finally:
+        db.close()
+    assert report["processed"] == 3
+    assert report["imported"] == 1
+    assert [error["row"] for error in report["errors"]] == [2, 3]
+
+# Test case for malformed NDJSON lines
+def test_import_reports_malformed_lines(auth_headers):
+    """
+    Tests that a line that is not valid JSON is reported as a failed row and the other lines are still imported.
+    """
+    ndjson = (b'{"name": "Line One", "category": "Bulk", "sku": "NDJSON-1", "price": 1, "quantity": 1}\n'
+              b'{"name": "Broken", "sku": \n'
+              b'\n'
+              b'{"name": "Line Three", "category": "Bulk", "sku": "NDJSON-3", "price": 1, "quantity": 1}\n')
+    response = client.post("/products/import", params={"chunk_size": 1}, files={"file": ("lines.ndjson", ndjson)}, headers=auth_headers)
+    assert response.status_code == 200
+    report = response.json()
+    assert (report["processed"], report["imported"], report["failed"]) == (3, 2, 1)
+    assert report["errors"][0]["row"] == 2
+    assert report["errors"][0]["error"].startswith("Invalid JSON")
+
+# Test case for duplicate skus without upsert
+def test_import_without_upsert_rejects_duplicates():
+    """
+    Tests that existing skus are reported as failed rows when upserting is disabled.
+    """
+    rows = [{"name": "Dup", "category": "Bulk", "sku": "DUP-1", "price": 1, "quantity": 1}]
+    db = SessionLocal()
+    try:
+        first = bulk_import.ProductImporter(db).run(rows)
+        second = bulk_import.ProductImporter(db, upsert=False).run(rows)
+    finally:
+        db.close()
+    assert first["imported"] == 1
+    assert second["imported"] == 0
+    assert second["errors"][0]["sku"] == "DUP-1"
+
+# Test case for unsupported formats
+def test_import_rejects_unknown_format(auth_headers):
+    """
+    Tests that an unknown format is rejected before reading the file.
+    """
+    response = client.post("/products/import", params={"format": "xml"}, files={"file": ("catalog.xml", b"<products/>")}, headers=auth_headers)
+    assert response.status_code == 400
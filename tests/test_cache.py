@@ -0,0 +1,172 @@
+import time
+import pytest
+from fastapi.testclient import TestClient
+from main import app
+from database import SessionLocal, Category
+from cache import MemoryBackend, RedisBackend, CatalogCache, ChangeFollower, catalog_cache, category_key
+
+# Create a test client
+client = TestClient(app)
+
+# Test case for the in-process backend expiring entries
+def test_memory_backend_ttl():
+    """
+    Tests that entries disappear once their TTL has passed.
+    """
+    backend = MemoryBackend()
+    backend.set("key", {"a": 1}, ttl=0)
+    time.sleep(0.01)
+    assert backend.get("key") is None
+
+# Test case for the in-process backend evicting least recently used entries
+def test_memory_backend_lru():
+    """
+    Tests that the least recently used entry is evicted first.
+    """
+    backend = MemoryBackend(max_entries=2)
+    backend.set("a", 1, ttl=60)
+    backend.set("b", 2, ttl=60)
+    backend.get("a")
+    backend.set("c", 3, ttl=60)
+    assert backend.get("a") == 1
+    assert backend.get("b") is None
+    assert backend.get("c") == 3
+
+# Test case for the in-process backend dropping expired entries that are never read
+def test_memory_backend_sweeps_expired():
+    """
+    Tests that writes remove expired entries without waiting for them to be read.
+    """
+    backend = MemoryBackend()
+    for key in range(100):
+        backend.set(f"revoked-token:{key}", True, ttl=0)
+    time.sleep(0.01)
+    backend.set("live", 1, ttl=60)
+    assert list(backend.entries) == ["live"]
+
+# Test case for the Redis backend
+def test_redis_backend():
+    """
+    Tests the Redis backend against a fakeredis stand-in.
+    """
+    fakeredis = pytest.importorskip("fakeredis")
+    cache = CatalogCache(RedisBackend(fakeredis.FakeRedis()), ttl=60)
+    calls = []
+
+    def load():
+        calls.append(1)
+        return [{"id": 1}]
+
+    key = cache.list_key("products", skip=0, limit=10)
+    assert cache.get_or_load(key, load) == [{"id": 1}]
+    assert cache.get_or_load(key, load) == [{"id": 1}]
+    assert len(calls) == 1
+
+    cache.invalidate({"product:1"}, {"products"})
+    assert cache.list_key("products", skip=0, limit=10) != key
+
+# Test case for reads being served from the cache
+def test_read_through(monkeypatch, auth_headers):
+    """
+    Tests that a cached category is served without querying the database again.
+    """
+    assert client.post("/categories", json={"id": 9100, "name": "Cached Category"}, headers=auth_headers).status_code == 200
+    assert client.get("/categories/9100").status_code == 200
+
+    import main
+    monkeypatch.setattr(main, "get_category_by_id", lambda db, category_id: pytest.fail("cache miss"))
+    response = client.get("/categories/9100")
+    assert response.status_code == 200
+    assert response.json()["name"] == "Cached Category"
+
+# Test case for writes invalidating cached reads
+def test_invalidation_on_commit(auth_headers):
+    """
+    Tests that updates and deletes invalidate cached rows and listings.
+    """
+    assert client.post("/categories", json={"id": 9101, "name": "Before"}, headers=auth_headers).status_code == 200
+    assert client.get("/categories/9101").json()["name"] == "Before"
+    names = [category["name"] for category in client.get("/categories", params={"limit": 1000}).json()]
+    assert "Before" in names
+
+    assert client.put("/categories/9101", json={"id": 9101, "name": "After"}, headers=auth_headers).status_code == 200
+    assert client.get("/categories/9101").json()["name"] == "After"
+    names = [category["name"] for category in client.get("/categories", params={"limit": 1000}).json()]
+    assert "After" in names and "Before" not in names
+
+    assert client.delete("/categories/9101", headers=auth_headers).status_code == 200
+    assert client.get("/categories/9101").status_code == 404
+
+# Test case for a PUT body naming a different id
+def test_put_keeps_id(auth_headers):
+    """
+    Tests that the id in a PUT body is ignored, so the row and its cached copy stay under the id in the path.
+    """
+    assert client.post("/categories", json={"id": 9103, "name": "Pinned"}, headers=auth_headers).status_code == 200
+    client.get("/categories/9103")
+    response = client.put("/categories/9103", json={"id": 9104, "name": "Pinned After"}, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()["id"] == 9103
+    assert client.get("/categories/9103").json()["name"] == "Pinned After"
+    assert client.get("/categories/9104").status_code == 404
+    assert client.delete("/categories/9103", headers=auth_headers).status_code == 200
+
+# Test case for rolled back writes leaving the cache alone
+def test_rollback_keeps_cache(auth_headers):
+    """
+    Tests that a rolled back change does not invalidate cached entries.
+    """
+    assert client.post("/categories", json={"id": 9102, "name": "Stable"}, headers=auth_headers).status_code == 200
+    client.get("/categories/9102")
+    assert catalog_cache.backend.get(category_key(9102)) is not None
+
+    db = SessionLocal()
+    try:
+        db.get(Category, 9102).name = "Discarded"
+        db.flush()
+        db.rollback()
+    finally:
+        db.close()
+    assert catalog_cache.backend.get(category_key(9102))["name"] == "Stable"
+
+# Test case for a read racing with a write
+def test_load_racing_a_write():
+    """
+    Tests that a row read before a write committed is not cached once the write has invalidated its key.
+    """
+    cache = CatalogCache(MemoryBackend(), ttl=60)
+
+    def load_then_write():
+        value = {"id": 9106, "name": "Old Name"}
+        # The write commits and invalidates the key before the load stores what it read
+        cache.invalidate({category_key(9106)}, {"categories"})
+        return value
+
+    assert cache.get_or_load(category_key(9106), load_then_write)["name"] == "Old Name"
+    assert cache.peek(category_key(9106)) is None
+    assert cache.get_or_load(category_key(9106), lambda: {"id": 9106, "name": "New Name"})["name"] == "New Name"
+    assert cache.peek(category_key(9106))["name"] == "New Name"
+
+# Test case for writes made by other workers
+def test_follower_invalidates_other_workers_writes(auth_headers):
+    """
+    Tests that a worker's own cache drops the rows another worker changed once it has read the change feed.
+    """
+    worker_cache = CatalogCache(MemoryBackend(), ttl=60)
+    follower = ChangeFollower(worker_cache)
+    db = SessionLocal()
+    try:
+        follower.catch_up(db)
+        worker_cache.backend.set(category_key(9105), {"id": 9105, "name": "Stale"}, ttl=60)
+        listing = worker_cache.list_key("categories", skip=0, limit=10)
+
+        # The write commits in this process, which only invalidates the shared catalog_cache
+        assert client.post("/categories", json={"id": 9105, "name": "Fresh"}, headers=auth_headers).status_code == 200
+        assert worker_cache.peek(category_key(9105)) is not None
+
+        follower.catch_up(db)
+        assert worker_cache.peek(category_key(9105)) is None
+        assert worker_cache.list_key("categories", skip=0, limit=10) != listing
+    finally:
+        db.close()
+        client.delete("/categories/9105", headers=auth_headers)
@@ -0,0 +1,227 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+from main import app
+from database import SessionLocal, Category, CategoryStats, CategoryStock, Change, Product, get_product_for_update, update_product, \
+    delete_product
+from models import Product as ProductSchema
+from bulk_import import ProductImporter
+from category_tree import STOCK_SHARDS
+
+# Create a test client
+client = TestClient(app)
+
+# Category id -> parent id, and product id -> (category id, price, quantity)
+CATEGORIES = {8000: None, 8001: 8000, 8002: 8001}
+PRODUCTS = {8010: (8000, 10.0, 1), 8011: (8001, 20.0, 2), 8012: (8002, 5.0, 3)}
+
+@pytest.fixture(autouse=True)
+def seed_tree(auth_headers):
+    """
+    Seeds a three level category chain with one product at each level for every test.
+    """
+    for category_id, parent_id in CATEGORIES.items():
+        client.post("/categories", json={"id": category_id, "name": f"Tree {category_id}", "parent_id": parent_id}, headers=auth_headers)
+    for product_id, (category_id, price, quantity) in PRODUCTS.items():
+        product_data = {"id": product_id, "name": f"Tree product {product_id}", "category_id": category_id, "sku": f"TREE-{product_id}",
+                        "price": price, "quantity": quantity}
+        client.post("/products", json=product_data, headers=auth_headers)
+    yield
+    db = SessionLocal()
+    try:
+        product_ids = db.scalars(select(Product.id).where(Product.sku.startswith("TREE-"))).all()
+        # Deepest first, since a category with subcategories cannot be deleted
+        category_ids = db.scalars(select(Category.id).where(Category.id.in_(CATEGORIES)).order_by(func.length(Category.path).desc())).all()
+    finally:
+        db.close()
+    for product_id in product_ids:
+        client.delete(f"/products/{product_id}", headers=auth_headers)
+    for category_id in category_ids:
+        client.delete(f"/categories/{category_id}", headers=auth_headers)
+
+def subtree(root: int = 8000) -> dict:
+    response = client.get("/categories/tree", params={"root": root})
+    assert response.status_code == 200
+    [node] = response.json()
+    return node
+
+def aggregates(node: dict) -> tuple:
+    return node["product_count"], node["total_stock"], node["min_price"], node["max_price"]
+
+# The maintained aggregates must always equal a full recomputation
+def assert_stats_consistent():
+    db = SessionLocal()
+    try:
+        for category_id in CATEGORIES:
+            stats = db.get(CategoryStats, category_id)
+            # Stock changes are spread over the category's stock shards
+            stock = stats.total_stock + db.scalar(select(func.sum(CategoryStock.stock_delta)).where(CategoryStock.category_id == category_id))
+            expected = db.execute(
+                select(func.count(), func.coalesce(func.sum(Product.quantity), 0), func.min(Product.price), func.max(Product.price))
+                .where(Product.category_id == category_id)
+            ).one()
+            assert (stats.product_count, stock, stats.min_price, stats.max_price) == tuple(expected)
+    finally:
+        db.close()
+
+# Test case for the rolled up tree
+def test_category_tree():
+    """
+    Tests that each node aggregates the products of its whole subtree.
+    """
+    root = subtree()
+    assert (root["id"], root["parent_id"]) == (8000, None)
+    assert aggregates(root) == (3, 6, 5.0, 20.0)
+    [child] = root["children"]
+    assert (child["id"], aggregates(child)) == (8001, (2, 5, 5.0, 20.0))
+    [grandchild] = child["children"]
+    assert (grandchild["id"], aggregates(grandchild), grandchild["children"]) == (8002, (1, 3, 5.0, 5.0), [])
+    assert 8000 in [node["id"] for node in client.get("/categories/tree").json()]
+    assert client.get("/categories/tree", params={"root": 9999999}).status_code == 404
+
+# Test case for aggregates following every kind of product write
+def test_aggregates_follow_writes(auth_headers):
+    """
+    Tests creates, full and partial updates, stock changes, bulk imports and deletes against a full recomputation.
+    """
+    client.patch("/products/8012", json={"price": 50.0}, headers=auth_headers)
+    assert aggregates(subtree(8002)) == (1, 3, 50.0, 50.0)
+    client.post("/products/8011/stock", json={"action": "reserve", "quantity": 2}, headers=auth_headers)
+    assert aggregates(subtree(8001)) == (2, 3, 20.0, 50.0)
+    client.patch("/products/8010", json={"category_id": 8002, "quantity": 4}, headers=auth_headers)
+    assert aggregates(subtree(8002)) == (2, 7, 10.0, 50.0)
+    assert_stats_consistent()
+
+    product_data = {"name": "Tree product 8013", "category_id": 8000, "sku": "TREE-8013", "price": 1.0, "quantity": 9}
+    client.put("/products/8011", json={"id": 8011, **product_data, "sku": "TREE-8011"}, headers=auth_headers)
+    db = SessionLocal()
+    try:
+        ProductImporter(db).run([product_data, {**product_data, "sku": "TREE-8012", "category_id": 8001}])
+    finally:
+        db.close()
+    assert aggregates(subtree()) == (4, 31, 1.0, 10.0)
+    assert_stats_consistent()
+
+    client.delete("/products/8012", headers=auth_headers)
+    assert aggregates(subtree()) == (3, 22, 1.0, 10.0)
+    assert_stats_consistent()
+
+# Test case for stock changes staying off the stats row
+def test_stock_changes_use_shards(auth_headers):
+    """
+    Tests that a checkout moves the stock of one shard of its category and leaves the category's stats row alone.
+    """
+    def stock_rows():
+        db = SessionLocal()
+        try:
+            return db.get(CategoryStats, 8001).total_stock, dict(db.execute(
+                select(CategoryStock.shard, CategoryStock.stock_delta).where(CategoryStock.category_id == 8001)).all())
+        finally:
+            db.close()
+
+    total, shards = stock_rows()
+    assert len(shards) == STOCK_SHARDS
+    assert client.post("/products/8011/stock", json={"action": "reserve", "quantity": 2}, headers=auth_headers).status_code == 200
+    assert stock_rows() == (total, {**shards, 8011 % STOCK_SHARDS: shards[8011 % STOCK_SHARDS] - 2})
+    assert aggregates(subtree(8001)) == (2, 3, 5.0, 20.0)
+    assert_stats_consistent()
+
+# Runs a write in a session of its own on another thread, as a concurrent request would
+def write_concurrently(pool, write, *args):
+    def run():
+        db = SessionLocal()
+        try:
+            return write(db, *args)
+        finally:
+            db.close()
+    return pool.submit(run)
+
+# Test case for writes racing on one product
+def test_interleaved_writes():
+    """
+    Tests that a write waits for another one holding the product and then counts only the product's current values.
+    """
+    product_data = ProductSchema(id=8011, name="Tree product 8011", category_id=8001, sku="TREE-8011", price=20.0, quantity=7)
+    first = SessionLocal()
+    try:
+        # A copy loaded before the other session's write must not be trusted
+        stale = first.get(Product, 8011)
+        with ThreadPoolExecutor(1) as pool:
+            holder = SessionLocal()
+            try:
+                held = get_product_for_update(holder, 8011)
+                racing = write_concurrently(pool, update_product, 8011, product_data.model_copy(update={"category_id": 8002, "quantity": 9}))
+                time.sleep(0.2)
+                assert not racing.done()
+                held.quantity = 7
+                holder.commit()
+            finally:
+                holder.close()
+            assert racing.result(timeout=10).quantity == 9
+        update_product(first, 8011, product_data.model_copy(update={"quantity": 4}))
+        assert stale.quantity == 4
+        assert aggregates(subtree(8001)) == (2, 7, 5.0, 20.0)
+        assert_stats_consistent()
+
+        since = first.scalar(select(func.max(Change.id)))
+        with ThreadPoolExecutor(1) as pool:
+            holder = SessionLocal()
+            try:
+                held = get_product_for_update(holder, 8012)
+                racing = write_concurrently(pool, delete_product, 8012)
+                time.sleep(0.2)
+                assert not racing.done()
+                holder.delete(held)
+                holder.commit()
+            finally:
+                holder.close()
+            assert racing.result(timeout=10) is None
+        assert aggregates(subtree(8002)) == (0, 0, None, None)
+        assert_stats_consistent()
+        assert first.scalar(select(func.count()).where(Change.id > since, Change.row_id == 8012, Change.operation == "delete")) == 1
+    finally:
+        first.close()
+
+# Test case for moving categories
+def test_move_category(auth_headers):
+    """
+    Tests that moving a category carries its subtree along and that cycles and orphans are refused.
+    """
+    assert client.patch("/categories/8002", json={"parent_id": 8000}, headers=auth_headers).status_code == 200
+    root = subtree()
+    assert sorted((child["id"], child["product_count"]) for child in root["children"]) == [(8001, 1), (8002, 1)]
+
+    response = client.put("/categories/8001", json={"id": 8001, "name": "Tree 8001", "parent_id": 8002}, headers=auth_headers)
+    assert response.status_code == 200
+    db = SessionLocal()
+    try:
+        assert db.scalar(select(Category.path).where(Category.id == 8001)) == "/8000/8002/8001/"
+    finally:
+        db.close()
+    assert aggregates(subtree(8002)) == (2, 5, 5.0, 20.0)
+
+    assert client.patch("/categories/8000", json={"parent_id": 8001}, headers=auth_headers).status_code == 400
+    assert client.put("/categories/8000", json={"id": 8000, "name": "Tree 8000", "parent_id": 9999999},
+                      headers=auth_headers).status_code == 400
+    assert client.delete("/categories/8002", headers=auth_headers).status_code == 409
+
+    # A null parent moves the category to the top level, but a null name is refused
+    response = client.patch("/categories/8002", json={"parent_id": None}, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()["parent_id"] is None
+    assert aggregates(subtree(8002)) == (2, 5, 5.0, 20.0)
+    assert aggregates(subtree()) == (1, 1, 10.0, 10.0)
+    assert client.patch("/categories/8002", json={"name": None}, headers=auth_headers).status_code == 422
+    assert client.patch("/categories/8002", json={"parent_id": 8000}, headers=auth_headers).status_code == 200
+
+# Test case for the cost of building the tree
+def test_category_tree_queries(count_queries):
+    """
+    Tests that the tree is built from the aggregates in a fixed number of statements, whatever the catalog size.
+    """
+    with count_queries() as statements:
+        assert client.get("/categories/tree", params={"root": 8001}).status_code == 200
+    assert len(statements) <= 2
+    assert not any("FROM products" in statement for statement in statements)
@@ -0,0 +1,154 @@
+import asyncio
+from collections import namedtuple
+from datetime import datetime, timedelta
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+from main import app
+from config import change_settings
+from database import SessionLocal, Change
+from change_log import settled, prune_changes, stream_changes, load_changes_in_threadpool
+
+# Create a test client
+client = TestClient(app)
+
+@pytest.fixture(autouse=True)
+def cleanup(auth_headers):
+    """
+    Removes the rows written by each test.
+    """
+    yield
+    for product_id in (8101, 8102):
+        client.delete(f"/products/{product_id}", headers=auth_headers)
+    client.delete("/categories/8100", headers=auth_headers)
+
+def latest_sequence() -> int:
+    db = SessionLocal()
+    try:
+        return db.scalar(select(func.max(Change.id))) or 0
+    finally:
+        db.close()
+
+def seed(auth_headers):
+    client.post("/categories", json={"id": 8100, "name": "Changes Category"}, headers=auth_headers)
+    for product_id in (8101, 8102):
+        product_data = {"id": product_id, "name": f"Changed {product_id}", "category_id": 8100, "sku": f"CHANGE-{product_id}",
+                        "price": 3.0, "quantity": 10}
+        client.post("/products", json=product_data, headers=auth_headers)
+
+# Test case for every kind of write appearing in the feed
+def test_change_feed(auth_headers):
+    """
+    Tests that ORM and single-statement writes are logged in order, with the current row embedded.
+    """
+    since = latest_sequence()
+    seed(auth_headers)
+    product_data = {"id": 8101, "name": "Renamed", "category_id": 8100, "sku": "CHANGE-8101", "price": 4.0, "quantity": 10}
+    client.put("/products/8101", json=product_data, headers=auth_headers)
+    client.patch("/products/8102", json={"price": 6.0}, headers=auth_headers)
+    client.post("/products/8102/stock", json={"action": "reserve", "quantity": 99}, headers=auth_headers)
+    client.post("/products/8102/stock", json={"action": "reserve", "quantity": 1}, headers=auth_headers)
+    client.delete("/products/8101", headers=auth_headers)
+
+    response = client.get("/changes", params={"since": since})
+    assert response.status_code == 200
+    feed = response.json()
+    assert [(change["kind"], change["id"], change["operation"]) for change in feed["changes"]] == [
+        ("category", 8100, "insert"), ("product", 8101, "insert"), ("product", 8102, "insert"), ("product", 8101, "update"),
+        ("product", 8102, "update"), ("product", 8102, "update"), ("product", 8101, "delete"),
+    ]
+    assert feed["next"] == feed["changes"][-1]["sequence"] == latest_sequence()
+    assert not feed["has_more"]
+    data = {change["id"]: change["data"] for change in feed["changes"]}
+    assert data[8101] is None
+    assert (data[8102]["price"], data[8102]["quantity"]) == (6.0, 9)
+    assert data[8100]["name"] == "Changes Category"
+    assert client.get("/changes", params={"since": feed["next"]}).json() == {"changes": [], "next": feed["next"], "has_more": False}
+
+# Test case for reading the feed in batches
+def test_change_feed_batches(auth_headers):
+    """
+    Tests that a consumer following `next` reads every change exactly once.
+    """
+    since = latest_sequence()
+    seed(auth_headers)
+    sequences = []
+    while True:
+        feed = client.get("/changes", params={"since": since, "limit": 2}).json()
+        sequences.extend(change["sequence"] for change in feed["changes"])
+        since = feed["next"]
+        if not feed["has_more"]:
+            break
+    assert len(sequences) == 3 and sequences == sorted(set(sequences))
+    assert client.get("/changes", params={"limit": 0}).status_code == 422
+
+# Test case for gaps left by transactions that have not committed yet
+def test_settled():
+    """
+    Tests that the feed stops before a recent gap in the sequence and moves past an old one.
+    """
+    Row = namedtuple("Row", "id changed_at")
+    now = datetime.utcnow()
+    recent = [Row(11, now), Row(13, now), Row(14, now)]
+    assert settled(recent, 10, now) == recent[:1]
+    assert settled(recent, 9, now) == []
+    old = now - timedelta(seconds=change_settings.gap_seconds + 1)
+    assert settled([Row(11, old), Row(13, old)], 10, now) == [Row(11, old), Row(13, old)]
+
+# Test case for waiting on a gap
+def test_gap_stops_the_batch(monkeypatch):
+    """
+    Tests that a batch stopped at a recent gap does not report more changes, so that the stream waits before polling again.
+    """
+    since = latest_sequence()
+    db = SessionLocal()
+    db.add(Change(id=since + 2, kind="product", row_id=8101, operation="update"))
+    db.commit()
+    try:
+        assert client.get("/changes", params={"since": since}).json() == {"changes": [], "next": since, "has_more": False}
+
+        monkeypatch.setattr(change_settings, "stream_seconds", 0.3)
+        monkeypatch.setattr(change_settings, "poll_seconds", 0.1)
+        polls = []
+        async def load(since, limit):
+            polls.append(since)
+            return await load_changes_in_threadpool(since, limit)
+        async def read_stream():
+            return [event async for event in stream_changes(since, load=load)]
+        events = asyncio.run(read_stream())
+        assert not any(b"event: change" in event for event in events)
+        assert 1 < len(polls) <= 4
+    finally:
+        # Fill the gap rather than delete past it, so that later sequences follow on without one
+        db.add(Change(id=since + 1, kind="product", row_id=8101, operation="update"))
+        db.commit()
+        db.close()
+
+# Test case for the Server-Sent Events stream
+def test_change_stream(auth_headers, monkeypatch):
+    """
+    Tests that the stream resumes from Last-Event-ID and sends each change as an event carrying its sequence.
+    """
+    monkeypatch.setattr(change_settings, "stream_seconds", 0)
+    since = latest_sequence()
+    seed(auth_headers)
+    response = client.get("/changes/stream", headers={"Last-Event-ID": str(since)})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [event for event in response.text.split("\n\n") if "event: change" in event]
+    assert len(events) == 3
+    assert events[0].startswith(f"id: {since + 1}\n")
+
+# Test case for consumers that fall behind the retention period
+def test_pruned_changes(auth_headers):
+    """
+    Tests that asking for pruned changes is refused so that the consumer resyncs.
+    """
+    seed(auth_headers)
+    db = SessionLocal()
+    try:
+        assert prune_changes(db, days=-1) > 0
+    finally:
+        db.close()
+    assert client.get("/changes", params={"since": 1}).status_code == 410
+    assert client.get("/changes", params={"since": latest_sequence() - 1}).status_code == 200
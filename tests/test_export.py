@@ -0,0 +1,95 @@
+import csv
+import io
+import json
+import pytest
+from fastapi.testclient import TestClient
+from main import app
+from database import SessionLocal
+from export import iter_batches
+
+# Create a test client
+client = TestClient(app)
+
+EXPORT_IDS = range(9801, 9806)
+
+@pytest.fixture(scope="module", autouse=True)
+def seed_products(auth_headers):
+    """
+    Seeds a category with a few products to export.
+    """
+    client.post("/categories", json={"id": 9800, "name": "Export Category"}, headers=auth_headers)
+    for product_id in EXPORT_IDS:
+        product_data = {"id": product_id, "name": f"Exported {product_id}", "category_id": 9800, "sku": f"EXPORT-{product_id}",
+                        "price": 2.5, "quantity": 4}
+        client.post("/products", json=product_data, headers=auth_headers)
+    yield
+    for product_id in EXPORT_IDS:
+        client.delete(f"/products/{product_id}", headers=auth_headers)
+    client.delete("/categories/9800", headers=auth_headers)
+
+# Test case for the NDJSON export
+def test_export_ndjson():
+    """
+    Tests that every product is streamed as one JSON document per line, with its category name on request.
+    """
+    response = client.get("/products/export", params={"format": "ndjson", "include": "category"}, headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert "content-encoding" not in response.headers
+
+    products = {product["id"]: product for product in map(json.loads, response.text.splitlines())}
+    for product_id in EXPORT_IDS:
+        assert products[product_id]["sku"] == f"EXPORT-{product_id}"
+        assert products[product_id]["category_name"] == "Export Category"
+    assert list(products) == sorted(products)
+
+# Test case for the CSV export
+def test_export_csv():
+    """
+    Tests that the CSV export starts with a header row and contains every product.
+    """
+    response = client.get("/products/export", params={"format": "csv"})
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert "category_name" not in rows[0]
+    exported = {int(row["id"]): row for row in rows}
+    assert exported[9801]["name"] == "Exported 9801"
+    assert float(exported[9801]["price"]) == 2.5
+
+# Test case for the gzip encoded export
+def test_export_gzip():
+    """
+    Tests that the export is gzip encoded when the client accepts it, and not when it is turned off.
+    """
+    response = client.get("/products/export", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert any(json.loads(line)["id"] == 9801 for line in response.text.splitlines())
+
+    response = client.get("/products/export", params={"gzip": False}, headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+
+# Test case for the export reading in bounded batches
+def test_export_batches(count_queries):
+    """
+    Tests that rows are fetched by keyset queries of at most the batch size, each row once and in id order.
+    """
+    db = SessionLocal()
+    try:
+        with count_queries() as statements:
+            batches = list(iter_batches(db, batch_size=2))
+    finally:
+        db.close()
+    assert all(len(batch) <= 2 for batch in batches)
+    ids = [row.id for batch in batches for row in batch]
+    assert ids == sorted(set(ids))
+    assert set(EXPORT_IDS) <= set(ids)
+    assert len(statements) == len(ids) // 2 + 1
+    assert all("LIMIT" in statement for statement in statements)
+
+# Test case for unknown export formats
+def test_export_rejects_unknown_format():
+    """
+    Tests that an unsupported format is rejected.
+    """
+    assert client.get("/products/export", params={"format": "xml"}).status_code == 422
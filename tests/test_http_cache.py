@@ -0,0 +1,87 @@
+import pytest
+from fastapi.testclient import TestClient
+from main import app
+from cache import catalog_cache, product_key
+
+# Create a test client
+client = TestClient(app)
+
+@pytest.fixture(scope="module", autouse=True)
+def seed_category(auth_headers):
+    """
+    Creates the category the products below belong to and removes everything afterwards.
+    """
+    client.post("/categories", json={"id": 9600, "name": "Conditional Category"}, headers=auth_headers)
+    yield
+    for product_id in range(9601, 9605):
+        client.delete(f"/products/{product_id}", headers=auth_headers)
+    client.delete("/categories/9600", headers=auth_headers)
+
+def create_product(auth_headers, product_id: int, name: str):
+    response = client.post("/products", json={"id": product_id, "name": name, "category_id": 9600, "sku": f"ETAG-{product_id}",
+                                              "price": 10.0, "quantity": 1}, headers=auth_headers)
+    assert response.status_code == 200
+
+# Test case for validators on a single product
+def test_product_etag(auth_headers):
+    """
+    Tests that a product is served with an ETag, Last-Modified and Cache-Control, and that
+    a matching If-None-Match or If-Modified-Since gets a 304 without a body.
+    """
+    create_product(auth_headers, 9601, "Tagged Product")
+    response = client.get("/products/9601")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert etag.startswith('"') and etag.endswith('"')
+    assert "max-age=" in response.headers["Cache-Control"]
+
+    response = client.get("/products/9601", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+    response = client.get("/products/9601", headers={"If-Modified-Since": response.headers["Last-Modified"]})
+    assert response.status_code == 304
+
+    assert client.get("/products/9601", headers={"If-None-Match": '"stale"'}).status_code == 200
+
+# Test case for revalidating a product that is not in the read cache
+def test_product_revalidation_without_cache(auth_headers):
+    """
+    Tests that a conditional request for an uncached product is answered from its modification time.
+    """
+    create_product(auth_headers, 9602, "Uncached Product")
+    etag = client.get("/products/9602").headers["ETag"]
+    catalog_cache.backend.delete(product_key(9602))
+
+    response = client.get("/products/9602", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert catalog_cache.backend.get(product_key(9602)) is None
+
+# Test case for updates changing the validator
+def test_etag_changes_after_update(auth_headers):
+    """
+    Tests that a stale ETag no longer matches once the product has been updated.
+    """
+    create_product(auth_headers, 9603, "Before Update")
+    etag = client.get("/products/9603").headers["ETag"]
+    response = client.put("/products/9603", json={"id": 9603, "name": "After Update", "category_id": 9600, "sku": "ETAG-9603",
+                                                  "price": 12.0, "quantity": 1}, headers=auth_headers)
+    assert response.status_code == 200
+
+    response = client.get("/products/9603", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["name"] == "After Update"
+    assert response.headers["ETag"] != etag
+
+# Test case for validators on listings
+def test_list_etag(auth_headers):
+    """
+    Tests that category and product listings can be revalidated.
+    """
+    create_product(auth_headers, 9604, "Listed Product")
+    for path, params in (("/categories", {"limit": 1000}), ("/products", {"category_id": 9600})):
+        response = client.get(path, params=params)
+        assert response.status_code == 200
+        response = client.get(path, params=params, headers={"If-None-Match": response.headers["ETag"]})
+        assert response.status_code == 304
@@ -0,0 +1,97 @@
+import pytest
+from fastapi.testclient import TestClient
+from main import app
+from cache import catalog_cache
+
+# Create a test client
+client = TestClient(app)
+
+INCLUDE_IDS = range(9901, 9907)
+
+@pytest.fixture(scope="module", autouse=True)
+def seed_products(auth_headers):
+    """
+    Seeds two categories with three products each.
+    """
+    for category_id in (9900, 9910):
+        client.post("/categories", json={"id": category_id, "name": f"Include Category {category_id}"}, headers=auth_headers)
+    for product_id in INCLUDE_IDS:
+        product_data = {"id": product_id, "name": f"Included {product_id}", "category_id": 9900 if product_id < 9904 else 9910,
+                        "sku": f"INCLUDE-{product_id}", "price": 3.0, "quantity": 1}
+        client.post("/products", json=product_data, headers=auth_headers)
+    yield
+    for product_id in INCLUDE_IDS:
+        client.delete(f"/products/{product_id}", headers=auth_headers)
+    for category_id in (9900, 9910):
+        client.delete(f"/categories/{category_id}", headers=auth_headers)
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    """
+    Starts every test with an empty read cache so each request reaches the database.
+    """
+    catalog_cache.backend.clear()
+
+# Test case for embedding categories in the product listing
+def test_list_products_include_category(count_queries):
+    """
+    Tests that categories are embedded on request and cost the same number of queries for any page size.
+    """
+    with count_queries() as small:
+        response = client.get("/products", params={"limit": 2, "min_price": 3, "max_price": 3, "include": "category"})
+    assert response.status_code == 200
+    catalog_cache.backend.clear()
+    with count_queries() as large:
+        response = client.get("/products", params={"limit": 6, "min_price": 3, "max_price": 3, "include": "category"})
+    assert response.status_code == 200
+    products = {product["id"]: product for product in response.json()}
+    assert products[9901]["category"]["name"] == "Include Category 9900"
+    assert products[9906]["category"]["name"] == "Include Category 9910"
+    assert len(large) == len(small)
+
+    plain = client.get("/products", params={"limit": 6, "min_price": 3, "max_price": 3}).json()
+    assert all("category" not in product for product in plain)
+
+# Test case for embedding the category of a single product
+def test_retrieve_product_include_category(auth_headers):
+    """
+    Tests that a single product embeds its category, and that the validator changes when the category does.
+    """
+    response = client.get("/products/9901", params={"include": "category"})
+    assert response.status_code == 200
+    assert response.json()["category"]["id"] == 9900
+    assert "category" not in client.get("/products/9901").json()
+
+    etag = response.headers["ETag"]
+    assert client.put("/categories/9900", json={"id": 9900, "name": "Renamed Include Category"}, headers=auth_headers).status_code == 200
+    response = client.get("/products/9901", params={"include": "category"}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["category"]["name"] == "Renamed Include Category"
+
+# Test case for embedding products in a category
+def test_retrieve_category_include_products(count_queries):
+    """
+    Tests that a category embeds all of its products in a fixed number of queries.
+    """
+    with count_queries() as statements:
+        response = client.get("/categories/9910", params={"include": "products"})
+    assert response.status_code == 200
+    assert sorted(product["id"] for product in response.json()["products"]) == [9904, 9905, 9906]
+    assert len(statements) <= 2
+    assert "products" not in client.get("/categories/9910").json()
+
+# Test case for embedding categories in batch lookups
+def test_batch_include_category(count_queries):
+    """
+    Tests that batch lookups embed categories without a query per product.
+    """
+    with count_queries() as statements:
+        response = client.get("/products:batch", params={"ids": "9901,9904,9906", "include": "category"})
+    assert response.status_code == 200
+    assert [product["category"]["id"] for product in response.json()["products"]] == [9900, 9910, 9910]
+    assert len(statements) == 1
+
+    with count_queries() as statements:
+        response = client.get("/products:batch", params={"ids": "9901,9904,9906"})
+    assert all("category" not in product for product in response.json()["products"])
+    assert len(statements) == 1
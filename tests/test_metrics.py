@@ -0,0 +1,76 @@
+import logging
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from main import app
+from config import metrics_settings
+from database import engine
+import metrics
+
+# Create a test client
+client = TestClient(app)
+
+# Test case for request metrics
+def test_request_metrics():
+    """
+    Tests that requests are counted per route template and status, with latency and SQL histograms.
+    """
+    client.get("/products/9999999")
+    client.get("/products", params={"limit": 5})
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert 'http_requests_total{method="GET",route="/products/{product_id}",status="404"}' in text
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/products",le="+Inf"}' in text
+    assert 'http_request_db_queries_count{method="GET",route="/products/{product_id}"}' in text
+    assert "http_request_db_seconds_sum" in text
+    assert "db_query_duration_seconds_count" in text
+    assert "db_pool_checked_out" in text
+
+# Test case for SQL statements being attributed to their request
+def test_request_query_count():
+    """
+    Tests that the statements a request runs are recorded against its route.
+    """
+    def recorded_queries():
+        counts, total = metrics.REQUEST_QUERIES.series.get(("GET", "/categories/{category_id}"), [[0], 0.0])
+        return sum(counts), total
+
+    before_requests, before_queries = recorded_queries()
+    client.get("/categories/9999999")
+    after_requests, after_queries = recorded_queries()
+    assert after_requests == before_requests + 1
+    assert after_queries >= before_queries + 1
+
+# Test case for slow query logging
+def test_slow_query_log(monkeypatch, caplog):
+    """
+    Tests that slow statements are logged and counted with a fingerprint of their normalized text.
+    """
+    monkeypatch.setattr(metrics_settings, "slow_query_seconds", 0.0)
+    with caplog.at_level(logging.WARNING, logger="catalog.sql"):
+        client.get("/categories/9999999")
+    assert any("Slow query" in record.getMessage() and "categories" in record.getMessage() for record in caplog.records)
+    assert "db_slow_queries_total{fingerprint=" in client.get("/metrics").text
+
+# Test case for statement fingerprints
+def test_fingerprint():
+    """
+    Tests that statements differing only in their values share a fingerprint.
+    """
+    first = "SELECT * FROM products WHERE id IN (?, ?, ?) AND name = 'a'"
+    second = "SELECT  *  FROM products WHERE id IN (?) AND name = 'b''c'"
+    assert metrics.normalize_statement(first) == "SELECT * FROM products WHERE id IN (...) AND name = ?"
+    assert metrics.fingerprint(first) == metrics.fingerprint(second)
+    assert metrics.fingerprint(first) != metrics.fingerprint("SELECT * FROM categories WHERE id = 1")
+
+# Test case for metrics being switched off
+def test_metrics_disabled(monkeypatch):
+    """
+    Tests that nothing is installed when metrics are disabled.
+    """
+    monkeypatch.setattr(metrics_settings, "enabled", False)
+    disabled = FastAPI()
+    metrics.install(disabled, engine)
+    assert not disabled.user_middleware
+    assert TestClient(disabled).get("/metrics").status_code == 404
@@ -0,0 +1,34 @@
+import pytest
+from fastapi.testclient import TestClient
+from main import app
+from pagination import encode_cursor, decode_cursor
+
+# Create a test client
+client = TestClient(app)
+
+# Test case for cursor round trips
+def test_cursor_round_trip():
+    """
+    Tests that a cursor decodes back to the position it was built from.
+    """
+    cursor = encode_cursor(id=42)
+    assert decode_cursor(cursor) == {"id": 42}
+    assert "=" not in cursor
+
+# Test case for malformed cursors
+@pytest.mark.parametrize("cursor", ["not-a-cursor", encode_cursor(id="42"), encode_cursor(last=42)])
+def test_decode_invalid_cursor(cursor):
+    """
+    Tests that tampered or malformed cursors are rejected.
+    """
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+# Test case for listing endpoints rejecting bad cursors
+@pytest.mark.parametrize("path", ["/products", "/categories"])
+def test_list_with_invalid_cursor(path):
+    """
+    Tests that listing endpoints answer 400 for an invalid `after` cursor.
+    """
+    response = client.get(path, params={"after": "not-a-cursor"})
+    assert response.status_code == 400
@@ -0,0 +1,93 @@
+import pytest
+from fastapi.testclient import TestClient
+from main import app
+
+# Create a test client
+client = TestClient(app)
+
+@pytest.fixture(autouse=True)
+def seed_product(auth_headers):
+    """
+    Seeds a product to patch for every test.
+    """
+    client.post("/categories", json={"id": 9960, "name": "Patch Category"}, headers=auth_headers)
+    product_data = {"id": 9961, "name": "Unpatched", "category_id": 9960, "sku": "PATCH-9961", "price": 5.0, "quantity": 2}
+    client.post("/products", json=product_data, headers=auth_headers)
+    yield
+    client.delete("/products/9961", headers=auth_headers)
+    client.delete("/categories/9960", headers=auth_headers)
+
+# Test case for changing only the fields that were sent
+def test_patch_product(auth_headers, count_queries):
+    """
+    Tests that a PATCH changes only the given fields, in a single statement, and that reads and search see it.
+    Besides the UPDATE only its change feed entry is written, plus the category's price range for a price change.
+    """
+    before = client.get("/products/9961").json()
+    with count_queries() as statements:
+        response = client.patch("/products/9961", json={"name": "Patched Gadget"}, headers=auth_headers)
+    assert response.status_code == 200
+    assert len(statements) == 2
+    assert sum(statement.startswith("UPDATE products") for statement in statements) == 1
+    with count_queries() as statements:
+        response = client.patch("/products/9961", json={"price": 7.5}, headers=auth_headers)
+    assert response.status_code == 200
+    assert len(statements) == 3
+    patched = response.json()
+    assert (patched["name"], patched["price"]) == ("Patched Gadget", 7.5)
+    assert (patched["sku"], patched["quantity"], patched["created_at"]) == (before["sku"], before["quantity"], before["created_at"])
+    assert patched["modified_at"] != before["modified_at"]
+
+    assert client.get("/products/9961").json()["name"] == "Patched Gadget"
+    assert 9961 in [product["id"] for product in client.get("/products/search", params={"q": "patched gadget"}).json()["products"]]
+
+# Test case for optimistic concurrency through If-Match
+def test_patch_if_match(auth_headers):
+    """
+    Tests that an update with a stale ETag is refused and one with the current ETag is applied.
+    """
+    etag = client.get("/products/9961").headers["ETag"]
+    response = client.patch("/products/9961", json={"quantity": 3}, headers={**auth_headers, "If-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+    response = client.patch("/products/9961", json={"quantity": 4}, headers={**auth_headers, "If-Match": etag})
+    assert response.status_code == 412
+    assert client.get("/products/9961").json()["quantity"] == 3
+
+# Test case for optimistic concurrency through modified_at
+def test_patch_modified_at(auth_headers):
+    """
+    Tests that an update carrying an outdated modified_at is refused.
+    """
+    seen = client.get("/products/9961").json()["modified_at"]
+    assert client.patch("/products/9961", json={"quantity": 5, "modified_at": seen}, headers=auth_headers).status_code == 200
+    assert client.patch("/products/9961", json={"quantity": 6, "modified_at": seen}, headers=auth_headers).status_code == 412
+    assert client.get("/products/9961").json()["quantity"] == 5
+
+# Test case for invalid partial updates
+def test_patch_rejections(auth_headers):
+    """
+    Tests missing rows, empty and invalid updates, sku conflicts and anonymous requests.
+    """
+    assert client.patch("/products/9999999", json={"name": "Nobody"}, headers=auth_headers).status_code == 404
+    assert client.patch("/products/9961", json={}, headers=auth_headers).status_code == 400
+    assert client.patch("/products/9961", json={"price": -1}, headers=auth_headers).status_code == 422
+    client.post("/products", json={"id": 9962, "name": "Other", "category_id": 9960, "sku": "PATCH-9962", "price": 1.0, "quantity": 1},
+                headers=auth_headers)
+    try:
+        assert client.patch("/products/9961", json={"sku": "PATCH-9962"}, headers=auth_headers).status_code == 409
+    finally:
+        client.delete("/products/9962", headers=auth_headers)
+    assert client.patch("/products/9961", json={"name": "Anonymous"}).status_code == 401
+
+# Test case for patching categories
+def test_patch_category(auth_headers):
+    """
+    Tests that a category can be renamed with a partial update.
+    """
+    etag = client.get("/categories/9960").headers["ETag"]
+    response = client.patch("/categories/9960", json={"name": "Patched Category"}, headers={**auth_headers, "If-Match": etag})
+    assert response.status_code == 200
+    assert client.get("/categories/9960").json()["name"] == "Patched Category"
+    assert client.patch("/categories/9960", json={"name": "Again"}, headers={**auth_headers, "If-Match": etag}).status_code == 412
@@ -0,0 +1,39 @@
+from fastapi.testclient import TestClient
+from main import app
+from database import engine
+from pool_metrics import get_pool_metrics
+
+# Create a test client
+client = TestClient(app)
+
+# Test case for the pool metrics endpoint
+def test_pool_metrics(auth_headers):
+    """
+    Tests that the pool metrics endpoint reports occupancy and checkout timings.
+    """
+    client.get("/products")
+    response = client.get("/admin/pool", headers=auth_headers)
+    assert response.status_code == 200
+
+    metrics = response.json()["primary"]
+    for key in ("size", "checked_out", "idle", "overflow", "checkouts", "wait_seconds_avg", "wait_seconds_max"):
+        assert key in metrics
+    assert metrics["checkouts"] >= 1
+
+# Test case for the pool metrics endpoint requiring authentication
+def test_pool_metrics_requires_token():
+    """
+    Tests that the pool metrics endpoint is not public.
+    """
+    response = client.get("/admin/pool")
+    assert response.status_code == 401
+
+# Test case for checkout accounting
+def test_checkout_is_recorded():
+    """
+    Tests that every checkout is counted and shows up as checked out while held.
+    """
+    before = get_pool_metrics(engine.pool)["checkouts"]
+    with engine.connect():
+        assert get_pool_metrics(engine.pool)["checked_out"] >= 1
+    assert get_pool_metrics(engine.pool)["checkouts"] == before + 1
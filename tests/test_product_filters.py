@@ -0,0 +1,122 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from main import app
+from sqlalchemy.dialects import mysql
+from database import engine, build_products_query, name_prefix_condition
+from pagination import encode_cursor
+
+# Create a test client
+client = TestClient(app)
+
+PRICES = {9301: 10.0, 9302: 30.0, 9303: 20.0, 9304: 20.0, 9305: 5.0}
+
+@pytest.fixture(scope="module", autouse=True)
+def seed_products(auth_headers):
+    """
+    Seeds a category with products at several prices, one of them out of stock.
+    """
+    client.post("/categories", json={"id": 9300, "name": "Filter Category"}, headers=auth_headers)
+    for product_id, price in PRICES.items():
+        product_data = {"id": product_id, "name": f"Filter{product_id}", "category_id": 9300, "sku": f"FILTER-{product_id}",
+                        "price": price, "quantity": 0 if product_id == 9305 else 3}
+        client.post("/products", json=product_data, headers=auth_headers)
+    client.post("/products", json={"id": 9306, "name": "100%_Pure", "category_id": 9300, "sku": "FILTER-9306", "price": 1.0, "quantity": 1}, headers=auth_headers)
+    yield
+    for product_id in list(PRICES) + [9306]:
+        client.delete(f"/products/{product_id}", headers=auth_headers)
+    client.delete("/categories/9300", headers=auth_headers)
+
+def list_ids(**params):
+    response = client.get("/products", params={"category_id": 9300, **params})
+    assert response.status_code == 200
+    return [product["id"] for product in response.json()]
+
+# Test case for price, stock and name filters
+def test_filters():
+    """
+    Tests the category, price range, stock and name prefix filters.
+    """
+    assert list_ids(min_price=10, max_price=20) == [9301, 9303, 9304]
+    assert list_ids(in_stock=False) == [9305]
+    assert list_ids(name_prefix="Filter930") == [9301, 9302, 9303, 9304, 9305]
+    assert list_ids(name_prefix="100%_") == [9306]
+    assert list_ids(name_prefix="100__") == []
+
+# Test case for the name prefix condition on MySQL
+def test_name_prefix_on_mysql():
+    """
+    Tests that MySQL gets an escaped LIKE, since a computed upper bound can miss names under its collation.
+    """
+    condition = name_prefix_condition("Galaxy S9_", dialect_name="mysql")
+    sql = str(condition.compile(dialect=mysql.dialect(), compile_kwargs={"literal_binds": True}))
+    assert "LIKE" in sql and "<" not in sql
+    assert "S9/_" in sql
+
+# Test case for sorting
+def test_sorting():
+    """
+    Tests ascending and descending sorts, with ties broken by id.
+    """
+    assert list_ids(sort="price") == [9306, 9305, 9301, 9303, 9304, 9302]
+    assert list_ids(sort="-price") == [9302, 9304, 9303, 9301, 9305, 9306]
+    assert list_ids(sort="-id")[:2] == [9306, 9305]
+
+# Test case for keyset pagination over a sorted listing
+@pytest.mark.parametrize("sort", ["price", "-price", "name", "-id"])
+def test_sorted_cursor_pagination(sort):
+    """
+    Tests that walking a sorted listing with cursors visits every row once, in order.
+    """
+    expected = list_ids(sort=sort)
+    seen = []
+    params = {"category_id": 9300, "sort": sort, "limit": 2}
+    while True:
+        response = client.get("/products", params=params)
+        seen += [product["id"] for product in response.json()]
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["after"] = response.headers["X-Next-Cursor"]
+    assert seen == expected
+
+# Test case for reusing a cursor with another sort order
+def test_cursor_sort_mismatch():
+    """
+    Tests that a cursor cannot be replayed against a different sort order.
+    """
+    response = client.get("/products", params={"category_id": 9300, "sort": "price", "limit": 1})
+    cursor = response.headers["X-Next-Cursor"]
+    response = client.get("/products", params={"category_id": 9300, "sort": "name", "after": cursor})
+    assert response.status_code == 400
+
+# Test case for cursors with a forged sort key
+@pytest.mark.parametrize("sort, key", [("price", {"a": 1}), ("price", "10"), ("name", [1]), ("name", None), ("-price", True)])
+def test_cursor_with_invalid_key(sort, key):
+    """
+    Tests that a cursor whose sort key does not fit the sort column is rejected with 400.
+    """
+    response = client.get("/products", params={"category_id": 9300, "sort": sort, "after": encode_cursor(id=9301, s=sort, k=key)})
+    assert response.status_code == 400
+
+def query_plan(**filters):
+    statement = build_products_query(**filters).compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as connection:
+        return " ".join(row[-1] for row in connection.execute(text(f"EXPLAIN QUERY PLAN {statement}")))
+
+# Test case for the listing queries using the composite indexes
+@pytest.mark.skipif(engine.url.get_backend_name() != "sqlite", reason="Checks SQLite query plans")
+@pytest.mark.parametrize("filters, index", [
+    ({"category_id": 1}, "ix_products_category_id_id"),
+    ({"category_id": 1, "sort": "price"}, "ix_products_category_id_price"),
+    ({"category_id": 1, "min_price": 5, "max_price": 50, "sort": "price"}, "ix_products_category_id_price"),
+    ({"min_price": 5, "sort": "price", "after_id": 10, "after_key": 5.0}, "ix_products_price_id"),
+    ({"name_prefix": "Game", "sort": "name"}, "ix_products_name"),
+    ({"name_prefix": "Game", "after_id": 10}, "ix_products_name"),
+])
+def test_listing_uses_index(filters, index):
+    """
+    Tests with EXPLAIN QUERY PLAN that filtered listings search an index instead of scanning the table.
+    """
+    plan = query_plan(**filters)
+    assert index in plan
+    assert "SCAN products" not in plan
@@ -0,0 +1,128 @@
+import time
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+from main import app
+from database import SessionLocal, Base, Category, Product
+from cache import catalog_cache, product_key, ChangeFollower, MemoryBackend, NullBackend, LAST_WRITE_KEY
+from config import db_settings, metrics_settings
+import metrics
+import replicas
+from replicas import ReplicaSet, STICKY_COOKIE
+
+# The async application reads from the primary only
+pytestmark = pytest.mark.skipif(db_settings.use_async, reason="replicas are used by the sync application only")
+
+@pytest.fixture
+def replica_set(tmp_path, monkeypatch, auth_headers):
+    """
+    Seeds a product on the primary and a stale copy of it on a SQLite replica, and routes reads to the replica.
+    """
+    client = TestClient(app)
+    client.post("/categories", json={"id": 8300, "name": "Replica Category"}, headers=auth_headers)
+    product_data = {"id": 8301, "name": "Primary copy", "category_id": 8300, "sku": "REPLICA-8301", "price": 2.0, "quantity": 1}
+    client.post("/products", json=product_data, headers=auth_headers)
+
+    replica_set = ReplicaSet([f"sqlite:///{tmp_path / 'replica.db'}"], sticky_seconds=60, eject_seconds=60)
+    replica = replica_set.replicas[0].engine
+    Base.metadata.create_all(replica)
+    with Session(replica) as db:
+        db.add(Category(id=8300, name="Replica Category"))
+        db.add(Product(**{**product_data, "name": "Replica copy"}))
+        db.commit()
+    # Cached rows would hide where a read was served from
+    monkeypatch.setattr(catalog_cache, "backend", NullBackend())
+    monkeypatch.setattr(replicas, "replica_set", replica_set)
+    yield replica_set
+    monkeypatch.setattr(replicas, "replica_set", None)
+    client.delete("/products/8301", headers=auth_headers)
+    client.delete("/categories/8300", headers=auth_headers)
+    replica_set.dispose()
+
+def product_name(client) -> str:
+    return client.get("/products/8301").json()["name"]
+
+# Test case for reads going to the replica
+def test_reads_use_replica(replica_set):
+    """
+    Tests that GET handlers read from the replica and writes stay on the primary.
+    """
+    client = TestClient(app)
+    assert product_name(client) == "Replica copy"
+    assert [product["name"] for product in client.get("/products", params={"category_id": 8300}).json()] == ["Replica copy"]
+    assert client.get("/products:batch", params={"ids": "8301"}).json()["products"][0]["name"] == "Replica copy"
+
+# Test case for reading your own writes
+def test_read_your_writes(replica_set, auth_headers):
+    """
+    Tests that a client that has written reads from the primary, and that other clients keep reading from the replica.
+    """
+    writer, reader = TestClient(app), TestClient(app)
+    response = writer.patch("/products/8301", json={"quantity": 5}, headers=auth_headers)
+    assert response.status_code == 200
+    assert STICKY_COOKIE in response.cookies
+    assert product_name(writer) == "Primary copy"
+    assert product_name(reader) == "Replica copy"
+    assert writer.get("/products/9999999").status_code == 404
+    assert STICKY_COOKIE not in TestClient(app).get("/products/8301").cookies
+
+# Test case for a write made by another worker
+@pytest.mark.parametrize("shared", [True, False])
+def test_other_workers_writes(replica_set, auth_headers, monkeypatch, shared):
+    """
+    Tests that replica reads right after another worker's write are not cached, and that the writer never reads a cached copy.
+    This worker's cache is either shared with the writing worker (Redis) or learns of the write through the change feed.
+    """
+    worker_cache = MemoryBackend()
+    follower = ChangeFollower(catalog_cache)
+    db = SessionLocal()
+    try:
+        follower.start(db)
+        writer, reader = TestClient(app), TestClient(app)
+        # The other worker's write invalidates its own cache, which is this worker's too when shared
+        monkeypatch.setattr(catalog_cache, "backend", worker_cache if shared else MemoryBackend())
+        assert writer.patch("/products/8301", json={"quantity": 5}, headers=auth_headers).status_code == 200
+        monkeypatch.setattr(catalog_cache, "backend", worker_cache)
+        if not shared:
+            follower.catch_up(db)
+
+        assert product_name(reader) == "Replica copy"
+        assert catalog_cache.peek(product_key(8301)) is None
+        # Once the replicas have had time to catch up, replica reads are cached again
+        worker_cache.set(LAST_WRITE_KEY, time.time() - replica_set.sticky_seconds, 60)
+        assert product_name(reader) == "Replica copy"
+        assert catalog_cache.peek(product_key(8301))["name"] == "Replica copy"
+        assert product_name(writer) == "Primary copy"
+    finally:
+        db.close()
+
+# Test case for replica metrics
+def test_replica_metrics(replica_set):
+    """
+    Tests that statements run on a replica are recorded like those on the primary.
+    """
+    if not metrics_settings.enabled:
+        pytest.skip("metrics are disabled")
+    def recorded_queries():
+        return metrics.REQUEST_QUERIES.series.get(("GET", "/products/{product_id}"), [[0], 0.0])[1]
+
+    before = recorded_queries()
+    assert product_name(TestClient(app)) == "Replica copy"
+    assert recorded_queries() >= before + 1
+
+# Test case for ejecting a replica that cannot be reached
+def test_replica_ejection(replica_set, tmp_path):
+    """
+    Tests that an unreachable replica is skipped, reads fall through to a healthy one, and it is retried later.
+    """
+    broken = ReplicaSet([f"sqlite:///{tmp_path / 'missing' / 'replica.db'}"]).replicas[0]
+    replica_set.replicas.insert(0, broken)
+    client = TestClient(app)
+    assert {product_name(client) for _ in range(4)} == {"Replica copy"}
+    assert broken.ejected_until > time.monotonic()
+
+    replica_set.replicas.remove(replica_set.replicas[1])
+    assert product_name(client) == "Primary copy"
+    broken.ejected_until = 0.0
+    assert product_name(client) == "Primary copy"
+    assert broken.ejected_until > time.monotonic()
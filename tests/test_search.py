@@ -0,0 +1,150 @@
+import pytest
+from fastapi.testclient import TestClient
+from main import app
+from sqlalchemy import delete, insert
+from database import engine, Product
+from change_log import record_changes
+from search import ProductSearchIndex, TermIndex, within_one_edit
+
+# Create a test client
+client = TestClient(app)
+
+@pytest.fixture()
+def index():
+    """
+    Builds a small standalone search index.
+    """
+    index = ProductSearchIndex()
+    index.built = True
+    index.put_category(1, "Games")
+    index.put_category(2, "TVs and Accessories")
+    index.put_product(1, "Pong", "A0001", 1)
+    index.put_product(2, "GameStation 5", "A0002", 1)
+    index.put_product(3, "Fony UHD HDR 55\" 4k TV", "A0004", 2)
+    index.put_product(4, "Station Wagon Remote", "B0100", 2)
+    return index
+
+# Test case for the edit distance check
+@pytest.mark.parametrize("a, b, expected", [
+    ("station", "station", True),
+    ("station", "staton", True),
+    ("station", "stations", True),
+    ("station", "statoin", True),
+    ("station", "stetion", True),
+    ("station", "sttaoin", False),
+    ("station", "stat", False),
+])
+def test_within_one_edit(a, b, expected):
+    """
+    Tests detection of terms one typo apart.
+    """
+    assert within_one_edit(a, b) is expected
+
+# Test case for exact, prefix and typo-tolerant matches
+@pytest.mark.parametrize("query, expected", [
+    ("pong", [1]),
+    ("gamestat", [2]),
+    ("gamestaton", [2]),
+    ("a0004", [3]),
+    ("fony tv", [3]),
+    ("games", [1, 2]),
+])
+def test_search_matches(index, query, expected):
+    """
+    Tests that names, skus and category names are matched, allowing prefixes and one typo.
+    """
+    product_ids, total = index.search(query)
+    assert sorted(product_ids) == expected
+    assert total == len(expected)
+
+# Test case for ranking
+def test_search_ranking(index):
+    """
+    Tests that exact name matches rank above prefix matches, and name matches above category matches.
+    """
+    index.put_product(5, "Stationary Bike", "C0001", 2)
+    index.put_product(6, "Games Console", "C0002", 1)
+    assert index.search("station")[0] == [4, 5]
+    assert index.search("games")[0][0] == 6
+
+# Test case for incremental updates
+def test_search_incremental_updates(index):
+    """
+    Tests that renamed, recategorised and removed products are reflected immediately.
+    """
+    index.put_product(1, "Pong Deluxe", "A0001", 2)
+    assert index.search("deluxe")[0] == [1]
+    assert 1 not in index.search("games")[0]
+    index.remove_product(1)
+    assert index.search("pong") == ([], 0)
+    index.put_category(2, "Television")
+    assert sorted(index.search("television")[0]) == [3, 4]
+
+# Test case for loading an index in bulk
+def test_bulk_loaded_terms():
+    """
+    Tests that terms loaded in bulk are sorted once at the end, and kept sorted by later additions and removals.
+    """
+    terms = TermIndex(fuzzy=False, ordered=False)
+    for doc_id, term in enumerate(["b0100", "a0004", "a0001", "c0002", "a0001"]):
+        terms.add(term, doc_id)
+    assert terms.terms == []
+    terms.sort_terms()
+    assert terms.terms == ["a0001", "a0004", "b0100", "c0002"]
+    terms.add("a0002", 5)
+    terms.remove("b0100", 0)
+    assert terms.terms == ["a0001", "a0002", "a0004", "c0002"]
+    assert list(terms.prefixed("a000")) == ["a0001", "a0002", "a0004"]
+
+# Test case for the search endpoint following commits
+def test_search_endpoint_tracks_commits(auth_headers):
+    """
+    Tests that creates, updates and deletes committed through the API are searchable right away.
+    """
+    client.post("/categories", json={"id": 9400, "name": "Quasar Gadgets"}, headers=auth_headers)
+    product_data = {"id": 9401, "name": "Zephyr Blender", "category_id": 9400, "sku": "ZEPH-1", "price": 49.0, "quantity": 2}
+    assert client.get("/products/search", params={"q": "zephyr"}).json()["total"] == 0
+    client.post("/products", json=product_data, headers=auth_headers)
+
+    body = client.get("/products/search", params={"q": "zephir blend"}).json()
+    assert [product["sku"] for product in body["products"]] == ["ZEPH-1"]
+    assert client.get("/products/search", params={"q": "quasar"}).json()["total"] == 1
+
+    product_data["name"] = "Nimbus Blender"
+    client.put("/products/9401", json=product_data, headers=auth_headers)
+    assert client.get("/products/search", params={"q": "zephyr"}).json()["total"] == 0
+    assert client.get("/products/search", params={"q": "nimbus"}).json()["total"] == 1
+
+    client.delete("/products/9401", headers=auth_headers)
+    client.delete("/categories/9400", headers=auth_headers)
+    assert client.get("/products/search", params={"q": "nimbus"}).json()["total"] == 0
+
+# Test case for imported products being searchable
+def test_search_finds_bulk_imported_products(auth_headers):
+    """
+    Tests that rows written by the bulk importer are added to the index.
+    """
+    client.get("/products/search", params={"q": "warmup"})
+    ndjson = b'{"name": "Obsidian Kettle", "category": "Kitchen", "sku": "OBS-1", "price": 20, "quantity": 1}\n'
+    client.post("/products/import", files={"file": ("kettle.ndjson", ndjson)}, headers=auth_headers)
+    body = client.get("/products/search", params={"q": "obsidian"}).json()
+    assert [product["sku"] for product in body["products"]] == ["OBS-1"]
+
+# Test case for writes made outside this process
+def test_search_follows_change_feed(auth_headers):
+    """
+    Tests that writes the index was never told about, as from another worker, are picked up from the change feed.
+    """
+    client.get("/products/search", params={"q": "warmup"})
+    client.post("/categories", json={"id": 9410, "name": "Feed Category"}, headers=auth_headers)
+    # A plain connection bypasses the session hooks that update this process's index
+    with engine.begin() as connection:
+        connection.execute(insert(Product).values(id=9411, name="Quokka Lamp", category_id=9410, sku="QUOKKA-1", price=5.0, quantity=1))
+        record_changes(connection, "product", [9411], "insert")
+    assert [product["sku"] for product in client.get("/products/search", params={"q": "quokka"}).json()["products"]] == ["QUOKKA-1"]
+
+    with engine.begin() as connection:
+        connection.execute(delete(Product).where(Product.id == 9411))
+        record_changes(connection, "product", [9411], "delete")
+    assert client.get("/products/search", params={"q": "quokka"}).json()["total"] == 0
+    client.delete("/categories/9410", headers=auth_headers)
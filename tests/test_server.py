@@ -0,0 +1,80 @@
+import os
+from argparse import Namespace
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from main import app
+from config import DatabaseSettings, db_settings, server_settings, env_int, env_bool
+from database import engine
+from serve import server_options, connection_budget
+
+def serving_pool():
+    if db_settings.use_async:
+        from async_database import async_engine
+        return async_engine.sync_engine.pool
+    return engine.pool
+
+# Test case for reading settings from the environment
+def test_env_settings(monkeypatch):
+    """
+    Tests that empty variables fall back to the default, bad ones name themselves, and unrelated variables are ignored.
+    """
+    monkeypatch.setenv("TEST_DB_PORT", "")
+    assert env_int("TEST_DB_PORT", 3306) == 3306
+    monkeypatch.setenv("TEST_DB_PORT", "abc")
+    with pytest.raises(ValueError, match="TEST_DB_PORT"):
+        env_int("TEST_DB_PORT", 3306)
+    monkeypatch.setenv("METRICS_ENABLED", " ")
+    assert env_bool("METRICS_ENABLED", True) is True
+
+    monkeypatch.setenv("USER", "someone-else")
+    monkeypatch.setenv("PORT", "not-a-port")
+    settings = DatabaseSettings()
+    assert (settings.user, settings.port) == (db_settings.user, db_settings.port)
+
+# Test case for worker startup and shutdown
+def test_lifespan():
+    """
+    Tests that a worker opens its warm connections before serving and closes its pool on shutdown.
+    """
+    with TestClient(app) as client:
+        assert serving_pool().checkedin() >= min(server_settings.warm_connections, db_settings.pool_size)
+        response = client.get("/health")
+        assert response.status_code == 200
+        assert response.json() == {"status": "ok", "worker": os.getpid()}
+    assert serving_pool().checkedin() == 0
+
+# Test case for connections crossing a fork
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_fork_starts_with_empty_pool():
+    """
+    Tests that a forked worker does not inherit the parent's pooled connections and can open its own.
+    """
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+    assert engine.pool.checkedin() >= 1
+    pid = os.fork()
+    if pid == 0:
+        try:
+            empty = engine.pool.checkedin() == 0
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            os._exit(0 if empty else 1)
+        except BaseException:
+            os._exit(2)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert engine.pool.checkedin() >= 1
+
+# Test case for the production server options
+def test_server_options():
+    """
+    Tests the worker count default and the options handed to the process manager.
+    """
+    args = Namespace(host="0.0.0.0", port=8000, workers=0, graceful_timeout=30, access_log=False)
+    options = server_options(args)
+    assert options["workers"] == (os.cpu_count() or 1)
+    assert (options["app"], options["lifespan"], options["timeout_graceful_shutdown"]) == ("main:app", "on", 30)
+    assert server_options(Namespace(**{**vars(args), "workers": 3}))["workers"] == 3
+    budget = connection_budget(3)
+    assert budget["max_connections"] == 3 * (db_settings.pool_size + db_settings.max_overflow)
@@ -0,0 +1,98 @@
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from fastapi.testclient import TestClient
+from main import app
+from database import SessionLocal
+from stock import apply_stock_changes, StockUnavailable
+
+# Create a test client
+client = TestClient(app)
+
+STOCK = {9951: 10, 9952: 5, 9953: 20}
+
+@pytest.fixture(autouse=True)
+def seed_products(auth_headers):
+    """
+    Seeds products with known stock levels for every test.
+    """
+    client.post("/categories", json={"id": 9950, "name": "Stock Category"}, headers=auth_headers)
+    for product_id, quantity in STOCK.items():
+        product_data = {"id": product_id, "name": f"Stocked {product_id}", "category_id": 9950, "sku": f"STOCK-{product_id}",
+                        "price": 9.0, "quantity": quantity}
+        client.post("/products", json=product_data, headers=auth_headers)
+    yield
+    for product_id in STOCK:
+        client.delete(f"/products/{product_id}", headers=auth_headers)
+    client.delete("/categories/9950", headers=auth_headers)
+
+def quantity_of(product_id: int) -> int:
+    return client.get(f"/products/{product_id}").json()["quantity"]
+
+# Test case for reserving, releasing and adjusting stock
+def test_stock_changes(auth_headers):
+    """
+    Tests that each action applies its delta and that reads see the new quantity.
+    """
+    assert quantity_of(9951) == 10
+    response = client.post("/products/9951/stock", json={"action": "reserve", "quantity": 3}, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()["quantity"] == 7
+    assert quantity_of(9951) == 7
+
+    assert client.post("/products/9951/stock", json={"action": "release", "quantity": 2}, headers=auth_headers).json()["quantity"] == 9
+    assert client.post("/products/9951/stock", json={"action": "adjust", "quantity": -4}, headers=auth_headers).json()["quantity"] == 5
+    assert client.post("/products/9951/stock", json={"action": "adjust", "quantity": 6}, headers=auth_headers).json()["quantity"] == 11
+
+# Test case for changes that cannot be applied
+def test_stock_rejections(auth_headers):
+    """
+    Tests that overselling is a 409 that changes nothing, and that unknown products and invalid quantities are rejected.
+    """
+    response = client.post("/products/9952/stock", json={"action": "reserve", "quantity": 6}, headers=auth_headers)
+    assert response.status_code == 409
+    assert quantity_of(9952) == 5
+    assert client.post("/products/9952/stock", json={"action": "adjust", "quantity": -6}, headers=auth_headers).status_code == 409
+    assert client.post("/products/9999999/stock", json={"action": "reserve", "quantity": 1}, headers=auth_headers).status_code == 404
+    assert client.post("/products/9952/stock", json={"action": "reserve", "quantity": -1}, headers=auth_headers).status_code == 422
+    assert client.post("/products/9952/stock", json={"action": "adjust", "quantity": 0}, headers=auth_headers).status_code == 422
+    assert client.post("/products/9952/stock", json={"action": "adjust", "quantity": 1e20}, headers=auth_headers).status_code == 422
+    assert client.post("/products/9952/stock", json={"action": "adjust", "quantity": 2 ** 31 - 1}, headers=auth_headers).status_code == 409
+    assert quantity_of(9952) == 5
+    assert client.post("/products/9952/stock", json={"action": "reserve", "quantity": 1}).status_code == 401
+
+# Test case for multi-line orders
+def test_stock_batch(auth_headers):
+    """
+    Tests that a batch is applied as a whole, or not at all when one line cannot be met.
+    """
+    items = [{"product_id": 9951, "action": "reserve", "quantity": 2}, {"product_id": 9953, "action": "reserve", "quantity": 5},
+             {"product_id": 9951, "action": "reserve", "quantity": 1}]
+    response = client.post("/products/stock:batch", json={"items": items}, headers=auth_headers)
+    assert response.status_code == 200
+    assert [(row["id"], row["quantity"]) for row in response.json()["products"]] == [(9951, 7), (9953, 15)]
+
+    items = [{"product_id": 9953, "action": "reserve", "quantity": 1}, {"product_id": 9952, "action": "reserve", "quantity": 50}]
+    response = client.post("/products/stock:batch", json={"items": items}, headers=auth_headers)
+    assert response.status_code == 409
+    assert "9952" in response.json()["detail"]
+    assert quantity_of(9953) == 15
+
+# Test case for concurrent reservations on one product
+def test_concurrent_reservations():
+    """
+    Tests that concurrent reservations never oversell or lose updates.
+    """
+    def reserve(_):
+        db = SessionLocal()
+        try:
+            apply_stock_changes(db, {9952: -1})
+            return True
+        except StockUnavailable:
+            return False
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(reserve, range(20)))
+    assert results.count(True) == 5
+    assert quantity_of(9952) == 0
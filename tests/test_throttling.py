@@ -0,0 +1,189 @@
+import asyncio
+import time
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from main import app
+from cache import catalog_cache, NullBackend
+from config import db_settings, metrics_settings, TrafficSettings
+from database import engine
+from auth import create_access_token
+from metrics import MetricsMiddleware
+from replicas import ReadYourWritesMiddleware
+import main
+import metrics
+from throttling import SingleFlightMiddleware, RateLimitMiddleware, TokenBuckets, install
+
+@pytest.fixture
+def product(auth_headers):
+    """
+    Creates a product to read, with the read cache disabled so every handler run reaches the database.
+    """
+    client = TestClient(app)
+    client.post("/categories", json={"id": 8400, "name": "Coalesced Category"}, headers=auth_headers)
+    client.post("/products", json={"id": 8401, "name": "Viral product", "category_id": 8400, "sku": "VIRAL-8401", "price": 3.0, "quantity": 1},
+                headers=auth_headers)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(catalog_cache, "backend", NullBackend())
+        yield 8401
+    client.delete("/products/8401", headers=auth_headers)
+    client.delete("/categories/8400", headers=auth_headers)
+
+# Makes the product handler slow enough for concurrent requests to overlap, recording each lookup
+def slow_product_lookups(monkeypatch, loads):
+    if db_settings.use_async:
+        import async_main
+        get_product_by_id = async_main.get_product_by_id
+        async def slow_get_product_by_id(db, product_id, **kwargs):
+            loads.append(product_id)
+            await asyncio.sleep(0.2)
+            return await get_product_by_id(db, product_id, **kwargs)
+        monkeypatch.setattr(async_main, "get_product_by_id", slow_get_product_by_id)
+        return
+    get_product_by_id = main.get_product_by_id
+    def slow_get_product_by_id(db, product_id, **kwargs):
+        loads.append(product_id)
+        time.sleep(0.2)
+        return get_product_by_id(db, product_id, **kwargs)
+    monkeypatch.setattr(main, "get_product_by_id", slow_get_product_by_id)
+
+def coalescing_middleware():
+    middleware = app.middleware_stack
+    while not isinstance(middleware, SingleFlightMiddleware):
+        middleware = middleware.app
+    return middleware
+
+# Test case for coalescing concurrent reads of one product
+def test_concurrent_reads_share_one_query(product, monkeypatch):
+    """
+    Tests that concurrent identical GET /products/{product_id} requests run the handler once and all get its response.
+    """
+    loads = []
+    slow_product_lookups(monkeypatch, loads)
+    TestClient(app).get("/health")
+    coalesced = coalescing_middleware().coalesced
+    served = metrics.REQUESTS.values[("GET", "/products/{product_id}", 200)]
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await asyncio.gather(*[client.get(f"/products/{product}") for _ in range(10)])
+    responses = asyncio.run(run())
+    assert loads == [product]
+    assert {response.status_code for response in responses} == {200}
+    assert {response.json()["name"] for response in responses} == {"Viral product"}
+    assert len({response.headers["etag"] for response in responses}) == 1
+    assert coalescing_middleware().coalesced == coalesced + 9
+    if metrics_settings.enabled:
+        assert metrics.REQUESTS.values[("GET", "/products/{product_id}", 200)] == served + 10
+
+    # Requests that finish apart from each other are not coalesced, and neither are ones that differ
+    TestClient(app).get(f"/products/{product}")
+    TestClient(app).get(f"/products/{product}", params={"include": "category"})
+    assert loads == [product] * 3
+
+# Test case for a failing leader
+def test_failed_request_is_not_shared():
+    """
+    Tests that callers waiting on a request that fails handle their own request instead of receiving nothing.
+    """
+    calls = []
+
+    async def flaky(scope, receive, send):
+        calls.append(scope["path"])
+        await asyncio.sleep(0.05)
+        if len(calls) == 1:
+            raise RuntimeError("database went away")
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    middleware = SingleFlightMiddleware(flaky)
+
+    async def request():
+        sent = []
+        async def send(message):
+            sent.append(message)
+        scope = {"type": "http", "method": "GET", "path": "/products/1", "query_string": b"", "headers": []}
+        try:
+            await middleware(scope, None, send)
+        except RuntimeError:
+            return None
+        return sent[-1]["body"]
+
+    async def run():
+        return await asyncio.gather(*[request() for _ in range(3)])
+    results = asyncio.run(run())
+    assert results.count(None) == 1
+    assert results.count(b"ok") == 2
+    assert middleware.flights == {}
+
+# Test case for refilling token buckets
+def test_token_buckets():
+    """
+    Tests that a client may spend its burst, is then refilled at the configured rate, and that buckets are bounded.
+    """
+    buckets = TokenBuckets(rate=2, burst=3, max_clients=2)
+    assert [buckets.take("a", 0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert buckets.take("a", 0.0) == pytest.approx(0.5)
+    assert buckets.take("a", 0.5) == 0.0
+    assert buckets.take("b", 0.5) == 0.0
+    assert buckets.take("a", 10.0) == 0.0
+    assert [buckets.take("a", 10.0) for _ in range(3)][-1] > 0
+    buckets.take("c", 10.0)
+    assert list(buckets.buckets) == ["a", "c"]
+
+# Test case for limiting writes per client
+def test_write_rate_limit():
+    """
+    Tests that writes beyond the burst get 429 with Retry-After, per token, and that reads are never limited.
+    """
+    limited = FastAPI()
+    limited.add_middleware(RateLimitMiddleware, rate=0.1, burst=2)
+    limited.add_api_route("/items", lambda: {"ok": True}, methods=["GET", "POST", "DELETE"])
+    client = TestClient(limited)
+
+    assert [client.post("/items").status_code for _ in range(2)] == [200, 200]
+    response = client.delete("/items")
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "10"
+    assert response.json() == {"detail": "Too many write requests"}
+    assert client.get("/items").status_code == 200
+    # Made-up tokens share the bucket of the address they are sent from
+    assert client.post("/items", headers={"Authorization": "Bearer made-up"}).status_code == 429
+    # A user is a client of its own, separate from the address it connects from, whichever of its tokens it sends
+    first = create_access_token({"sub": "writer", "user_id": 8402})
+    second = create_access_token({"sub": "writer", "user_id": 8402, "device": "second"})
+    assert client.post("/items", headers={"Authorization": f"Bearer {first}"}).status_code == 200
+    assert client.post("/items", headers={"Authorization": f"Bearer {second}"}).status_code == 200
+    assert client.post("/items", headers={"Authorization": f"Bearer {first}"}).status_code == 429
+
+# Test case for rate limiting settings
+def test_rate_limit_settings():
+    """
+    Tests that a rate limit that could never refill a bucket is refused when the middleware is installed.
+    """
+    settings = TrafficSettings(rate_limit_enabled=True, rate_limit_per_second=0)
+    with pytest.raises(ValueError, match="RATE_LIMIT_WRITES_PER_SECOND"):
+        install(FastAPI(), settings)
+
+# Test case for metrics seeing throttled requests
+def test_metrics_record_throttled_requests():
+    """
+    Tests that metrics wrap the traffic middleware, so coalesced reads and rejected writes are recorded.
+    """
+    if not metrics_settings.enabled:
+        pytest.skip("metrics are disabled")
+    TestClient(app).get("/health")
+    middleware = app.middleware_stack
+    while not isinstance(middleware, (MetricsMiddleware, SingleFlightMiddleware, RateLimitMiddleware, ReadYourWritesMiddleware)):
+        middleware = middleware.app
+    assert isinstance(middleware, MetricsMiddleware)
+
+    limited = FastAPI()
+    install(limited, TrafficSettings(rate_limit_enabled=True, rate_limit_per_second=0.1, rate_limit_burst=1))
+    metrics.install(limited, engine)
+    limited.add_api_route("/items", lambda: {"ok": True}, methods=["POST"])
+    client = TestClient(limited)
+    rejected = metrics.REQUESTS.values[("POST", "/items", 429)]
+    assert [client.post("/items").status_code for _ in range(2)] == [200, 429]
+    assert metrics.REQUESTS.values[("POST", "/items", 429)] == rejected + 1
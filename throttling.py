@@ -0,0 +1,164 @@
+import asyncio
+import math
+import re
+import time
+from collections import OrderedDict
+from fastapi import Request
+from starlette.routing import Match
+from serialization import dumps
+from config import traffic_settings
+from replicas import reads_own_writes
+from auth import decode_token
+
+# Traffic shaping in front of the handlers, per worker process.
+# Single-flight coalescing: while a GET /products/{product_id} is being handled, identical
+# requests arriving for the same product wait for it and are sent a copy of its response,
+# so a spike on one product costs one handler run, one threadpool slot and one database
+# connection instead of one per request. Waiting happens on the event loop.
+# Rate limiting: every client gets a token bucket for writes (POST, PUT, PATCH, DELETE),
+# keyed by the user of its bearer token, or by its address when it sends no valid token
+# (so made-up tokens share their sender's bucket); a client that has spent its burst
+# gets 429 with Retry-After before its request reaches the handler.
+# Both are plain ASGI middleware and are only installed when enabled.
+
+COALESCED_PATHS = r"/products/\d+"
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+# Headers that change what a GET responds with; requests only share a response when these match
+VARYING_HEADERS = (b"accept", b"accept-encoding", b"if-none-match", b"if-modified-since")
+
+def header_values(scope, names: tuple) -> tuple:
+    headers = dict(scope["headers"])
+    return tuple(headers.get(name) for name in names)
+
+def flight_key(scope) -> tuple:
+    # A client reading its own writes goes to the primary and must not share a replica read
+    return scope["path"], scope["query_string"], header_values(scope, VARYING_HEADERS), reads_own_writes(Request(scope))
+
+def is_complete(messages: list) -> bool:
+    return bool(messages) and messages[0]["type"] == "http.response.start" and messages[-1]["type"] == "http.response.body" \
+        and not messages[-1].get("more_body", False)
+
+def is_shareable(messages: list) -> bool:
+    return is_complete(messages) and all(name.lower() != b"set-cookie" for name, _ in messages[0].get("headers", ()))
+
+# Responses sent here never reach the router; name the route they were for so that metrics
+# record them under its template rather than as unmatched
+def resolve_route(scope):
+    router = getattr(scope.get("app"), "router", None)
+    for route in getattr(router, "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            scope["route"] = route
+            return
+
+class SingleFlightMiddleware:
+    """Runs concurrent identical GET requests once and replays the response to every caller"""
+
+    def __init__(self, app, paths: str = COALESCED_PATHS):
+        self.app = app
+        self.paths = re.compile(paths)
+        # In-flight requests by key; only touched from the event loop thread, so no lock is needed
+        self.flights = {}
+        self.coalesced = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET" or not self.paths.fullmatch(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        key = flight_key(scope)
+        flight = self.flights.get(key)
+        if flight is not None:
+            # Shielded so that a caller that disconnects does not cancel the response for the others
+            messages = await asyncio.shield(flight)
+            if messages is not None:
+                self.coalesced += 1
+                resolve_route(scope)
+                for message in messages:
+                    await send(message)
+                return
+            # The request being waited for failed; handle this one on its own
+            await self.app(scope, receive, send)
+            return
+
+        flight = self.flights[key] = asyncio.get_running_loop().create_future()
+        messages = []
+
+        async def send_and_record(message):
+            messages.append(message)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            del self.flights[key]
+            flight.set_result(messages if is_shareable(messages) else None)
+
+class TokenBuckets:
+    """Token buckets by client key, refilled at `rate` tokens per second up to `burst`"""
+
+    def __init__(self, rate: float, burst: int, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        # key -> (tokens, time of the last refill), least recently seen first
+        self.buckets = OrderedDict()
+
+    # Takes a token for the client; returns 0 when allowed, otherwise the seconds until a token is available
+    def take(self, key: str, now: float) -> float:
+        tokens, updated = self.buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        allowed = tokens >= 1
+        self.buckets[key] = (tokens - 1 if allowed else tokens, now)
+        if len(self.buckets) > self.max_clients:
+            self.buckets.popitem(last=False)
+        return 0.0 if allowed else (1 - tokens) / self.rate
+
+def client_key(scope) -> str:
+    authorization = header_values(scope, (b"authorization",))[0] or b""
+    scheme, _, token = authorization.partition(b" ")
+    # Only the signature is checked: a revoked token still names the user it was issued to
+    payload = decode_token(token.decode("latin-1")) if scheme.lower() == b"bearer" and token else None
+    if payload and payload.get("user_id"):
+        return f"user:{payload['user_id']}"
+    client = scope.get("client")
+    return f"client:{client[0] if client else 'unknown'}"
+
+class RateLimitMiddleware:
+    """Rejects writes from clients that have used up their token bucket with 429"""
+
+    def __init__(self, app, rate: float = traffic_settings.rate_limit_per_second, burst: int = traffic_settings.rate_limit_burst,
+                 max_clients: int = traffic_settings.rate_limit_max_clients):
+        self.app = app
+        # Only touched from the event loop thread, so no lock is needed
+        self.buckets = TokenBuckets(rate, burst, max_clients)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in WRITE_METHODS:
+            await self.app(scope, receive, send)
+            return
+        wait = self.buckets.take(client_key(scope), time.monotonic())
+        if not wait:
+            await self.app(scope, receive, send)
+            return
+        resolve_route(scope)
+        body = dumps({"detail": "Too many write requests"})
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(math.ceil(wait)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+# Add the enabled middleware to an app; rate limiting runs first so rejected writes cost nothing else
+def install(app, settings=traffic_settings):
+    if settings.coalesce_reads:
+        app.add_middleware(SingleFlightMiddleware)
+    if settings.rate_limit_enabled:
+        if settings.rate_limit_per_second <= 0:
+            raise ValueError(f"RATE_LIMIT_WRITES_PER_SECOND must be positive, got {settings.rate_limit_per_second!r}")
+        app.add_middleware(RateLimitMiddleware, rate=settings.rate_limit_per_second, burst=settings.rate_limit_burst,
+                           max_clients=settings.rate_limit_max_clients)